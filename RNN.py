@@ -1,39 +1,34 @@
-import numpy as np
+import argparse
 import tensorflow as tf
-import math
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import SimpleRNN, Dense
+from rnn_numpy import export_weights
+from data_pipeline import WindowDataset
 
 ACCOUNTED_LENGTH = 10
 
-dataset = np.load("dataset.npy")
+parser = argparse.ArgumentParser(description="Train the trajectory prediction RNN")
+parser.add_argument("--data", type=str, default="dataset.npy", help="Recording directory (recorder.py) or (N, 2) positions .npy")
+parser.add_argument("--epochs", type=int, default=200, help="Training epochs")
+parser.add_argument("--batch_size", type=int, default=32, help="Batch size")
+parser.add_argument("--rebuild", action="store_true", help="Rebuild the cached windows of --data")
+args = parser.parse_args()
 
-angles = []
-for i in range(1, len(dataset)):
-    dx = dataset[i][0] - dataset[i-1][0]
-    dy = dataset[i][1] - dataset[i-1][1]
-    angle = math.atan2(dy, dx)
-    angles.append(angle)
-
-
-x, y = [], []
-for i in range(len(angles) - ACCOUNTED_LENGTH):
-    x.append(angles[i: i+ACCOUNTED_LENGTH])
-    y.append(angles[i+ACCOUNTED_LENGTH])
-
-X = np.array(x)
-y = np.array(y)
-
-split_idx = int(0.8 * len(X))
-X_train, X_val = X[:split_idx], X[split_idx:]
-y_train, y_val = y[:split_idx], y[split_idx:]
+# memory-mapped angle windows that never cross a round (see data_pipeline.py)
+dataset = WindowDataset.from_source(args.data, ACCOUNTED_LENGTH, rebuild=args.rebuild)
+train, val = dataset.split(0.8)
+print(f"{len(train)} training / {len(val)} validation windows")
 
 # Build the model
 model = Sequential()
-model.add(SimpleRNN(50, activation='relu', input_shape=(X_train.shape[1], 1)))
+model.add(SimpleRNN(50, activation='relu', input_shape=(ACCOUNTED_LENGTH, 1)))
 model.add(Dense(1))  # Output layer with 1 unit for predicting the next angle
 model.compile(optimizer='adam', loss='mean_squared_error')
 
-model.fit(X_train, y_train, epochs=200, batch_size=32, validation_data=(X_val, y_val))
+model.fit(train.tf_dataset(args.batch_size, shuffle=True), epochs=args.epochs,
+          validation_data=val.tf_dataset(args.batch_size))
+
+model.save("trajectory_model.h5")
 
-model.save("trajectory_model.h5")
\ No newline at end of file
+# keep the weights of the NumPy inference backend in sync (see rnn_numpy.py)
+export_weights("trajectory_model.h5", "trajectory_model.npz")
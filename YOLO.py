@@ -1,5 +1,8 @@
 from ultralytics import YOLO
+import argparse
+import time
 import cv2
+import numpy as np
 
 # Load the YOLO model
 model = YOLO('yolov8n.pt')  
@@ -15,3 +18,82 @@ model = YOLO('yolov8n.pt')
 # cv2.imwrite(output_path, annotated_image)
 
 # print(f"Results saved to {output_path}")
+
+# columns of a packed detection: x1, y1, x2, y2, confidence, class id
+BOX_COLUMNS = 6
+# class id of the padding rows
+NO_CLASS = -1
+
+
+# ultralytics Results (one per frame) -> one (N, K, 6) float32 array plus the
+# number of boxes of every frame, K = most boxes in any frame, the rows after
+# counts[i] are padding (zeros with class id NO_CLASS)
+def pack_results(results):
+    # boxes.data is already (k, 6) = xyxy, conf, cls, one copy per frame instead of a loop per box
+    data = [result.boxes.data.cpu().numpy() for result in results]
+    counts = np.array([len(d) for d in data], dtype=np.int32)
+    boxes = np.zeros((len(data), max(counts.max(initial=0), 1), BOX_COLUMNS), dtype=np.float32)
+    boxes[:, :, 5] = NO_CLASS
+    for i, d in enumerate(data):
+        boxes[i, :len(d)] = d
+    return boxes, counts
+
+
+# one model call for the frames of N scenarios (list of (H, W, 3) BGR arrays,
+# all the same size), returns pack_results()
+def predict_batch(frames, yolo=None):
+    yolo = model if yolo is None else yolo
+    return pack_results(yolo(list(frames), verbose=False))
+
+
+# (xyxys, confidences, class_ids) of frame i of a batch, what Engine.step takes
+def frame_detections(boxes, counts, i):
+    frame = boxes[i, :counts[i]]
+    return frame[:, :4], frame[:, 4], frame[:, 5]
+
+
+if __name__ == "__main__":
+    # per-frame cost of batched inference on frames of independent headless scenarios
+    import pygame
+    from engine import Engine
+    from object import WIDTH, HEIGHT
+    from capture import FrameCapture
+
+    parser = argparse.ArgumentParser(description="Benchmark batched YOLO inference")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Scenarios per model call")
+    parser.add_argument("--steps", type=int, default=10, help="Timed model calls per batch size")
+    parser.add_argument("--capture_scale", type=int, default=1, help="Downscale the frames by this factor")
+    args = parser.parse_args()
+
+    car_image = pygame.image.load("car.jpg")
+    pedestrian_image = pygame.image.load("pedestrian.jpg")
+
+    for batch_size in args.batch_sizes:
+        engines = [Engine("passive", num_pedestrian=1, seed=i, car_image=car_image, pedestrian_image=pedestrian_image)
+                   for i in range(batch_size)]
+        surfaces = [pygame.Surface((WIDTH, HEIGHT), depth=32) for _ in engines]
+        captures = [FrameCapture(surface, scale=args.capture_scale) for surface in surfaces]
+
+        def render():
+            for engine, surface in zip(engines, surfaces):
+                surface.fill((255, 255, 255))
+                engine.draw(surface)
+            return [capture.capture() for capture in captures]
+
+        predict_batch(render())  # warm up
+        elapsed = 0.0
+        n_boxes = 0
+        for _ in range(args.steps):
+            frames = render()
+            start = time.perf_counter()
+            boxes, counts = predict_batch(frames)
+            elapsed += time.perf_counter() - start
+            for capture, frame in zip(captures, frames):
+                capture.release(frame)
+            n_boxes += int(counts.sum())
+            for i, engine in enumerate(engines):
+                engine.step(frame_detections(boxes, counts, i))
+
+        per_call = elapsed / args.steps
+        print(f"batch {batch_size:3d}: {per_call * 1e3:8.2f} ms/call  {per_call / batch_size * 1e3:7.2f} ms/frame  "
+              f"{n_boxes / (args.steps * batch_size):.1f} boxes/frame")
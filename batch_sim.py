@@ -0,0 +1,263 @@
+import argparse
+import time
+import numpy as np
+from object import Car, Pedestrian
+from object import WIDTH, HEIGHT, CAR_WIDTH, CAR_HEIGHT
+from object import COLLIDE_DISTANCE
+from ttc_func import INTERSECTION_BAND, calculate_elapsed_time_array
+
+# same as engine.py / control.py (not imported from there to keep the trajectory predictors out)
+FPS = 60
+MAX_ROUND_FRAMES = 3000
+DISTANCE_THRESHOLD = 200
+TTC_WINDOW = 30
+ACTIVE_LOOKAHEAD = 400
+
+# number of pedestrian scenarios (Pedestrian.case)
+N_CASES = 4
+
+# the car never leaves its lane, so its y is a constant
+CAR_Y = (HEIGHT - CAR_HEIGHT) // 2
+
+
+def build_case_paths(speed=9):
+    # precompute the path of every case once, padded with the last point
+    # paths: (N_CASES, max_len, 2), lengths: (N_CASES,)
+    case_paths = []
+    for case in range(N_CASES):
+        pedestrian = Pedestrian(None)
+        pedestrian.speed = speed
+        pedestrian.case = case
+        pedestrian.start_new_round()
+        case_paths.append(pedestrian.path)
+
+    lengths = np.array([len(path) for path in case_paths])
+    paths = np.empty((N_CASES, lengths.max(), 2))
+    for case, path in enumerate(case_paths):
+        paths[case, :len(path)] = path
+        paths[case, len(path):] = path[-1]
+    return paths, lengths
+
+
+def build_intersection_table(paths, lengths, car_y=CAR_Y):
+    # next_hit[case, i] = first index j >= i whose point is inside the car's band, -1 if none
+    # i.e. the answer of find_intersection_point(car, path[i:]) for every suffix of every path
+    n_cases, max_len = paths.shape[:2]
+    next_hit = np.full((n_cases, max_len + 1), -1)
+    for case in range(n_cases):
+        hit = -1
+        for i in range(lengths[case] - 1, -1, -1):
+            dy = paths[case, i, 1] - car_y
+            if -INTERSECTION_BAND < dy and dy < INTERSECTION_BAND:
+                hit = i
+            next_hit[case, i] = hit
+    return next_hit
+
+
+# N independent copies of engine.Engine stepped together with NumPy.
+# Every scenario has one car and num_pedestrian pedestrians, all state lives in
+# arrays of shape (N,) or (N, P). step() reproduces Car.update, Pedestrian.update,
+# is_colliding and the controllers of control.py for:
+#   active  + distance / ttc
+#   passive + distance
+# (passive + ttc needs the trajectory predictors, use engine.Engine for that)
+# exact_kinematics: ttc with the exact frames of kinematics.Kinematics, like engine.Engine
+class BatchSimulator:
+    def __init__(self, n, flag="active", metric="distance", num_pedestrian=1, seed=None,
+                 distance_threshold=DISTANCE_THRESHOLD, ttc_window=TTC_WINDOW, lookahead=ACTIVE_LOOKAHEAD,
+                 max_round_frames=MAX_ROUND_FRAMES, speed=9, cases=None, exact_kinematics=False):
+        if flag == "passive" and metric == "ttc":
+            raise ValueError("passive ttc needs trajectory prediction, use engine.Engine")
+
+        self.n = n
+        self.flag = flag
+        self.metric = metric
+        self.num_pedestrian = num_pedestrian
+        self.distance_threshold = distance_threshold
+        self.ttc_window = ttc_window
+        self.lookahead = lookahead
+        self.max_round_frames = max_round_frames
+        self.rng = np.random.default_rng(seed)
+        # the Pedestrian.case values a round is drawn from (like engine.Engine)
+        self.cases = np.arange(N_CASES) if cases is None else np.asarray(cases)
+
+        car = Car()
+        self.car_width = car.width
+        self.max_speed = car.max_speed
+        self.acceleration = car.acceleration
+        self.deceleration = car.deceleration
+        self.kinematics = None
+        if exact_kinematics:
+            from kinematics import for_car
+            self.kinematics = for_car(car)
+
+        self.paths, self.lengths = build_case_paths(speed)
+        self.next_hit = build_intersection_table(self.paths, self.lengths)
+
+        shape = (n, num_pedestrian)
+        # car state
+        self.car_x = np.zeros(n)
+        self.car_speed = np.full(n, float(car.max_speed))
+        self.decelerate = np.zeros(n, dtype=bool)
+        # pedestrian state, a fresh Pedestrian starts with case 3 at its start point
+        self.case = np.full(shape, 3)
+        if cases is not None:
+            self.case = self.rng.choice(self.cases, size=shape)
+        self.path_index = np.zeros(shape, dtype=int)
+        self.ped_pos = np.broadcast_to(self.paths[3, 0], shape + (2,)).copy()
+        self.collide = np.zeros(shape, dtype=bool)
+        # last path each pedestrian sent in active mode (case + index of the suffix)
+        self.sent = np.zeros(shape, dtype=bool)
+        self.sent_case = np.zeros(shape, dtype=int)
+        self.sent_index = np.zeros(shape, dtype=int)
+
+        # bookkeeping, rounds past round_limit are not added to the totals
+        self.round_limit = np.iinfo(int).max
+        self.frame = 0
+        self.rounds = np.zeros(n, dtype=int)
+        self.round_frame = np.zeros(n, dtype=int)
+        self.round_collisions = np.zeros(n, dtype=int)
+        self.round_min_distance = np.full(n, np.inf)
+        # totals over the finished rounds
+        self.collisions = np.zeros(n, dtype=int)
+        self.min_distance = np.zeros(n)
+        self.collided_rounds = np.zeros(n, dtype=int)
+        self.frames = np.zeros(n, dtype=int)
+        self.timeouts = np.zeros(n, dtype=int)
+
+    def start_new_round(self, mask, timeout):
+        # close the current round of the masked scenarios and reset them
+        counted = mask & (self.rounds < self.round_limit)
+        self.collisions[counted] += self.round_collisions[counted]
+        self.collided_rounds[counted] += self.round_collisions[counted] > 0
+        self.frames[counted] += self.round_frame[counted]
+        self.min_distance[counted] += self.round_min_distance[counted]
+        self.timeouts[counted] += timeout[counted]
+        self.rounds[mask] += 1
+        self.round_frame[mask] = 0
+        self.round_collisions[mask] = 0
+        self.round_min_distance[mask] = np.inf
+
+        # Car.start_new_round only moves the car back, speed is kept
+        self.car_x[mask] = 0
+        # Pedestrian.start_new_round keeps the rect where it was until the next update
+        n_reset = int(mask.sum())
+        self.case[mask] = self.rng.choice(self.cases, size=(n_reset, self.num_pedestrian))
+        self.path_index[mask] = 0
+        self.collide[mask] = False
+
+    def control(self):
+        car_x = self.car_x[:, None]
+        if self.metric == "distance":
+            # distance from the car's head (rect.midright) to the pedestrian's topleft
+            head_x = car_x + self.car_width
+            head_y = CAR_Y + CAR_HEIGHT // 2
+            dist = np.hypot(self.ped_pos[..., 0] - head_x, self.ped_pos[..., 1] - head_y)
+            brake = (dist <= self.distance_threshold) & (self.ped_pos[..., 0] > head_x)
+            if self.flag == "active":
+                brake &= self.sent
+            else:
+                # car_control_logic_passive stops at the first pedestrian with a short trajectory
+                brake &= np.cumprod(self.path_index > 20, axis=1).astype(bool)
+        else:
+            # active ttc on the last received suffix path[sent_index:] of every pedestrian
+            hit = self.next_hit[self.sent_case, self.sent_index]
+            pos_x = self.paths[self.sent_case, np.maximum(hit, 0), 0]
+            d = pos_x - car_x
+            valid = self.sent & (hit >= 0) & (d > 0)
+            if self.kinematics is not None:
+                car_ttc = self.kinematics.frames_to_reach(self.car_speed[:, None], np.where(valid, d, 1.0))
+            else:
+                car_ttc = calculate_elapsed_time_array(np.where(valid, d, 1.0), self.car_speed[:, None],
+                                                 self.acceleration, self.max_speed)
+            pedestrian_ttc = hit - self.sent_index + 1
+            diff = car_ttc - pedestrian_ttc
+            brake = valid & (-self.ttc_window < diff) & (diff < self.ttc_window) & (d < self.lookahead)
+
+        self.decelerate = brake.any(axis=1)
+
+    def update_car(self):
+        speed = self.car_speed
+        accelerated = np.where(speed < self.max_speed, speed + self.acceleration, self.max_speed)
+        decelerated = np.where(speed > 0, speed - self.deceleration, 0.0)
+        self.car_speed = np.where(self.decelerate, decelerated, accelerated)
+        # pygame.Rect rounds the new x half away from zero
+        self.car_x = np.floor(self.car_x + self.car_speed + 0.5)
+
+    def update_pedestrians(self):
+        moving = self.path_index < self.lengths[self.case]
+        index = np.minimum(self.path_index, self.lengths[self.case] - 1)
+        self.ped_pos = np.where(moving[..., None], self.paths[self.case, index], self.ped_pos)
+        self.path_index += moving
+
+        # is_colliding: car topleft vs pedestrian topleft
+        dist = np.hypot(self.ped_pos[..., 0] - self.car_x[:, None], self.ped_pos[..., 1] - CAR_Y)
+        self.round_min_distance = np.minimum(self.round_min_distance, dist.min(axis=1))
+        new_collisions = ~self.collide & (dist <= COLLIDE_DISTANCE)
+        self.collide |= new_collisions
+        self.round_collisions += new_collisions.sum(axis=1)
+
+        if self.flag == "active":
+            self.sent[:] = True
+            self.sent_case[:] = self.case
+            self.sent_index[:] = self.path_index
+
+    # advance every scenario by one frame (same order as engine.Engine.step)
+    def step(self):
+        finished = self.car_x + self.car_width >= WIDTH
+        timeout = np.zeros(self.n, dtype=bool)
+        if self.max_round_frames is not None:
+            timeout = ~finished & (self.round_frame >= self.max_round_frames)
+        reset = finished | timeout
+        if reset.any():
+            self.start_new_round(reset, timeout)
+
+        self.control()
+        self.update_car()
+        self.update_pedestrians()
+
+        self.frame += 1
+        self.round_frame += 1
+
+    # step until every scenario finished n_rounds rounds
+    # (scenarios that are done keep stepping, but their totals are frozen)
+    def run(self, n_rounds):
+        self.round_limit = n_rounds
+        while self.rounds.min() < n_rounds:
+            self.step()
+        return self.summary(n_rounds)
+
+    def summary(self, n_rounds):
+        return {
+            "scenarios": self.n,
+            "rounds": self.n * n_rounds,
+            "collisions": int(self.collisions.sum()),
+            "collision_rate": float(self.collided_rounds.sum() / (self.n * n_rounds)),
+            "timeouts": int(self.timeouts.sum()),
+            "mean_round_time": float(self.frames.sum() / FPS / (self.n * n_rounds)),
+            "mean_min_distance": float(self.min_distance.sum() / (self.n * n_rounds)),
+            "frames": int(self.frames.sum()),
+            "sim_time": float(self.frames.sum() / FPS),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorized batch car and pedestrian simulation")
+    parser.add_argument("--flag", type=str, default="active", choices=["active", "passive"], help="active or passive pedestrian detection")
+    parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric (distance or ttc)")
+    parser.add_argument("--n_scenarios", type=int, default=10000, help="Number of independent scenarios")
+    parser.add_argument("--n_rounds", type=int, default=5, help="Number of rounds per scenario")
+    parser.add_argument("--num_pedestrian", type=int, default=1, help="Number of pedestrians per scenario")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the pedestrian cases")
+    parser.add_argument("--exact_kinematics", action="store_true", help="ttc: use the exact frames the car needs instead of the continuous estimate")
+    args = parser.parse_args()
+
+    sim = BatchSimulator(args.n_scenarios, args.flag, args.metric, num_pedestrian=args.num_pedestrian, seed=args.seed,
+                         exact_kinematics=args.exact_kinematics)
+    start = time.perf_counter()
+    summary = sim.run(args.n_rounds)
+    elapsed = time.perf_counter() - start
+
+    summary["wall_time"] = elapsed
+    summary["rounds_per_second"] = summary["rounds"] / elapsed if elapsed > 0 else float("inf")
+    print(summary)
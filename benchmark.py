@@ -0,0 +1,310 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+# every benchmark starts from the same state: fixed seed, and the inputs are
+# built from the four Pedestrian.case routes (see Pedestrian.generate_waypoints)
+SEED = 0
+CASES = (0, 1, 2, 3)
+# frames a pedestrian walks before its trajectory is used as prediction input
+# (car_control_logic_passive only predicts trajectories longer than 20)
+WARMUP_STEPS = 30
+
+# a benchmark whose time grows by more than this is a regression
+# (two runs of the same code still differ by up to ~25 % on a shared VM,
+# lower it with --threshold on a quiet machine)
+THRESHOLD = 0.25
+
+
+# Fixed pure python + small numpy workload. Every sample of a benchmark is
+# followed by a sample of it, and compare --normalize divides by its median,
+# so a baseline saved on a faster / less loaded machine (CPU steal on a shared
+# VM easily doubles every number, and comes and goes within a run) does not
+# show up as a regression of everything. One call takes ~15 us, a sample is
+# CALIBRATION_NUMBER calls (a few ms) so that it is not just timer noise.
+CALIBRATION_POINTS = [(float(i), float(i * i % 97)) for i in range(64)]
+CALIBRATION_ARRAY = np.asarray(CALIBRATION_POINTS)
+CALIBRATION_NUMBER = 200
+# calibration samples taken after every (long) episode sample
+CALIBRATION_SAMPLES = 5
+
+
+def calibration_workload():
+    total = 0.0
+    for x, y in CALIBRATION_POINTS:
+        total += x * 0.5 + y
+    return total + float(np.diff(CALIBRATION_ARRAY, axis=0).sum())
+
+
+def timed(fn, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+# Runs fn `number` times per sample, `repeat` samples, with the garbage
+# collector off (like timeit). Returns per-call times in us.
+def measure(fn, repeat, number):
+    fn()  # warm up (lazy imports, caches, tf.function tracing)
+    times = []
+    calibration = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            times.append(timed(fn, number))
+            calibration.append(timed(calibration_workload, CALIBRATION_NUMBER))
+    finally:
+        if enabled:
+            gc.enable()
+    times = np.array(times)
+    return {"median_us": float(np.median(times)), "min_us": float(times.min()),
+            "p95_us": float(np.percentile(times, 95)), "calibration_us": float(np.median(calibration)),
+            "repeat": repeat, "number": number}
+
+
+# pedestrians of every case WARMUP_STEPS into their route, and a car at the start
+def scenario():
+    from object import Car, Pedestrian
+    car = Car()
+    pedestrians = []
+    for case in CASES:
+        pedestrian = Pedestrian(id=case)
+        pedestrian.case = case
+        pedestrian.start_new_round()
+        for _ in range(WARMUP_STEPS):
+            pedestrian.update()
+        pedestrians.append(pedestrian)
+    return car, pedestrians
+
+
+def bench_wma(repeat, number):
+    from trajectory_prediction import weighted_moving_average
+    _, pedestrians = scenario()
+    results = {}
+    for pedestrian in pedestrians:
+        features, trajectory = pedestrian.features, list(pedestrian.trajectory)
+        results[f"wma/features/case{pedestrian.case}"] = measure(lambda: weighted_moving_average(features), repeat, number)
+        results[f"wma/list/case{pedestrian.case}"] = measure(lambda: weighted_moving_average(trajectory), repeat, number)
+    return results
+
+
+def bench_rnn(repeat, number):
+    import trajectory_prediction
+    from trajectory_prediction import RNN_prediction, RNN_prediction_batch
+    backend = trajectory_prediction.load_rnn_backend()
+    _, pedestrians = scenario()
+    results = {}
+    for pedestrian in pedestrians:
+        features = pedestrian.features
+        results[f"rnn/{backend}/case{pedestrian.case}"] = measure(lambda: RNN_prediction(features), repeat, number)
+    batch = [pedestrian.features for pedestrian in pedestrians]
+    results[f"rnn/{backend}/batch{len(batch)}"] = measure(lambda: RNN_prediction_batch(batch), repeat, number)
+    return results
+
+
+def bench_ttc(repeat, number):
+    from ttc_func import calculate_ttc, find_intersection_point, PathIndex
+    from kinematics import for_car
+    car, pedestrians = scenario()
+    kinematics = for_car(car)
+    results = {}
+    for pedestrian in pedestrians:
+        path, start = list(pedestrian.path), pedestrian.path_index
+        index = PathIndex(path)
+        array = np.asarray(path)
+        case = pedestrian.case
+        results[f"ttc/list/case{case}"] = measure(lambda: calculate_ttc(car, pedestrian, path, start), repeat, number)
+        results[f"ttc/path_index/case{case}"] = measure(lambda: calculate_ttc(car, pedestrian, index, start), repeat, number)
+        results[f"ttc/exact/case{case}"] = measure(lambda: calculate_ttc(car, pedestrian, index, start, kinematics), repeat, number)
+        results[f"intersection/list/case{case}"] = measure(lambda: find_intersection_point(car, path), repeat, number)
+        results[f"intersection/array/case{case}"] = measure(lambda: find_intersection_point(car, array), repeat, number)
+        results[f"intersection/path_index/case{case}"] = measure(lambda: find_intersection_point(car, index), repeat, number)
+    return results
+
+
+# Capture + detection, the per-frame detector path of simulation.main.
+# "stub" is an image detector that returns the ground truth boxes without
+# looking at the image, so only the capture / handoff cost is measured and no
+# model is needed; "yolo" is skipped when ultralytics is not installed.
+def bench_predict(repeat, number, detectors=("stub", "components")):
+    import pygame
+    from capture import FrameCapture
+    from detectors import Detector, GroundTruthDetector, make_detector, WHITE
+    from engine import Engine
+    from object import WIDTH, HEIGHT
+
+    class StubDetector(Detector):
+        source = "image"
+
+        def __init__(self, car, pedestrians):
+            super().__init__()
+            self.ground_truth = GroundTruthDetector(car, pedestrians)
+
+        def detect(self, image):
+            return self.ground_truth.detect()
+
+    car_image = pygame.image.load("car.jpg")
+    pedestrian_image = pygame.image.load("pedestrian.jpg")
+    results = {}
+    for name in detectors:
+        engine = Engine("passive", "ttc", num_pedestrian=len(CASES), seed=SEED, cases=list(CASES),
+                        car_image=car_image, pedestrian_image=pedestrian_image)
+        for _ in range(WARMUP_STEPS):
+            engine.step()
+        if name == "stub":
+            detector = StubDetector(engine.car, engine.pedestrians)
+        else:
+            try:
+                detector = make_detector(name, engine.car, engine.pedestrians)
+                if name == "yolo":
+                    import YOLO  # noqa: F401  (fails here without ultralytics)
+            except ImportError as error:
+                print(f"skipping predict/{name}: {error}")
+                continue
+        surface = pygame.Surface((WIDTH, HEIGHT), depth=32)
+        surface.fill(WHITE)
+        engine.draw(surface)
+        frame_capture = FrameCapture(surface)
+
+        def predict():
+            frame = frame_capture.capture() if detector.source == "image" else surface
+            xyxys, confidences, class_ids = detector(frame)
+            if detector.source == "image":
+                frame_capture.release(frame)
+                xyxys = frame_capture.to_screen(xyxys)
+            return xyxys, confidences, class_ids
+
+        results[f"predict/{name}"] = measure(predict, repeat, max(number // 10, 1))
+    return results
+
+
+# Whole headless episodes: frames per second, plus the outcome (collisions,
+# frames) so a change in behaviour shows up next to a change in speed.
+def bench_episode(repeat, number, n_rounds=20):
+    from engine import Engine, summarize
+    results = {}
+    for flag in ("active", "passive"):
+        for metric in ("distance", "ttc"):
+            times = []
+            calibration = []
+            for _ in range(max(repeat // 5, 1)):
+                engine = Engine(flag, metric, num_pedestrian=len(CASES), seed=SEED, cases=list(CASES))
+                start = time.perf_counter()
+                summary = summarize(engine.run(n_rounds))
+                times.append(time.perf_counter() - start)
+                calibration.extend(timed(calibration_workload, CALIBRATION_NUMBER) for _ in range(CALIBRATION_SAMPLES))
+            elapsed = float(np.median(times))
+            results[f"episode/{flag}/{metric}"] = {
+                "median_us": elapsed / summary["frames"] * 1e6, "min_us": min(times) / summary["frames"] * 1e6,
+                "calibration_us": float(np.median(calibration)),
+                "frames_per_second": summary["frames"] / elapsed, "repeat": len(times), "number": summary["frames"],
+                "outcome": {"rounds": summary["rounds"], "frames": summary["frames"], "collisions": summary["collisions"]},
+            }
+    return results
+
+
+BENCHMARKS = {"wma": bench_wma, "rnn": bench_rnn, "ttc": bench_ttc, "predict": bench_predict, "episode": bench_episode}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": sys.version.split()[0],
+            "numpy": np.__version__, "platform": platform.platform(), "processor": platform.processor(),
+            "seed": SEED, "cases": list(CASES)}
+
+
+def run(names, repeat, number):
+    np.random.seed(SEED)
+    results = {}
+    for name in names:
+        start = time.perf_counter()
+        results.update(BENCHMARKS[name](repeat, number))
+        print(f"{name}: {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return {"environment": environment(), "results": results}
+
+
+# (name, baseline us, current us, ratio, status) for every benchmark of the current run
+# The fastest sample (min_us) is compared, the other samples only add noise on
+# top of it. Raw times by default; with normalize each time is divided by the
+# median calibration time measured alongside it (for a baseline from another
+# machine / load, at the price of the calibration's own noise).
+# status: "regression" (slower by more than threshold), "improvement",
+# "ok", "new" (not in the baseline), or "changed" (different episode outcome)
+def compare(baseline, current, threshold=THRESHOLD, normalize=False):
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append((name, None, result["min_us"], None, "new"))
+            continue
+        scale = result["calibration_us"] / base["calibration_us"] if normalize else 1.0
+        ratio = result["min_us"] / (base["min_us"] * scale) if base["min_us"] > 0 else float("inf")
+        if "outcome" in result and result["outcome"] != base.get("outcome"):
+            status = "changed"
+        elif ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append((name, base["min_us"], result["min_us"], ratio, status))
+    return rows
+
+
+def print_results(report):
+    print(f"{'benchmark':36s} {'median us':>11s} {'min us':>11s} {'p95 us':>11s}")
+    for name, result in report["results"].items():
+        print(f"{name:36s} {result['median_us']:11.2f} {result['min_us']:11.2f} {result.get('p95_us', float('nan')):11.2f}"
+              + (f"  {result['frames_per_second']:.0f} frames/s {result['outcome']}" if "outcome" in result else ""))
+
+
+def print_comparison(rows, threshold):
+    print(f"{'benchmark':36s} {'base min us':>11s} {'min us':>11s} {'ratio':>7s}  status (threshold {threshold:.0%})")
+    for name, base, current, ratio, status in rows:
+        print(f"{name:36s} {base if base is not None else float('nan'):11.2f} {current:11.2f} "
+              f"{ratio if ratio is not None else float('nan'):7.2f}  {status}")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the control and prediction hot paths")
+    parser.add_argument("--benchmarks", type=str, nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=25, help="Timed samples per benchmark")
+    parser.add_argument("--number", type=int, default=200, help="Calls per sample")
+    parser.add_argument("--detectors", type=str, nargs="+", default=["stub", "components"], choices=["stub", "components", "yolo"], help="Detectors of the predict benchmark")
+    parser.add_argument("--output", type=str, default=None, help="Save the results as JSON")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON to compare against, exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Relative slowdown that counts as a regression")
+    parser.add_argument("--normalize", action="store_true", help="Compare times relative to the calibration workload timed alongside (baseline from another machine)")
+    args = parser.parse_args()
+
+    if "predict" in args.benchmarks:
+        BENCHMARKS["predict"] = lambda repeat, number: bench_predict(repeat, number, args.detectors)
+    report = run(args.benchmarks, args.repeat, args.number)
+    print_results(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, args.threshold, normalize=args.normalize)
+        print()
+        print_comparison(rows, args.threshold)
+        if any(status in ("regression", "changed") for *_, status in rows):
+            sys.exit(1)
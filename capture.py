@@ -0,0 +1,141 @@
+import argparse
+import threading
+import time
+import numpy as np
+import pygame
+from object import WIDTH, HEIGHT, CAR_HEIGHT
+
+# rows of the screen around the road the car drives on (car rows +- 200 px),
+# the part of the frame a pedestrian has to be in to matter to the car
+ROAD_TOP = (HEIGHT - CAR_HEIGHT) // 2 - 200
+ROAD_BOTTOM = (HEIGHT + CAR_HEIGHT) // 2 + 200
+ROAD_BAND = (0, ROAD_TOP, WIDTH, ROAD_BOTTOM)
+
+# buffers allocated up front: one being detected, one pending in the
+# AsyncDetector, one being captured (more are only needed if the consumer
+# holds on to frames longer, then capture falls back to a fresh array)
+N_BUFFERS = 3
+
+
+# screenshot the way simulation.py used to take it: array3d (copy), cv2.transpose
+# (copy), cv2.cvtColor (copy) -> new (HEIGHT, WIDTH, 3) BGR array every frame
+def capture_copy(surface):
+    import cv2
+    screenshot = pygame.surfarray.array3d(surface)
+    screenshot = cv2.transpose(screenshot)
+    return cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
+
+
+# Screenshot of a pygame surface as a (H, W, 3) BGR uint8 array for the detector
+# with a single copy: pixels3d is a (W, H, 3) view of the surface memory, the
+# transpose, the RGB -> BGR swap, the crop and the downscale are all views
+# on top of it, and np.copyto writes the result into a buffer allocated once.
+# roi: (x1, y1, x2, y2) part of the surface to keep (None = all of it)
+# scale: keep every scale-th pixel in both directions (nearest neighbour)
+# A buffer belongs to whoever capture() handed it to until it comes back with
+# release(): capture only writes into free buffers, when none is free (the
+# detector still reads one, another is pending) the frame goes into a new
+# array instead, so a frame never changes while someone is looking at it.
+class FrameCapture:
+    def __init__(self, surface, roi=None, scale=1, buffers=N_BUFFERS):
+        self.surface = surface
+        width, height = surface.get_size()
+        x1, y1, x2, y2 = (0, 0, width, height) if roi is None else roi
+        self.roi = (max(x1, 0), max(y1, 0), min(x2, width), min(y2, height))
+        self.scale = max(int(scale), 1)
+
+        x1, y1, x2, y2 = self.roi
+        shape = (len(range(y1, y2, self.scale)), len(range(x1, x2, self.scale)), 3)
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(max(int(buffers), 1))]
+        self.owned = {id(buffer) for buffer in self.buffers}
+        # capture runs on the loop, release on the detector thread
+        self.free = list(self.buffers)
+        self.lock = threading.Lock()
+        self.copies = 0  # captures that found no free buffer
+
+    @property
+    def shape(self):
+        return self.buffers[0].shape
+
+    # returns a free preallocated buffer (or a new array), it is not written
+    # again before it is given back with release()
+    def capture(self):
+        x1, y1, x2, y2 = self.roi
+        with self.lock:
+            out = self.free.pop() if self.free else None
+        if out is None:
+            self.copies += 1
+            out = np.empty(self.shape, dtype=np.uint8)
+
+        pixels = pygame.surfarray.pixels3d(self.surface)  # locks the surface until released
+        view = pixels[x1:x2:self.scale, y1:y2:self.scale].transpose(1, 0, 2)[..., ::-1]
+        np.copyto(out, view)
+        del view, pixels
+        return out
+
+    # the caller is done with a frame from capture() (arrays that are not
+    # one of the buffers are just dropped)
+    def release(self, frame):
+        if id(frame) in self.owned:
+            with self.lock:
+                if not any(frame is buffer for buffer in self.free):
+                    self.free.append(frame)
+
+    # (k, 4) boxes found in a captured frame -> surface coordinates
+    def to_screen(self, xyxys):
+        if self.roi[:2] == (0, 0) and self.scale == 1:
+            return xyxys
+        x1, y1 = self.roi[:2]
+        offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+        return np.asarray(xyxys, dtype=np.float32).reshape(-1, 4) * self.scale + offset
+
+
+def benchmark(surface, runs=200):
+    def timed(capture):
+        capture()
+        start = time.perf_counter()
+        for _ in range(runs):
+            capture()
+        return (time.perf_counter() - start) / runs * 1e3
+
+    try:
+        import cv2
+        legacy = lambda: capture_copy(surface)
+        name = "array3d + cv2"
+    except ImportError:
+        # same three full-size copies without OpenCV
+        legacy = lambda: np.ascontiguousarray(pygame.surfarray.array3d(surface).transpose(1, 0, 2)[..., ::-1])
+        name = "array3d + numpy"
+
+    results = [(name, timed(legacy), (surface.get_height(), surface.get_width(), 3))]
+    for label, roi, scale in [("pixels3d", None, 1), ("pixels3d road band", ROAD_BAND, 1),
+                              ("pixels3d 1/2", None, 2), ("pixels3d road band 1/2", ROAD_BAND, 2)]:
+        frame_capture = FrameCapture(surface, roi, scale)
+        results.append((label, timed(lambda: frame_capture.release(frame_capture.capture())), frame_capture.shape))
+    return results
+
+
+if __name__ == "__main__":
+    from engine import Engine
+
+    parser = argparse.ArgumentParser(description="Benchmark the screen capture for the detector")
+    parser.add_argument("--runs", type=int, default=200, help="Captures per method")
+    args = parser.parse_args()
+
+    # a frame that looks like the simulation: white background, car and pedestrian sprites
+    surface = pygame.Surface((WIDTH, HEIGHT), depth=32)
+    car_image = pygame.image.load("car.jpg")
+    pedestrian_image = pygame.image.load("pedestrian.jpg")
+    engine = Engine("passive", num_pedestrian=3, seed=0, car_image=car_image, pedestrian_image=pedestrian_image)
+    for _ in range(20):
+        engine.step()
+    surface.fill((255, 255, 255))
+    engine.draw(surface)
+
+    # the fast path has to produce exactly the old screenshot
+    frame = FrameCapture(surface).capture()
+    expected = np.ascontiguousarray(pygame.surfarray.array3d(surface).transpose(1, 0, 2)[..., ::-1])
+    print("identical to the old screenshot:", np.array_equal(frame, expected))
+
+    for label, ms, shape in benchmark(surface, args.runs):
+        print(f"{label:24s} {ms:7.3f} ms/frame  {shape[1]}x{shape[0]}  {np.prod(shape) / 1e6:.2f} MB")
@@ -0,0 +1,182 @@
+import math
+import pygame
+from object import Car, Pedestrian
+from object import COLLIDE_DISTANCE, PEDESTRIAN_WIDTH
+from trajectory_prediction import RNN_prediction_batch, wma_rollout, direction_rollout
+from ttc_func import calculate_ttc, PathIndex
+from profiler import NULL_PROFILER
+
+# Screen dimensions
+WIDTH, HEIGHT = 1400, 800
+
+# Colors
+RED = (255, 0, 0)
+
+# the number of pedestrian's future steps that the car should predict
+PREDICT_STEPS = 100
+
+# default controller parameters (see sweep.py for tuning them)
+# distance metric: brake when a pedestrian ahead is closer than this (px)
+DISTANCE_THRESHOLD = 200
+# ttc metric: brake when car and pedestrian reach the intersection within this many frames of each other
+TTC_WINDOW = 30
+# ttc metric: ... and the intersection point is closer than this (px) to the car
+ACTIVE_LOOKAHEAD = 400
+PASSIVE_LOOKAHEAD = 350
+
+# ttc metric, active mode: how far (px) sideways a pedestrian can walk before it reaches
+# the car's lane (the routes move at most 200 px sideways, see Pedestrian.generate_waypoints)
+LATERAL_DRIFT = 250
+
+# Global dictionary to store precomputed_paths of each pedestrian
+# key: id, value: {"precomputed_path": [...], "speed": ..., "start": ...}
+# "start" (optional, default 0) is the step of precomputed_path the pedestrian is at,
+# so a sender can keep sending the same path object and only move the start
+precomputed_paths = {}
+
+# PathIndex of the last path object received from each pedestrian
+# key: id, value: (path, PathIndex)
+path_indices = {}
+
+def get_path_index(pedestrian_id, path):
+    cached = path_indices.get(pedestrian_id)
+    if cached is None or cached[0] is not path:
+        cached = (path, PathIndex(path))
+        path_indices[pedestrian_id] = cached
+    return cached[1]
+
+# broad phase: (x1, y1, x2, y2) region the top left corner of a pedestrian has to be in
+# for the controller to possibly react to it this frame (a superset, the controller
+# still does the exact test), pedestrians outside it can be skipped
+# max_speed: fastest pedestrian, bounds how far a passive prediction can walk sideways
+def control_region(car: Car, flag, metric, distance_threshold=DISTANCE_THRESHOLD, lookahead=None, max_speed=0):
+    if metric == "distance":
+        head_x, head_y = car.rect.midright
+        return (head_x, head_y - distance_threshold, head_x + distance_threshold, head_y + distance_threshold)
+
+    # ttc: the intersection point is less than lookahead in front of the car
+    if flag == "active":
+        lookahead = ACTIVE_LOOKAHEAD if lookahead is None else lookahead
+        drift = LATERAL_DRIFT
+    else:
+        lookahead = PASSIVE_LOOKAHEAD if lookahead is None else lookahead
+        drift = PREDICT_STEPS * max_speed + PEDESTRIAN_WIDTH
+    return (car.rect.x - drift, -math.inf, car.rect.x + lookahead + drift, math.inf)
+
+def get_distance(pos1, pos2):
+    x1, y1 = pos1
+    x2, y2 = pos2
+    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+
+def is_entering(path):
+
+    cur_pos_y = path[0][1]
+    next_pos_y = path[1][1]
+
+    return ((HEIGHT / 2 - next_pos_y) * (next_pos_y - cur_pos_y) >= 0)
+
+def is_colliding(car: Car, pedestrian: Pedestrian):
+    # pure collision check, rendering / printing is left to the caller
+    car_pos = (car.rect.x, car.rect.y)
+    pedestrian_pos = (pedestrian.rect.x, pedestrian.rect.y)
+    return get_distance(car_pos, pedestrian_pos) <= COLLIDE_DISTANCE
+
+# active prediction of pedestrian trajectory
+# surface: optional pygame surface to draw the received paths on (None in headless mode)
+# kinematics: optional kinematics.Kinematics, the ttc metric then uses the exact frames of the car
+def car_control_logic_active(car: Car, pedestrians: list[Pedestrian], metric, distance_threshold=DISTANCE_THRESHOLD,
+                             ttc_window=TTC_WINDOW, lookahead=ACTIVE_LOOKAHEAD, surface=None, kinematics=None):
+
+    # get the coordinate of car's head
+    car_head = car.rect.midright
+    car.decelerate_flag = False
+
+    for pedestrian in pedestrians:
+        # one lookup: a receiver thread may replace the entry meanwhile, path and
+        # start have to come from the same update
+        entry = precomputed_paths.get(pedestrian.pedestrian_id)
+        if entry is None:
+            continue
+
+        path = entry["precomputed_path"]
+        start = entry.get("start", 0)
+        if surface is not None and len(path) - start >= 2:
+            precomputed_centered_path = [(x + pedestrian.width // 2, y) for x, y in path[start:]]
+            pygame.draw.lines(surface, RED, False, precomputed_centered_path, 3)
+
+        if metric == 'ttc':
+            car_ttc, pedestrian_ttc, pos = calculate_ttc(car, pedestrian, get_path_index(pedestrian.pedestrian_id, path), start, kinematics)
+
+            # Deceleration logic
+            if car_ttc == -1:
+                continue
+            elif -ttc_window < car_ttc - pedestrian_ttc and car_ttc - pedestrian_ttc < ttc_window and pos[0] - car.rect.x < lookahead:
+                car.decelerate_flag = True
+                # print("car ttc: " + str(car_ttc) + "pedestrian ttc: " + str(pedestrian_ttc))
+                break
+
+        elif metric == 'distance':
+            dist = get_distance(car_head, (pedestrian.rect.x, pedestrian.rect.y))
+            if dist <= distance_threshold and pedestrian.rect.x > car_head[0]:
+                car.decelerate_flag = True
+                break
+
+# passive prediction of pedestrian trajectory
+# pedestrians: Pedestrian objects, or tracker.Track objects built from the detections
+# surface: optional pygame surface to draw the predicted trajectories on (None in headless mode)
+# profiler: profiler.Profiler, times the RNN forward pass as its own "rnn" stage
+# kinematics: optional kinematics.Kinematics, as in car_control_logic_active
+def car_control_logic_passive(car: Car, pedestrians: list[Pedestrian], xyxys, confidences, class_ids, metric, distance_threshold=DISTANCE_THRESHOLD,
+                              ttc_window=TTC_WINDOW, lookahead=PASSIVE_LOOKAHEAD, surface=None, profiler=NULL_PROFILER, kinematics=None):
+    if len(xyxys) == 0:
+        car.decelerate_flag = False
+        return
+
+    # get the coordinate of car's head
+    car_head = car.rect.midright
+    car.decelerate_flag = False
+
+    prediction_strategy = 1
+
+    # pedestrians are handled in order until the first one with a short trajectory
+    tracked = []
+    for pedestrian in pedestrians:
+        if len(pedestrian.trajectory) <= 20: break
+        tracked.append(pedestrian)
+
+    # one RNN forward pass for all of them instead of one per pedestrian
+    if prediction_strategy == 1:
+        with profiler.stage("rnn"):
+            predicted_directions = RNN_prediction_batch([pedestrian.features for pedestrian in tracked])
+
+    for index, pedestrian in enumerate(tracked):
+        # the whole future trajectory as one (PREDICT_STEPS, 2) array
+        if prediction_strategy == 0: # WMA
+            future_trajectory = wma_rollout(pedestrian.features, pedestrian.speed, PREDICT_STEPS)
+
+        elif prediction_strategy == 1: # RNN
+            predicted_direction = predicted_directions[index]
+            future_trajectory = direction_rollout(pedestrian.trajectory[-1], predicted_direction, pedestrian.speed, PREDICT_STEPS)
+
+        # centered trajectory
+        future_centered_trajectory = future_trajectory + (pedestrian.width // 2, 0)
+        if surface is not None:
+            pygame.draw.lines(surface, RED, False, future_centered_trajectory, 2)
+
+        if metric == 'ttc':
+            # print(future_centered_trajectory)
+            car_ttc, pedestrian_ttc, pos = calculate_ttc(car, pedestrian, future_centered_trajectory, kinematics=kinematics)
+
+            # Deceleration logic
+            if car_ttc == -1:
+                continue
+            elif -ttc_window < car_ttc - pedestrian_ttc and car_ttc - pedestrian_ttc < ttc_window and pos[0] - car.rect.x < lookahead:
+                car.decelerate_flag = True
+                # print("car ttc: " + str(car_ttc) + "pedestrian ttc: " + str(pedestrian_ttc))
+                break
+        else:
+            distance = get_distance(car_head, (pedestrian.rect.x, pedestrian.rect.y))
+            # print(f"Distance: {distance}, Threshold: {distance_threshold}")
+            if distance <= distance_threshold and pedestrian.rect.x > car_head[0]:
+                car.decelerate_flag = True
+                break
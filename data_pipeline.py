@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import numpy as np
+from recorder import iter_shards, shard_paths
+
+# same as ACCOUNTED_LENGTH in RNN.py / trajectory_prediction.py
+ACCOUNTED_LENGTH = 10
+
+# the old dataset.npy has no round boundaries, a step longer than this (px)
+# is a pedestrian jumping back to its start, i.e. a new episode
+MAX_STEP = 30
+
+CACHE_DIR = "windows"
+
+
+# positions of one (episode, pedestrian) after the other, in frame order
+def split_records(records):
+    if len(records) == 0:
+        return []
+    order = np.lexsort((records["frame"], records["pedestrian"], records["episode"]))
+    episode, pedestrian = records["episode"][order], records["pedestrian"][order]
+    cuts = np.flatnonzero((np.diff(episode) != 0) | (np.diff(pedestrian) != 0)) + 1
+    positions = np.stack([records["x"][order], records["y"][order]], axis=1)
+    return np.split(positions, cuts)
+
+
+# (n, 2) positions of every trajectory of a source, one at a time:
+#  - a recorder directory: the shards are read (memory-mapped) in order and
+#    handed out episode by episode, an episode split over two shards is joined
+#  - an (N, 2) .npy file (old dataset.npy): memory-mapped, cut where the
+#    position jumps further than max_step
+def iter_trajectories(source, max_step=MAX_STEP):
+    if os.path.isdir(source):
+        pending = None
+        for shard in iter_shards(source):
+            if pending is not None and len(pending):
+                shard = np.concatenate([pending, shard])
+            # the recorder writes the episodes one after the other, only the
+            # last one of a shard can continue in the next shard
+            cuts = np.flatnonzero(np.diff(shard["episode"])) + 1
+            last = cuts[-1] if len(cuts) else 0
+            yield from split_records(shard[:last])
+            pending = shard[last:]
+        if pending is not None and len(pending):
+            yield from split_records(pending)
+    else:
+        positions = np.load(source, mmap_mode="r")
+        steps = np.diff(positions, axis=0).astype(np.float64)
+        cuts = np.flatnonzero(np.hypot(steps[:, 0], steps[:, 1]) > max_step) + 1
+        yield from np.split(positions, cuts)
+
+
+# what a cache was built from: [name, size, mtime_ns] of every shard of a
+# recorder directory (or of the .npy file), a cache whose fingerprint differs
+# from the source's is out of date (e.g. recordings were appended since)
+def source_fingerprint(source):
+    paths = shard_paths(source) if os.path.isdir(source) else [source]
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+# heading angle of every step of a trajectory (vectorized atan2)
+# drop_still: skip steps that do not move (a pedestrian waiting at the end of
+# its path), TrajectoryFeatures never sees them at run time either
+def trajectory_angles(positions, drop_still=True):
+    steps = np.diff(np.asarray(positions, dtype=np.float64), axis=0)
+    if drop_still:
+        steps = steps[(steps[:, 0] != 0) | (steps[:, 1] != 0)]
+    return np.arctan2(steps[:, 1], steps[:, 0]).astype(np.float32)
+
+
+# Stream the trajectories of a source into two flat files of a cache directory:
+#   angles.bin  float32, the angles of all trajectories one after the other
+#   starts.bin  int64, the first angle of every window of length + 1 angles
+#               (length inputs and the target) that lies inside one trajectory
+#   meta.json   length, counts, the angle offset of every trajectory and the
+#               fingerprint of the source
+# Only one episode is in memory at a time, the files are memory-mapped by WindowDataset.
+def build_cache(source, cache_dir, length=ACCOUNTED_LENGTH, drop_still=True, max_step=MAX_STEP):
+    os.makedirs(cache_dir, exist_ok=True)
+    # taken before reading, a shard written meanwhile makes the next load rebuild
+    fingerprint = source_fingerprint(source)
+    offset = 0
+    n_windows = 0
+    bounds = [0]
+    with open(os.path.join(cache_dir, "angles.bin"), "wb") as angles_file, \
+         open(os.path.join(cache_dir, "starts.bin"), "wb") as starts_file:
+        for positions in iter_trajectories(source, max_step):
+            angles = trajectory_angles(positions, drop_still)
+            if len(angles) == 0:
+                continue
+            angles_file.write(angles.tobytes())
+            if len(angles) > length:
+                starts = offset + np.arange(len(angles) - length, dtype=np.int64)
+                starts_file.write(starts.tobytes())
+                n_windows += len(starts)
+            offset += len(angles)
+            bounds.append(offset)
+
+    meta = {"source": os.path.abspath(source), "length": length, "drop_still": drop_still,
+            "angles": offset, "windows": n_windows, "trajectories": len(bounds) - 1, "bounds": bounds,
+            "fingerprint": fingerprint}
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+# Training windows over memory-mapped angles.
+# windows is a sliding_window_view of the angles (no copy), a batch is
+# windows[starts[index]], so only the batch itself is ever materialized, and
+# the starts never include a window that crosses from one trajectory into the next.
+class WindowDataset:
+    def __init__(self, angles, starts, length=ACCOUNTED_LENGTH, bounds=None):
+        self.angles = angles
+        self.starts = starts
+        self.length = length
+        # angle offsets where trajectories begin (for splitting without leaking
+        # one trajectory into both sides)
+        self.bounds = np.asarray(bounds if bounds is not None else [0, len(angles)])
+        self.windows = np.lib.stride_tricks.sliding_window_view(angles, length + 1)
+
+    # build (or reuse) the cache of a source and memory-map it, the cache is
+    # only reused if it was built from this source as it is now
+    @classmethod
+    def from_source(cls, source, length=ACCOUNTED_LENGTH, cache_dir=None, drop_still=True, rebuild=False):
+        if cache_dir is None:
+            cache_dir = os.path.join(source, CACHE_DIR) if os.path.isdir(source) else os.path.splitext(source)[0] + "_" + CACHE_DIR
+        meta_path = os.path.join(cache_dir, "meta.json")
+        meta = None
+        if not rebuild and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["length"] != length or meta["drop_still"] != drop_still or \
+                    meta["source"] != os.path.abspath(source) or meta.get("fingerprint") != source_fingerprint(source):
+                meta = None
+        if meta is None:
+            meta = build_cache(source, cache_dir, length, drop_still)
+        return cls.load(cache_dir)
+
+    @classmethod
+    def load(cls, cache_dir):
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            meta = json.load(f)
+        angles = np.memmap(os.path.join(cache_dir, "angles.bin"), dtype=np.float32, mode="r", shape=(meta["angles"],)) \
+            if meta["angles"] else np.zeros(0, dtype=np.float32)
+        starts = np.memmap(os.path.join(cache_dir, "starts.bin"), dtype=np.int64, mode="r", shape=(meta["windows"],)) \
+            if meta["windows"] else np.zeros(0, dtype=np.int64)
+        return cls(angles, starts, meta["length"], meta["bounds"])
+
+    def __len__(self):
+        return len(self.starts)
+
+    # X: (n, length, 1) float32 angle windows, y: (n,) the angle after each window
+    def batch(self, index):
+        windows = self.windows[self.starts[index]]
+        return windows[:, :self.length, None], windows[:, self.length]
+
+    def batches(self, batch_size=32, shuffle=False, seed=None):
+        index = np.arange(len(self.starts))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(index)
+        for first in range(0, len(index), batch_size):
+            yield self.batch(np.sort(index[first:first + batch_size]) if not shuffle else index[first:first + batch_size])
+
+    # every window at once, for data that fits in memory
+    def arrays(self):
+        return self.batch(np.arange(len(self.starts)))
+
+    # first ~fraction of the windows / the rest, cut at a trajectory boundary
+    def split(self, fraction=0.8):
+        if len(self.starts) == 0:
+            return self, self
+        cut_angle = self.starts[min(int(fraction * len(self.starts)), len(self.starts) - 1)]
+        boundary = self.bounds[np.searchsorted(self.bounds, cut_angle, side="left")]
+        cut = int(np.searchsorted(self.starts, boundary, side="left"))
+        return (WindowDataset(self.angles, self.starts[:cut], self.length, self.bounds),
+                WindowDataset(self.angles, self.starts[cut:], self.length, self.bounds))
+
+    # tf.data pipeline over batches() (TensorFlow imported on use)
+    def tf_dataset(self, batch_size=32, shuffle=False, seed=None):
+        import tensorflow as tf
+        signature = (tf.TensorSpec((None, self.length, 1), tf.float32), tf.TensorSpec((None,), tf.float32))
+        dataset = tf.data.Dataset.from_generator(lambda: self.batches(batch_size, shuffle, seed), output_signature=signature)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the windowed training data of RNN.py")
+    parser.add_argument("source", type=str, nargs="?", default="dataset.npy", help="Recording directory or (N, 2) positions .npy")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Where to write the memory-mapped windows")
+    parser.add_argument("--length", type=int, default=ACCOUNTED_LENGTH, help="Window length")
+    parser.add_argument("--keep_still", action="store_true", help="Keep the steps that do not move")
+    args = parser.parse_args()
+
+    data = WindowDataset.from_source(args.source, args.length, args.cache_dir, drop_still=not args.keep_still, rebuild=True)
+    train, val = data.split(0.8)
+    print(f"{len(data.bounds) - 1} trajectories, {len(data.angles)} angles, {len(data)} windows "
+          f"({len(train)} train / {len(val)} validation)")
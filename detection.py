@@ -0,0 +1,204 @@
+import argparse
+import collections
+import threading
+import time
+import traceback
+import numpy as np
+
+# Detector output of one frame, in the (xyxys, confidences, class_ids) format
+# of simulation.predict plus where it came from:
+#   frame     engine frame the image was captured at
+#   captured  perf_counter() at capture
+#   latency   seconds the detector took on it
+class Detections(collections.namedtuple("Detections", ["xyxys", "confidences", "class_ids", "frame", "captured", "latency"])):
+    __slots__ = ()
+
+    # what Engine.step / car_control_logic_passive take
+    @property
+    def boxes(self):
+        return self.xyxys, self.confidences, self.class_ids
+
+    # frames / seconds since the image was captured
+    def age(self, frame, now=None):
+        now = time.perf_counter() if now is None else now
+        return frame - self.frame, now - self.captured
+
+
+NO_DETECTIONS = Detections([], [], [], -1, 0.0, 0.0)
+
+
+class DetectionStats:
+    def __init__(self, keep=10000):
+        self.submitted = 0
+        self.skipped = 0    # frames not sent to the detector (detect every N frames)
+        self.dropped = 0    # frames replaced by a newer one before the detector got to them
+        self.processed = 0
+        self.errors = 0     # frames detect() raised on (threaded: the worker carries on)
+        self.latencies = collections.deque(maxlen=keep)       # detector time (s)
+        self.staleness = collections.deque(maxlen=keep)       # age of the consumed result (s)
+        self.staleness_frames = collections.deque(maxlen=keep)  # ... in frames
+
+    def summary(self):
+        summary = {"submitted": self.submitted, "skipped": self.skipped, "dropped": self.dropped, "processed": self.processed,
+                   "errors": self.errors}
+        for name, values, scale in [("latency_ms", self.latencies, 1e3), ("staleness_ms", self.staleness, 1e3),
+                                    ("staleness_frames", self.staleness_frames, 1)]:
+            if len(values):
+                values = np.array(values) * scale
+                summary[f"{name}_mean"] = float(values.mean())
+                summary[f"{name}_p50"] = float(np.percentile(values, 50))
+                summary[f"{name}_p99"] = float(np.percentile(values, 99))
+        return summary
+
+
+# Runs detect(image) -> (xyxys, confidences, class_ids) off the control loop.
+# The loop hands over frames with submit() and reads the newest result with
+# latest(), neither of them waits for the detector:
+#  - there is a single pending slot, a frame that is still waiting when a newer
+#    one comes in is dropped (the detector always works on the latest frame)
+#  - latest() returns the last finished result with its frame / capture time,
+#    so the caller knows how old the boxes are
+#  - every: only every N-th frame is offered to the detector (wants())
+# threaded=False runs detect inline in submit() (same results as calling it
+# directly, for deterministic runs).
+# release(image), if given, is called once the detector is done with an image:
+# after it was detected, or when it was dropped for a newer one (capture.FrameCapture
+# reuses the buffer then).
+class AsyncDetector:
+    def __init__(self, detect, every=1, threaded=True, release=None):
+        self.detect = detect
+        self.release = release
+        self.every = max(int(every), 1)
+        self.threaded = threaded
+        self.stats = DetectionStats()
+
+        self.result = NO_DETECTIONS
+        self.error = None  # last exception of detect() on the worker
+        self.pending = None  # (image, frame, captured)
+        self.condition = threading.Condition()
+        self.running = True
+        self.worker = None
+        if threaded:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    # whether the frame should be captured and submitted at all
+    # (lets the caller skip the screenshot on the other frames)
+    def wants(self, frame):
+        if frame % self.every == 0:
+            return True
+        self.stats.skipped += 1
+        return False
+
+    def submit(self, image, frame, captured=None):
+        captured = time.perf_counter() if captured is None else captured
+        self.stats.submitted += 1
+        if not self.threaded:
+            self.process(image, frame, captured)
+            return
+
+        with self.condition:
+            dropped = self.pending
+            if dropped is not None:
+                self.stats.dropped += 1
+            self.pending = (image, frame, captured)
+            self.condition.notify()
+        if dropped is not None and self.release is not None:
+            self.release(dropped[0])
+
+    def process(self, image, frame, captured):
+        start = time.perf_counter()
+        try:
+            xyxys, confidences, class_ids = self.detect(image)
+            latency = time.perf_counter() - start
+        finally:
+            if self.release is not None:
+                self.release(image)
+        with self.condition:
+            self.stats.processed += 1
+            self.stats.latencies.append(latency)
+            # the worker only ever takes the newest frame, but keep the check cheap and explicit
+            if frame >= self.result.frame:
+                self.result = Detections(xyxys, confidences, class_ids, frame, captured, latency)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                image, frame, captured = self.pending
+                self.pending = None
+            # a frame detect() fails on is lost, not the worker: it is counted,
+            # the first traceback printed, and latest() keeps the last good result
+            try:
+                self.process(image, frame, captured)
+            except Exception as error:
+                with self.condition:
+                    self.stats.errors += 1
+                    self.error = error
+                    first = self.stats.errors == 1
+                if first:
+                    traceback.print_exc()
+
+    # newest finished result (NO_DETECTIONS before the first one)
+    # frame: the frame it is consumed at, for the staleness metrics
+    def latest(self, frame=None):
+        with self.condition:
+            result = self.result
+        if result is not NO_DETECTIONS and frame is not None:
+            age_frames, age = result.age(frame)
+            self.stats.staleness_frames.append(age_frames)
+            self.stats.staleness.append(age)
+        return result
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            pending, self.pending = self.pending, None
+            self.condition.notify()
+        if self.worker is not None:
+            self.worker.join()
+        if pending is not None and self.release is not None:
+            self.release(pending[0])
+
+
+if __name__ == "__main__":
+    # effect of detector latency / frame skipping on the passive controller,
+    # headless and paced at FPS: the "image" is the ground truth boxes of the
+    # frame and the detector just sleeps for --latency ms before returning them
+    from engine import Engine, FPS, ground_truth_detections, summarize
+
+    parser = argparse.ArgumentParser(description="Asynchronous detection with a simulated detector latency")
+    parser.add_argument("--latency", type=float, default=30, help="Simulated detector latency (ms)")
+    parser.add_argument("--every", type=int, default=1, help="Detect every N frames")
+    parser.add_argument("--sync", action="store_true", help="Run the detector inline (blocking)")
+    parser.add_argument("--n_rounds", type=int, default=5, help="Number of rounds to run")
+    parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric")
+    parser.add_argument("--num_pedestrian", type=int, default=1, help="Number of pedestrians")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the pedestrian cases")
+    args = parser.parse_args()
+
+    def delayed_ground_truth(boxes):
+        time.sleep(args.latency / 1000)
+        return boxes
+
+    detector = AsyncDetector(delayed_ground_truth, every=args.every, threaded=not args.sync)
+    engine = Engine("passive", args.metric, num_pedestrian=args.num_pedestrian, seed=args.seed)
+    start = time.perf_counter()
+    next_frame = start
+    while engine.rounds < args.n_rounds:
+        if detector.wants(engine.frame):
+            detector.submit(ground_truth_detections(engine.car, engine.pedestrians), engine.frame)
+        engine.step(detector.latest(engine.frame).boxes)
+
+        next_frame += 1 / FPS
+        time.sleep(max(next_frame - time.perf_counter(), 0))
+    elapsed = time.perf_counter() - start
+    detector.close()
+
+    summary = summarize(engine.results[:args.n_rounds])
+    print(summary)
+    print(f"{engine.frame / elapsed:.1f} frames/s (target {FPS})")
+    print(detector.stats.summary())
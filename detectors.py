@@ -0,0 +1,204 @@
+import argparse
+import time
+import numpy as np
+import pygame
+from object import WIDTH, HEIGHT, PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT
+from object import RED, BLUE
+from engine import ground_truth_detections, CAR_CLASS_ID, PERSON_CLASS_ID
+
+GREEN = (0, 255, 0)
+WHITE = (255, 255, 255)
+
+# colors simulation.py draws on top of the scene (paths, predicted paths, boxes),
+# not objects
+OVERLAY_COLORS = (RED, GREEN, BLUE)
+
+
+def empty_detections():
+    return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+
+def as_arrays(xyxys, confidences, class_ids):
+    if len(xyxys) == 0:
+        return empty_detections()
+    return (np.asarray(xyxys, dtype=np.float32).reshape(-1, 4),
+            np.asarray(confidences, dtype=np.float32), np.asarray(class_ids, dtype=np.float32))
+
+
+# Detector errors to put on top of any backend:
+#   jitter               std (px) of the noise added to every box coordinate
+#   miss_rate            probability that a box is dropped
+#   false_positive_rate  probability per frame of an extra person box somewhere on screen
+class DetectionNoise:
+    def __init__(self, jitter=0.0, miss_rate=0.0, false_positive_rate=0.0, seed=None):
+        self.jitter = jitter
+        self.miss_rate = miss_rate
+        self.false_positive_rate = false_positive_rate
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, detections):
+        xyxys, confidences, class_ids = detections
+        if self.miss_rate > 0:
+            keep = self.rng.random(len(xyxys)) >= self.miss_rate
+            xyxys, confidences, class_ids = xyxys[keep], confidences[keep], class_ids[keep]
+        if self.jitter > 0:
+            xyxys = xyxys + self.rng.normal(0, self.jitter, xyxys.shape).astype(np.float32)
+        if self.false_positive_rate > 0 and self.rng.random() < self.false_positive_rate:
+            x = self.rng.uniform(0, WIDTH - PEDESTRIAN_WIDTH)
+            y = self.rng.uniform(0, HEIGHT - PEDESTRIAN_HEIGHT)
+            box = np.array([[x, y, x + PEDESTRIAN_WIDTH, y + PEDESTRIAN_HEIGHT]], dtype=np.float32)
+            xyxys = np.concatenate([xyxys, box])
+            confidences = np.append(confidences, np.float32(self.rng.uniform(0.25, 0.6)))
+            class_ids = np.append(class_ids, np.float32(PERSON_CLASS_ID))
+        return xyxys, confidences, class_ids
+
+
+# Detector interface: detector(frame) -> (xyxys (k, 4), confidences (k,), class_ids (k,))
+# as float32 arrays in screen coordinates (the format car_control_logic_passive takes).
+# source says what frame has to be:
+#   "image"    (H, W, 3) BGR array, e.g. from capture.FrameCapture
+#   "surface"  the pygame surface the scene is drawn on
+#   None       nothing, the detector reads the objects itself
+class Detector:
+    source = None
+
+    def __init__(self, noise: DetectionNoise = None):
+        self.noise = noise
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+    def __call__(self, frame=None):
+        detections = self.detect(frame)
+        return detections if self.noise is None else self.noise(detections)
+
+
+# the rects the sprites are blitted at, no image involved
+class GroundTruthDetector(Detector):
+    def __init__(self, car, pedestrians, noise=None):
+        super().__init__(noise)
+        self.car = car
+        self.pedestrians = pedestrians
+
+    def detect(self, frame=None):
+        return as_arrays(*ground_truth_detections(self.car, self.pedestrians))
+
+
+# Connected components of the non-background pixels of the drawn scene.
+# The sprites are mostly white inside, so the foreground mask is dilated
+# (convolved with a merge x merge block) before labelling, which joins the
+# fragments of one sprite, and the boxes are shrunk back afterwards.
+# Works on a copy of the surface downscaled by `scale`, wider than tall = car.
+class ComponentDetector(Detector):
+    source = "surface"
+
+    def __init__(self, scale=4, background=WHITE, threshold=40, merge=20, min_size=10,
+                 overlay_colors=OVERLAY_COLORS, noise=None):
+        super().__init__(noise)
+        self.scale = max(int(scale), 1)
+        self.background = background
+        self.threshold = (threshold, threshold, threshold, 255)
+        self.kernel_size = max(merge // self.scale, 1)
+        self.kernel = pygame.mask.Mask((self.kernel_size, self.kernel_size), fill=True)
+        self.min_size = min_size
+        self.overlay_colors = overlay_colors
+        self.small = None
+
+    def detect(self, surface):
+        if self.scale > 1:
+            size = (surface.get_width() // self.scale, surface.get_height() // self.scale)
+            if self.small is None or self.small.get_size() != size:
+                self.small = pygame.Surface(size, depth=32)
+            pygame.transform.scale(surface, size, self.small)
+            surface = self.small
+
+        foreground = pygame.mask.from_threshold(surface, self.background, self.threshold)
+        foreground.invert()
+        for color in self.overlay_colors:
+            foreground.erase(pygame.mask.from_threshold(surface, color, (30, 30, 30, 255)), (0, 0))
+
+        grow = self.kernel_size - 1
+        boxes = []
+        for rect in foreground.convolve(self.kernel).get_bounding_rects():
+            width, height = rect.w - grow, rect.h - grow
+            if width * self.scale < self.min_size or height * self.scale < self.min_size:
+                continue
+            boxes.append((rect.x, rect.y, rect.x + width, rect.y + height))
+        if not boxes:
+            return empty_detections()
+
+        xyxys = np.array(boxes, dtype=np.float32) * self.scale
+        widths, heights = xyxys[:, 2] - xyxys[:, 0], xyxys[:, 3] - xyxys[:, 1]
+        class_ids = np.where(widths > heights, CAR_CLASS_ID, PERSON_CLASS_ID).astype(np.float32)
+        return xyxys, np.ones(len(xyxys), dtype=np.float32), class_ids
+
+
+# YOLOv8 (YOLO.py), loaded on first use
+class YOLODetector(Detector):
+    source = "image"
+
+    def detect(self, image):
+        from YOLO import predict_batch, frame_detections
+        boxes, counts = predict_batch([image])
+        return frame_detections(boxes, counts, 0)
+
+
+DETECTORS = ["ground_truth", "components", "yolo"]
+
+
+def make_detector(name, car=None, pedestrians=None, noise=None, **kwargs):
+    if name == "ground_truth":
+        return GroundTruthDetector(car, pedestrians, noise=noise)
+    if name == "components":
+        return ComponentDetector(noise=noise, **kwargs)
+    if name == "yolo":
+        return YOLODetector(noise=noise)
+    raise ValueError(f"unknown detector: {name}")
+
+
+if __name__ == "__main__":
+    # passive controller, headless, driven by each detector backend
+    from engine import Engine, summarize
+    from capture import FrameCapture
+
+    parser = argparse.ArgumentParser(description="Run the passive controller with different detectors")
+    parser.add_argument("--detectors", type=str, nargs="+", default=["ground_truth", "components"], choices=DETECTORS, help="Detector backends")
+    parser.add_argument("--n_rounds", type=int, default=20, help="Number of rounds per detector")
+    parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric")
+    parser.add_argument("--num_pedestrian", type=int, default=1, help="Number of pedestrians")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the pedestrian cases and the noise")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Box noise std (px)")
+    parser.add_argument("--miss_rate", type=float, default=0.0, help="Probability of missing a box")
+    parser.add_argument("--false_positive_rate", type=float, default=0.0, help="Probability of a false person box per frame")
+    args = parser.parse_args()
+
+    car_image = pygame.image.load("car.jpg")
+    pedestrian_image = pygame.image.load("pedestrian.jpg")
+
+    for name in args.detectors:
+        noise = None
+        if args.jitter or args.miss_rate or args.false_positive_rate:
+            noise = DetectionNoise(args.jitter, args.miss_rate, args.false_positive_rate, seed=args.seed)
+        engine = Engine("passive", args.metric, num_pedestrian=args.num_pedestrian, seed=args.seed,
+                        car_image=car_image, pedestrian_image=pedestrian_image)
+        detector = make_detector(name, engine.car, engine.pedestrians, noise)
+
+        # image based detectors look at the frame drawn from the current state
+        surface = pygame.Surface((WIDTH, HEIGHT), depth=32) if detector.source is not None else None
+        frame_capture = FrameCapture(surface) if detector.source == "image" else None
+
+        start = time.perf_counter()
+        while engine.rounds < args.n_rounds:
+            frame = None
+            if surface is not None:
+                surface.fill(WHITE)
+                engine.draw(surface)
+                frame = frame_capture.capture() if frame_capture is not None else surface
+            engine.step(detector(frame))
+            if frame_capture is not None:
+                frame_capture.release(frame)
+        elapsed = time.perf_counter() - start
+
+        summary = summarize(engine.results[:args.n_rounds])
+        print(f"{name:12s} {engine.frame / elapsed:9.0f} frames/s  collisions {summary['collisions']}  "
+              f"mean round time {summary['mean_round_time']:.2f} s  mean min distance {summary['mean_min_distance']:.1f}")
@@ -0,0 +1,408 @@
+import argparse
+import random
+import time
+import numpy as np
+from object import Car, Pedestrian
+from object import HEIGHT, WIDTH, COLLIDE_DISTANCE
+import control
+from control import car_control_logic_active, car_control_logic_passive, is_colliding, get_distance, control_region
+from spatial import SpatialGrid
+from profiler import NULL_PROFILER
+
+# Frame rate the physics was tuned for, one step() is one frame of 1/FPS seconds
+FPS = 60
+
+# safety net for headless runs: a round that takes longer than this is cut off
+# (e.g. the car stopped forever in front of a pedestrian)
+MAX_ROUND_FRAMES = 3000
+
+# crowd mode: pedestrians cross anywhere in this range of x offsets from the middle
+# of the screen and start up to CROWD_DEPTH px above the top (so they arrive spread out)
+CROWD_SPREAD = (-600, 600)
+CROWD_DEPTH = 800
+
+# YOLO class id of a car (COCO), used for the ground truth boxes
+CAR_CLASS_ID = 2
+PERSON_CLASS_ID = 0
+
+
+def ground_truth_detections(car: Car, pedestrians: list[Pedestrian]):
+    # boxes in the same format as simulation.predict, taken straight from the rects
+    xyxys, confidences, class_ids = [], [], []
+    for obj, cls in [(car, CAR_CLASS_ID)] + [(p, PERSON_CLASS_ID) for p in pedestrians]:
+        xyxys.append((obj.rect.left, obj.rect.top, obj.rect.right, obj.rect.bottom))
+        confidences.append(1.0)
+        class_ids.append(cls)
+    return xyxys, confidences, class_ids
+
+
+# The simulated world without any window / clock.
+# step() advances exactly one fixed timestep (one frame), so the same code is
+# used by the rendered simulation (paced by clock.tick) and by headless runs
+# (stepped as fast as the CPU allows).
+class Engine:
+    def __init__(self, flag="passive", metric="distance", num_pedestrian=1, seed=None,
+                 car_image=None, pedestrian_image=None, surface=None, transport=None,
+                 recorder=None, max_round_frames=MAX_ROUND_FRAMES, control_params=None, cases=None, tracker=None,
+                 crowd=False, broad_phase=None, profiler=None, event_driven=False, exact_kinematics=False, episode_log=None):
+        self.flag = flag
+        self.metric = metric
+        self.rng = random.Random(seed)
+        # extra keyword arguments for the controller (distance_threshold, ttc_window, lookahead)
+        self.control_params = control_params or {}
+        # the Pedestrian.case values a round is drawn from, None = all four
+        # (and the very first round keeps the Pedestrian default)
+        self.cases = cases
+
+        # surface to draw the controller's paths on, None when headless
+        self.surface = surface
+        # active mode: transport.Transport the pedestrians send their paths through
+        # (the receiving side fills control.precomputed_paths),
+        # None = write them straight into control.precomputed_paths
+        self.transport = transport
+        # optional recorder.TrajectoryRecorder that gets every pedestrian position
+        # with its round, pedestrian id, case and frame (training data for RNN.py)
+        self.recorder = recorder
+        # optional replay.EpisodeLogger that gets what the controller saw and decided
+        # every frame (car, pedestrians, received paths, detections), for replay.py
+        self.episode_log = episode_log
+        # None = no limit (interactive runs)
+        self.max_round_frames = max_round_frames
+        # passive mode: tracker.Tracker that turns the detections into the tracks
+        # the controller predicts from, None = read the Pedestrian objects directly
+        self.tracker = tracker
+
+        # crowd: every round the pedestrians get a random crossing point and start delay
+        # (Pedestrian offset) instead of all walking the same route
+        self.crowd = crowd
+        # only let the controller and the collision check look at the pedestrians a
+        # SpatialGrid finds near the car (same results, cost grows with the pedestrians
+        # near the car instead of all of them), on by default in crowd mode
+        self.broad_phase = crowd if broad_phase is None else broad_phase
+        self.grid = SpatialGrid() if self.broad_phase else None
+        # the grid holds the pedestrian positions of the end of the last step, which are
+        # still the positions at the next control step (a new round does not move them)
+        self.grid_valid = False
+        # profiler.Profiler that times the stages of step(), None = off
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
+        self.car = Car(car_image)
+        # ttc metric: the car ttc is the number of frames Car.update really needs to
+        # reach the intersection (kinematics.Kinematics) instead of the continuous
+        # calculate_elapsed_time estimate
+        if exact_kinematics:
+            from kinematics import for_car
+            self.control_params = dict(self.control_params, kinematics=for_car(self.car))
+        # active ttc: decide with an events.TTCScheduler, which only re-evaluates the
+        # ttc when a path update arrives or the decision is due to flip
+        # (same decisions, no per-frame calculate_ttc, no broad phase needed)
+        self.scheduler = None
+        if event_driven and flag == "active" and metric == "ttc":
+            from events import TTCScheduler
+            self.scheduler = TTCScheduler(**{key: self.control_params[key] for key in ("ttc_window", "lookahead", "kinematics")
+                                             if key in self.control_params})
+        self.pedestrians = [Pedestrian(pedestrian_image, id=i) for i in range(num_pedestrian)]
+        if cases is not None or crowd:
+            for pedestrian in self.pedestrians:
+                if cases is not None:
+                    pedestrian.case = self.rng.choice(cases)
+                if crowd:
+                    pedestrian.offset = self.crowd_offset()
+                pedestrian.start_new_round()
+
+        self.frame = 0
+        self.rounds = 0
+        self.round_frame = 0
+        self.round_collisions = 0
+        # closest car - pedestrian distance seen in the current round
+        self.round_min_distance = float("inf")
+        self.results = []
+        if episode_log is not None:
+            episode_log.begin(self)
+
+    def start_new_round(self, timeout=False):
+        self.results.append({
+            "round": self.rounds,
+            "cases": [pedestrian.case for pedestrian in self.pedestrians],
+            "frames": self.round_frame,
+            "time": self.round_frame / FPS,
+            "collisions": self.round_collisions,
+            "min_distance": self.round_min_distance,
+            "timeout": timeout,
+        })
+        self.rounds += 1
+        self.round_frame = 0
+        self.round_collisions = 0
+        self.round_min_distance = float("inf")
+
+        self.car.start_new_round()
+        for pedestrian in self.pedestrians:
+            if self.cases is None:
+                pedestrian.case = self.rng.randrange(4)
+            else:
+                pedestrian.case = self.rng.choice(self.cases)
+            if self.crowd:
+                pedestrian.offset = self.crowd_offset()
+            pedestrian.collide = False
+            pedestrian.start_new_round()
+
+    def crowd_offset(self):
+        return (self.rng.randint(*CROWD_SPREAD), self.rng.randint(0, CROWD_DEPTH))
+
+    def pedestrian_positions(self):
+        return np.array([(p.rect.x, p.rect.y) for p in self.pedestrians], dtype=np.int64).reshape(-1, 2)
+
+    # broad phase: the pedestrians whose rect corner is inside region
+    def nearby_pedestrians(self, region):
+        if not self.grid_valid:
+            self.grid.build(self.pedestrian_positions())
+            self.grid_valid = True
+        return [self.pedestrians[i] for i in self.grid.query(*region).tolist()]
+
+    # ... for other objects with a rect (tracks)
+    def nearby(self, objects, region):
+        positions = np.array([(obj.rect.x, obj.rect.y) for obj in objects], dtype=np.int64).reshape(-1, 2)
+        return [objects[i] for i in SpatialGrid().build(positions).query(*region).tolist()]
+
+    def send_path(self, pedestrian: Pedestrian):
+        if self.transport is not None:
+            self.transport.send(pedestrian.pedestrian_id, pedestrian.path, pedestrian.path_index, pedestrian.speed)
+        else:
+            # same path object every frame, only the start moves (no copy, PathIndex is reused)
+            control.precomputed_paths[pedestrian.pedestrian_id] = {
+                "precomputed_path": pedestrian.path,
+                "start": pedestrian.path_index,
+                "speed": pedestrian.speed
+            }
+
+    # advance the world by one frame
+    # detections: (xyxys, confidences, class_ids) from a detector, ground truth if None
+    # returns the pedestrians that collided with the car during this frame
+    def step(self, detections=None):
+        car = self.car
+        pedestrians = self.pedestrians
+        stage = self.profiler.stage
+
+        # Check if the car reaches the end of the frame
+        # if yes, start a new round
+        if car.rect.x + car.width >= WIDTH:
+            self.start_new_round()
+        elif self.max_round_frames is not None and self.round_frame >= self.max_round_frames:
+            self.start_new_round(timeout=True)
+
+        if self.flag == "active":
+            # take in the path updates that arrived since the last frame
+            if self.transport is not None:
+                with stage("transport"):
+                    self.transport.poll()
+            with stage("control"):
+                if self.scheduler is not None:
+                    self.scheduler.control(car, pedestrians, surface=self.surface)
+                else:
+                    targets = pedestrians
+                    if self.grid is not None:
+                        targets = self.nearby_pedestrians(self.control_region())
+                    car_control_logic_active(car, targets, self.metric, surface=self.surface, **self.control_params)
+        elif self.flag == "passive":
+            if detections is None:
+                detections = ground_truth_detections(car, pedestrians)
+            xyxys, confidences, class_ids = detections
+            targets = pedestrians
+            if self.tracker is not None:
+                with stage("tracker"):
+                    targets = self.tracker.update(detections)
+            with stage("control"):
+                if self.grid is not None:
+                    if self.tracker is None:
+                        targets = self.nearby_pedestrians(self.control_region())
+                    else:
+                        targets = self.nearby(targets, self.control_region())
+                car_control_logic_passive(car, targets, xyxys, confidences, class_ids, self.metric,
+                                          surface=self.surface, profiler=self.profiler, **self.control_params)
+
+        if self.episode_log is not None:
+            self.episode_log.record(self, detections if self.flag == "passive" else None)
+
+        # move the car
+        car.update()
+
+        # Move pedestrian
+        with stage("pedestrians"):
+            if self.grid is not None:
+                collided = self.update_pedestrians_broad_phase()
+            else:
+                collided = self.update_pedestrians()
+
+        if self.flag == "active" and self.transport is not None:
+            with stage("transport"):
+                self.transport.flush()
+
+        if self.episode_log is not None:
+            self.episode_log.collided(len(collided))
+
+        self.frame += 1
+        self.round_frame += 1
+        return collided
+
+    def control_region(self):
+        params = {key: self.control_params[key] for key in ("distance_threshold", "lookahead") if key in self.control_params}
+        return control_region(self.car, self.flag, self.metric, max_speed=max((p.speed for p in self.pedestrians), default=0), **params)
+
+    def update_pedestrians(self):
+        car = self.car
+        collided = []
+        for pedestrian in self.pedestrians:
+            pedestrian.update()
+            if self.recorder is not None:
+                self.recorder.record(self.rounds, pedestrian.pedestrian_id, pedestrian.case, self.round_frame,
+                                     pedestrian.rect.x, pedestrian.rect.y)
+            distance = get_distance((car.rect.x, car.rect.y), (pedestrian.rect.x, pedestrian.rect.y))
+            self.round_min_distance = min(self.round_min_distance, distance)
+            if pedestrian.collide is False:
+                pedestrian.collide = is_colliding(car, pedestrian)
+                if pedestrian.collide:
+                    self.round_collisions += 1
+                    collided.append(pedestrian)
+
+            if self.flag == "active":
+                self.send_path(pedestrian)
+
+            # Check if the pedestrian is leaving the intersection
+            if pedestrian.rect.y >= HEIGHT // 2:
+                pedestrian.entering = False
+        return collided
+
+    # same as update_pedestrians, but the distances are computed for everybody at
+    # once and only the pedestrians within COLLIDE_DISTANCE of the car are checked
+    def update_pedestrians_broad_phase(self):
+        car = self.car
+        pedestrians = self.pedestrians
+        for pedestrian in pedestrians:
+            pedestrian.update()
+            if self.recorder is not None:
+                self.recorder.record(self.rounds, pedestrian.pedestrian_id, pedestrian.case, self.round_frame,
+                                     pedestrian.rect.x, pedestrian.rect.y)
+            if self.flag == "active":
+                self.send_path(pedestrian)
+            if pedestrian.rect.y >= HEIGHT // 2:
+                pedestrian.entering = False
+
+        positions = self.pedestrian_positions()
+        if len(positions):
+            dx = (positions[:, 0] - car.rect.x).astype(float)
+            dy = (positions[:, 1] - car.rect.y).astype(float)
+            self.round_min_distance = min(self.round_min_distance, float(np.sqrt(dx**2 + dy**2).min()))
+
+        collided = []
+        self.grid.build(positions)
+        self.grid_valid = True
+        for i in self.grid.query(car.rect.x - COLLIDE_DISTANCE, car.rect.y - COLLIDE_DISTANCE,
+                                 car.rect.x + COLLIDE_DISTANCE, car.rect.y + COLLIDE_DISTANCE).tolist():
+            pedestrian = pedestrians[i]
+            if pedestrian.collide is False:
+                pedestrian.collide = is_colliding(car, pedestrian)
+                if pedestrian.collide:
+                    self.round_collisions += 1
+                    collided.append(pedestrian)
+        return collided
+
+    def draw(self, surface):
+        self.car.draw(surface)
+        for pedestrian in self.pedestrians:
+            pedestrian.draw(surface)
+
+    # step until n_rounds rounds are finished, returns the per-round results
+    def run(self, n_rounds):
+        profiler = self.profiler
+        while self.rounds < n_rounds:
+            profiler.begin_frame()
+            self.step()
+            profiler.end_frame()
+        return self.results[:n_rounds]
+
+
+def summarize(results):
+    frames = sum(r["frames"] for r in results)
+    return {
+        "rounds": len(results),
+        "collisions": sum(r["collisions"] for r in results),
+        "collision_rate": sum(r["collisions"] > 0 for r in results) / max(len(results), 1),
+        "timeouts": sum(r["timeout"] for r in results),
+        "mean_round_time": sum(r["time"] for r in results) / max(len(results), 1),
+        "mean_min_distance": sum(r["min_distance"] for r in results) / max(len(results), 1),
+        "frames": frames,
+        "sim_time": frames / FPS,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless car and pedestrian simulation")
+    parser.add_argument("--flag", type=str, default="passive", choices=["active", "passive"], help="active or passive pedestrian detection")
+    parser.add_argument("--n_rounds", type=int, default=100, help="Number of rounds to run")
+    parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric (distance or ttc)")
+    parser.add_argument("--num_pedestrian", type=int, default=1, help="Number of pedestrians")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the pedestrian cases")
+    parser.add_argument("--record", type=str, default=None, help="Record the pedestrian trajectories into this directory")
+    parser.add_argument("--crowd", action="store_true", help="Spread the pedestrians out (random crossing points and start delays)")
+    parser.add_argument("--no_broad_phase", action="store_true", help="Check every pedestrian every frame, even in crowd mode")
+    parser.add_argument("--tracker", action="store_true", help="Passive mode: control from tracked detections instead of the pedestrian objects")
+    parser.add_argument("--transport", type=str, default="direct", choices=["direct", "queue", "udp", "v2x"], help="Channel for the active mode paths")
+    parser.add_argument("--event_driven", action="store_true", help="Active ttc: only re-evaluate the ttc on path updates / decision flips")
+    parser.add_argument("--exact_kinematics", action="store_true", help="ttc: use the exact frames the car needs instead of the continuous estimate")
+    parser.add_argument("--episode_log", type=str, default=None, help="Log what the controller saw and decided every frame into this directory (replay.py)")
+    parser.add_argument("--profile", action="store_true", help="Time the stages of every frame and print a summary")
+    parser.add_argument("--profile_jsonl", type=str, default=None, help="Append profiler snapshots to this JSONL file (implies --profile)")
+    parser.add_argument("--profile_prometheus", type=str, default=None, help="Write the profiler histograms to this file in Prometheus text format (implies --profile)")
+    args = parser.parse_args()
+
+    transport = None
+    if args.transport != "direct":
+        from transport import make_transport
+        transport = make_transport(args.transport, control.precomputed_paths)
+    tracker = None
+    if args.tracker:
+        from tracker import Tracker
+        tracker = Tracker()
+    recorder = None
+    if args.record:
+        from recorder import TrajectoryRecorder
+        recorder = TrajectoryRecorder(args.record)
+    episode_log = None
+    if args.episode_log:
+        from replay import EpisodeLogger
+        episode_log = EpisodeLogger(args.episode_log)
+    profiler = None
+    if args.profile or args.profile_jsonl or args.profile_prometheus:
+        from profiler import Profiler
+        profiler = Profiler(jsonl_path=args.profile_jsonl)
+    engine = Engine(args.flag, args.metric, num_pedestrian=args.num_pedestrian, seed=args.seed, transport=transport, tracker=tracker,
+                    recorder=recorder,
+                    crowd=args.crowd, broad_phase=False if args.no_broad_phase else None, profiler=profiler,
+                    event_driven=args.event_driven, exact_kinematics=args.exact_kinematics, episode_log=episode_log)
+    start = time.perf_counter()
+    results = engine.run(args.n_rounds)
+    elapsed = time.perf_counter() - start
+
+    if recorder is not None:
+        recorder.close()
+        print(f"{recorder.records} records saved to {args.record}")
+    if episode_log is not None:
+        episode_log.close()
+        print(f"{episode_log.counts['frames']} frames logged to {args.episode_log}")
+
+    summary = summarize(results)
+    summary["wall_time"] = elapsed
+    summary["speedup"] = summary["sim_time"] / elapsed if elapsed > 0 else float("inf")
+    print(summary)
+    if engine.scheduler is not None:
+        print(engine.scheduler.summary())
+    if profiler is not None:
+        profiler.close()
+        print(profiler.summary())
+        if args.profile_prometheus:
+            profiler.write_prometheus(args.profile_prometheus)
+    if transport is not None:
+        print(transport.stats.summary())
+        if args.transport == "v2x":
+            print(transport.server.store.stats.summary())
+        transport.close()
@@ -0,0 +1,253 @@
+import argparse
+import collections
+import time
+import numpy as np
+import pygame
+import control
+from control import TTC_WINDOW, ACTIVE_LOOKAHEAD, RED
+from object import WIDTH
+from kinematics import for_car
+from ttc_func import INTERSECTION_BAND, calculate_elapsed_time_array
+
+# frames a plan looks ahead at most, after that it is simply made again
+HORIZON = 240
+
+# paths whose first-hit tables are cached (paths are shared route tuples, see object.route_cache)
+MAX_CACHED_PATHS = 1024
+
+
+# Event-driven version of the ttc branch of car_control_logic_active.
+#
+# Between two path updates everything the active ttc decision depends on is
+# known in advance: the pedestrians walk one step of their precomputed path per
+# frame, and the car only accelerates or decelerates. So instead of calling
+# calculate_ttc for every pedestrian every frame, a plan is made once:
+#   - the car is stepped forward in its current mode (kinematics tables of Car.update),
+#   - the ttc condition of every pedestrian is evaluated for all those frames
+#     at once (one array over pedestrians x frames),
+#   - the first frame where the decision flips is the next event.
+# Until that frame the decision is known and the only per-frame work is
+# checking that the world still is what the plan assumed (car position / speed,
+# path object and start of every pedestrian). A path update that arrives, the
+# car being reset by a new round, or reaching the event makes a new plan.
+# Same decisions as car_control_logic_active(metric="ttc") frame for frame.
+# kinematics: kinematics.Kinematics for the car ttc, like car_control_logic_active
+class TTCScheduler:
+    def __init__(self, ttc_window=TTC_WINDOW, lookahead=ACTIVE_LOOKAHEAD, horizon=HORIZON, kinematics=None):
+        self.ttc_window = ttc_window
+        self.lookahead = lookahead
+        self.horizon = horizon
+        self.kinematics = kinematics
+        self.tables = {}
+        # (speed, mode, ...) -> x offsets / speeds of the car over the horizon
+        self.projections = {}
+        # the path tables of the last plan, joined into one array per table
+        self.joined_key = None
+        self.joined = None
+
+        self.planned = False
+        self.k = 0
+        self.decision = False
+        self.end = 0          # frames of the plan: decision holds for k < end
+        self.car_x = []       # planned car x / speed, index k
+        self.car_speed = []
+        self.car_y = None
+        self.pedestrians = None
+        self.watch = []       # (pedestrian id, path or None, start at k = 0, path length)
+        # frames until each pedestrian enters the ttc window under the current plan
+        # (pedestrian id -> k, only the ones that do within the plan)
+        self.entries = {}
+
+        self.frames = 0
+        self.plans = 0
+        self.plan_time = 0.0
+        self.reasons = collections.Counter()
+
+    # first_hit(path, car_y, start) and the x of that point for every start
+    # 0 .. len(path) as two tables (-1 = no hit), so the first hit of any frame is a lookup
+    def path_table(self, path, car_y):
+        key = (id(path), car_y)
+        cached = self.tables.get(key)
+        if cached is not None and cached[0] is path:
+            return cached[1], cached[2]
+        points = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+        dy = points[:, 1] - car_y
+        hits = np.flatnonzero((-INTERSECTION_BAND < dy) & (dy < INTERSECTION_BAND))
+        first = np.searchsorted(hits, np.arange(len(points) + 1))
+        found = first < len(hits)
+        steps = np.where(found, hits[np.minimum(first, len(hits) - 1)] if len(hits) else -1, -1)
+        xs = np.where(found, points[np.maximum(steps, 0), 0] if len(points) else 0, 0)
+        if len(self.tables) >= MAX_CACHED_PATHS:
+            self.tables.clear()
+        self.tables[key] = (path, steps, xs)
+        return steps, xs
+
+    # does the world still match the plan at frame k
+    def check(self, car, pedestrians, paths):
+        k = self.k
+        if k >= self.end:
+            return "event" if self.end < len(self.car_x) else "horizon"
+        if car.rect.x != self.car_x[k] or car.speed != self.car_speed[k] or car.rect.y != self.car_y:
+            return "car"
+        # (the engine passes the same list every frame, a different one means other pedestrians)
+        if pedestrians is not self.pedestrians or len(pedestrians) != len(self.watch):
+            return "pedestrians"
+        get = paths.get
+        for pedestrian_id, path, start, length in self.watch:
+            entry = get(pedestrian_id)
+            if entry is None:
+                if path is not None:
+                    return "path"
+            elif entry["precomputed_path"] is not path or entry.get("start", 0) != (start + k if start + k < length else length):
+                return "path"
+        return None
+
+    def plan(self, car, pedestrians, paths):
+        self.plans += 1
+        self.k = 0
+        self.car_y = car.rect.y
+        self.pedestrians = pedestrians
+
+        # car states of the next frames, first assuming it keeps accelerating;
+        # if the decision right now is to brake, again assuming it keeps braking
+        for mode in (False, True):
+            car_x, car_speed = self.project(car, mode)
+            decisions, entries = self.evaluate(car, pedestrians, paths, car_x, car_speed)
+            if decisions[0] == mode:
+                break
+        self.decision = bool(decisions[0])
+        flips = np.flatnonzero(decisions != decisions[0])
+        self.end = int(flips[0]) if len(flips) else len(decisions)
+        self.car_x, self.car_speed = car_x.tolist(), car_speed.tolist()
+        self.entries = entries
+
+    # car x / speed for k = 0 .. horizon with decelerate_flag = mode every frame
+    # (up to the frame that reaches the right edge, a new round starts there)
+    def project(self, car, mode):
+        # the moves only depend on the speed and the mode (see kinematics.Kinematics)
+        key = (car.speed, mode, car.max_speed, car.acceleration, car.deceleration)
+        projection = self.projections.get(key)
+        if projection is None:
+            projection = self.projections[key] = for_car(car).trajectory(car.speed, self.horizon, mode)
+        offsets, speeds = projection
+        car_x = car.rect.x + offsets
+        edge = np.flatnonzero(car_x + car.width >= WIDTH)
+        n = edge[0] + 1 if len(edge) else len(car_x)
+        return car_x[:n], speeds[:n]
+
+    # the decision of every planned frame, and when each pedestrian's conflict starts
+    # all pedestrians x all frames at once: the path tables of the pedestrians are
+    # joined into one array and indexed with (pedestrian, frame) start steps
+    def evaluate(self, car, pedestrians, paths, car_x, car_speed):
+        self.watch = []
+        conflicting = []  # pedestrian ids, paths, starts, lengths of the ones with a path
+        for pedestrian in pedestrians:
+            pedestrian_id = pedestrian.pedestrian_id
+            entry = paths.get(pedestrian_id)
+            if entry is None:
+                self.watch.append((pedestrian_id, None, 0, 0))
+                continue
+            path = entry["precomputed_path"]
+            start = entry.get("start", 0)
+            self.watch.append((pedestrian_id, path, start, len(path)))
+            conflicting.append((pedestrian_id, path, start, len(path)))
+
+        decisions = np.zeros(len(car_x), dtype=bool)
+        if not conflicting:
+            return decisions, {}
+
+        key = tuple(id(path) for _, path, _, _ in conflicting) + (self.car_y,)
+        if key != self.joined_key:
+            tables = [self.path_table(path, self.car_y) for _, path, _, _ in conflicting]
+            lengths = np.array([length for *_, length in conflicting])
+            offsets = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+            self.joined = (np.concatenate([steps for steps, _ in tables]), np.concatenate([xs for _, xs in tables]),
+                           lengths, offsets)
+            self.joined_key = key
+        all_steps, all_xs, lengths, offsets = self.joined
+
+        starts = np.minimum(np.array([start for _, _, start, _ in conflicting])[:, None] + np.arange(len(car_x)), lengths[:, None])
+        index = offsets[:, None] + starts
+        step, x = all_steps[index], all_xs[index]
+
+        valid = (step >= 0) & (x > car_x)
+        distance = np.where(valid, x - car_x, 1)
+        if self.kinematics is not None:
+            car_ttc = self.kinematics.frames_to_reach(car_speed, distance)
+        else:
+            car_ttc = calculate_elapsed_time_array(distance, car_speed, car.acceleration, car.max_speed)
+        difference = car_ttc - (step - starts + 1)
+        conflict = valid & (-self.ttc_window < difference) & (difference < self.ttc_window) & (x - car_x < self.lookahead)
+        decisions = conflict.any(axis=0)
+
+        entries = {}
+        for row in np.flatnonzero(conflict.any(axis=1)).tolist():
+            entries[conflicting[row][0]] = int(np.argmax(conflict[row]))
+        return decisions, entries
+
+    # sets car.decelerate_flag like car_control_logic_active(metric="ttc")
+    def control(self, car, pedestrians, paths=None, surface=None):
+        paths = control.precomputed_paths if paths is None else paths
+        if surface is not None:
+            draw_paths(surface, pedestrians, paths)
+
+        reason = self.check(car, pedestrians, paths) if self.planned else "first"
+        if reason is not None:
+            self.reasons[reason] += 1
+            start = time.perf_counter()
+            self.plan(car, pedestrians, paths)
+            self.plan_time += time.perf_counter() - start
+            self.planned = True
+        self.frames += 1
+        car.decelerate_flag = self.decision
+        self.k += 1
+
+    # frames from now until the planned decision flips (None: no flip within the plan)
+    def next_event(self):
+        return self.end - self.k if self.planned and self.end < len(self.car_x) else None
+
+    def summary(self):
+        return {"frames": self.frames, "plans": self.plans,
+                "frames_per_plan": self.frames / self.plans if self.plans else 0.0,
+                "plan_us": self.plan_time / self.plans * 1e6 if self.plans else 0.0, "reasons": dict(self.reasons)}
+
+
+# the received paths, as car_control_logic_active draws them
+def draw_paths(surface, pedestrians, paths):
+    for pedestrian in pedestrians:
+        entry = paths.get(pedestrian.pedestrian_id)
+        if entry is None:
+            continue
+        path, start = entry["precomputed_path"], entry.get("start", 0)
+        if len(path) - start >= 2:
+            pygame.draw.lines(surface, RED, False, [(x + pedestrian.width // 2, y) for x, y in path[start:]], 3)
+
+
+if __name__ == "__main__":
+    # per-frame polling vs the event scheduler: same results, control cost per frame
+    from engine import Engine, summarize
+    from profiler import Profiler
+
+    parser = argparse.ArgumentParser(description="Compare per-frame and event-driven active ttc control")
+    parser.add_argument("--num_pedestrian", type=int, nargs="+", default=[1, 3, 10], help="Numbers of pedestrians")
+    parser.add_argument("--n_rounds", type=int, default=200, help="Number of rounds per run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    for n in args.num_pedestrian:
+        for event_driven in (False, True):
+            control.precomputed_paths.clear()
+            profiler = Profiler()
+            engine = Engine("active", "ttc", num_pedestrian=n, seed=args.seed, event_driven=event_driven, profiler=profiler)
+            start = time.perf_counter()
+            summary = summarize(engine.run(args.n_rounds))
+            elapsed = time.perf_counter() - start
+            control_time = profiler.stage("control").snapshot()
+            extra = ""
+            if event_driven:
+                scheduler = engine.scheduler.summary()
+                quiet = (control_time["mean"] * scheduler["frames"] - scheduler["plan_us"] * 1e-6 * scheduler["plans"]) / (scheduler["frames"] - scheduler["plans"])
+                extra = f"  {scheduler['frames_per_plan']:.1f} frames/plan, {scheduler['plan_us']:.0f} us/plan, {quiet * 1e6:.2f} us/quiet frame"
+
+            print(f"{n:3d} pedestrians, {'events ' if event_driven else 'polling'}: control {control_time['mean'] * 1e6:7.2f} us/frame  "
+                  f"total {elapsed / engine.frame * 1e6:7.2f} us/frame  collisions {summary['collisions']}  frames {summary['frames']}{extra}")
@@ -0,0 +1,244 @@
+import argparse
+import math
+import time
+import numpy as np
+from object import Car, WIDTH
+
+# the car is stepped from this x when the tables are built: pygame rounds the new
+# x half away from zero, so a speed < 0 (a deceleration that does not divide the
+# speed, for one frame) would move a car at x = 0 differently than one further right
+BASE_X = WIDTH
+
+# speeds tabled up front at most (more: the rows are made when they are queried)
+MAX_STATES = 4096
+# guards against parameters the car never settles with (e.g. acceleration 0)
+MAX_TRANSIENT = 100000
+
+ACCELERATE, BRAKE = 0, 1
+
+# plain numbers, checked with isinstance (np.ndim costs more than a whole single query)
+SCALAR = (int, float, np.number)
+
+
+# Exact model of Car.update.
+# The car is a discrete integrator: every frame the speed goes up by acceleration
+# (capped at max_speed one frame late) or down by deceleration (clamped at 0 one
+# frame late), then the int rect.x moves by the rounded speed. Only the speed and
+# the mode decide how far it moves, so:
+#   - the speeds the car can have usually form a small set (the floats
+#     Car.update produces from max_speed and 0, e.g. 0, 0.5, ..., 15.5 for the
+#     defaults), found once by stepping a Car
+#   - from every speed, in both modes, the car settles within a few frames
+#     (max_speed / 0); those frames are stepped once with Car.update and stored
+#     as tables, after them it moves a constant number of px per frame
+# Every query is a table lookup plus that constant tail (O(1), no loop over the
+# frames), and takes arrays: any shapes of speeds / distances / frames that
+# broadcast, e.g. (N, 1) cars against (N, M) targets.
+class Kinematics:
+    def __init__(self, max_speed=15, acceleration=1, deceleration=0.5, speeds=()):
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.ghost = Car()
+        self.ghost.max_speed, self.ghost.acceleration, self.ghost.deceleration = max_speed, acceleration, deceleration
+
+        # px per frame once settled: at max_speed, and standing still
+        self.rate = (self.step(max_speed, ACCELERATE)[1], self.step(0, BRAKE)[1])
+        # speed -> (offsets, speeds) until settled, in both modes
+        self.runs = {}
+
+        # every speed reachable from max_speed / 0 (and the given ones), when they
+        # stay on a small grid (they do when acceleration and deceleration have a
+        # common step, like the defaults), otherwise the rows are added when queried
+        found = {float(speed) for speed in (max_speed, 0, *speeds)}
+        pending = list(found)
+        while pending and len(found) <= MAX_STATES:
+            speed = pending.pop()
+            for mode in (ACCELERATE, BRAKE):
+                following = self.step(speed, mode)[0]
+                if following not in found:
+                    found.add(following)
+                    pending.append(following)
+        if len(found) > MAX_STATES:
+            found = {float(speed) for speed in (max_speed, 0, *speeds)}
+        self.build(found)
+
+    # (re)build the tables for these speeds
+    def build(self, speeds):
+        self.speeds = np.array(sorted(speeds))
+        self.speed_index = {speed: index for index, speed in enumerate(self.speeds.tolist())}
+        for speed in self.speeds.tolist():
+            if speed not in self.runs:
+                self.runs[speed] = (self.settle(speed, ACCELERATE), self.settle(speed, BRAKE))
+
+        # offsets[mode][state, k] / speed_after[mode][state, k]: x moved / speed after
+        # k frames, k = 0 .. frames (the longest time any speed needs to settle)
+        runs = [[self.runs[speed][mode] for speed in self.speeds.tolist()] for mode in (ACCELERATE, BRAKE)]
+        self.settle_frames = np.array([[len(offsets) - 1 for offsets, _ in run] for run in runs])
+        self.frames = int(self.settle_frames.max())
+        self.offsets, self.speed_after = [], []
+        for mode, run in enumerate(runs):
+            offsets = np.empty((len(self.speeds), self.frames + 1), dtype=np.int64)
+            speed_after = np.empty((len(self.speeds), self.frames + 1))
+            for state, (state_offsets, state_speeds) in enumerate(run):
+                n = len(state_offsets)
+                offsets[state, :n] = state_offsets
+                offsets[state, n:] = state_offsets[-1] + self.rate[mode] * np.arange(1, self.frames + 2 - n)
+                speed_after[state, :n] = state_speeds
+                speed_after[state, n:] = state_speeds[-1]
+            self.offsets.append(offsets)
+            self.speed_after.append(speed_after)
+
+        # reach[mode][state, d]: first frame at which the car has moved >= d px,
+        # for every d up to the furthest the table goes (a speed < 0 can move
+        # the car back for a frame, hence the running maximum)
+        self.reach = []
+        for offsets in self.offsets:
+            furthest = np.maximum.accumulate(offsets, axis=1)
+            distances = np.arange(max(int(furthest[:, -1].max()), 0) + 1)
+            self.reach.append(np.stack([np.searchsorted(row, distances) for row in furthest]))
+        # the same rows as lists, single queries (calculate_ttc) skip numpy
+        self.reach_rows = [table.tolist() for table in self.reach]
+        self.settled_offsets = [offsets[:, -1].tolist() for offsets in self.offsets]
+
+    # speed and x moved of one Car.update
+    def step(self, speed, mode):
+        ghost = self.ghost
+        ghost.rect.x, ghost.speed, ghost.decelerate_flag = BASE_X, speed, mode == BRAKE
+        ghost.update()
+        return ghost.speed, ghost.rect.x - BASE_X
+
+    # x moved and speed after every frame until the car has settled (max_speed / 0)
+    def settle(self, speed, mode):
+        terminal = self.max_speed if mode == ACCELERATE else 0
+        offsets, speeds = [0], [speed]
+        while speed != terminal:
+            if len(offsets) > MAX_TRANSIENT:
+                raise ValueError(f"the car never reaches speed {terminal} from {speed} with these parameters")
+            speed, moved = self.step(speed, mode)
+            offsets.append(offsets[-1] + moved)
+            speeds.append(speed)
+        return offsets, speeds
+
+    # table row of every speed (speeds without a row yet get one, the tables are
+    # rebuilt, which only happens for speeds off the grid found at construction)
+    def index(self, speed):
+        if isinstance(speed, SCALAR):
+            state = self.speed_index.get(float(speed))
+            if state is None:
+                self.build([*self.speed_index, float(speed)])
+                state = self.speed_index[float(speed)]
+            return state
+        speed = np.asarray(speed, dtype=np.float64)
+        state = np.minimum(np.searchsorted(self.speeds, speed), len(self.speeds) - 1)
+        if not np.array_equal(self.speeds[state], speed):
+            self.build([*self.speed_index, *np.unique(speed).tolist()])
+            state = np.searchsorted(self.speeds, speed)
+        return state
+
+    # px the car moves in `frames` frames
+    def distance(self, speed, frames, brake=False):
+        mode = BRAKE if brake else ACCELERATE
+        state, frames = self.index(speed), np.asarray(frames)
+        return self.offsets[mode][state, np.minimum(frames, self.frames)] + np.maximum(frames - self.frames, 0) * self.rate[mode]
+
+    # speed after `frames` frames
+    def speed(self, speed, frames, brake=False):
+        mode = BRAKE if brake else ACCELERATE
+        return self.speed_after[mode][self.index(speed), np.minimum(frames, self.frames)]
+
+    # frames until the car has moved at least `distance` px (0 for distance <= 0,
+    # inf if it never gets there, i.e. it stops first when braking)
+    def frames_to_reach(self, speed, distance, brake=False):
+        mode = BRAKE if brake else ACCELERATE
+        state = self.index(speed)
+        if isinstance(distance, SCALAR) and isinstance(speed, SCALAR):
+            return self.frames_to_reach_one(mode, state, distance)
+        # rect.x moves in whole px, reaching d is reaching ceil(d)
+        distance = np.maximum(np.ceil(distance), 0).astype(np.int64)
+        reach = self.reach[mode]
+        frames = reach[state, np.minimum(distance, reach.shape[1] - 1)].astype(np.float64)
+        # past the table: the car moves rate px per frame from there on
+        beyond = (frames > self.frames) | (distance >= reach.shape[1])
+        if np.any(beyond):
+            rate = self.rate[mode]
+            if rate > 0:
+                rest = distance - self.offsets[mode][state, self.frames]
+                frames = np.where(beyond, self.frames + np.ceil(rest / rate), frames)
+            else:
+                frames = np.where(beyond, np.inf, frames)
+        return frames
+
+    def frames_to_reach_one(self, mode, state, distance):
+        distance = max(math.ceil(distance), 0)
+        row = self.reach_rows[mode][state]
+        if distance < len(row) and row[distance] <= self.frames:
+            return float(row[distance])
+        rate = self.rate[mode]
+        if rate <= 0:
+            return math.inf
+        return float(self.frames + math.ceil((distance - self.settled_offsets[mode][state]) / rate))
+
+    # px the car still moves when it brakes from now on
+    def stopping_distance(self, speed):
+        return self.offsets[BRAKE][self.index(speed), self.frames]
+
+    # frames until it stands still when it brakes from now on
+    def stopping_frames(self, speed):
+        return self.settle_frames[BRAKE][self.index(speed)]
+
+    # x moved / speed for k = 0 .. frames of one car that keeps its mode
+    def trajectory(self, speed, frames, brake=False):
+        k = np.arange(frames + 1)
+        return self.distance(speed, k, brake), self.speed(speed, k, brake)
+
+
+# one Kinematics per set of car parameters (the tables only depend on those)
+kinematics_cache = {}
+
+
+def for_car(car: Car):
+    key = (car.max_speed, car.acceleration, car.deceleration)
+    kinematics = kinematics_cache.get(key)
+    if kinematics is None:
+        kinematics = kinematics_cache[key] = Kinematics(*key)
+    return kinematics
+
+
+if __name__ == "__main__":
+    # how far calculate_elapsed_time is from the frames Car.update really needs,
+    # and what a vectorized query costs
+    from ttc_func import calculate_elapsed_time, calculate_elapsed_time_array
+
+    parser = argparse.ArgumentParser(description="Exact car kinematics vs the continuous ttc formula")
+    parser.add_argument("--max_distance", type=int, default=400, help="Largest distance (px) compared")
+    parser.add_argument("--queries", type=int, default=1000000, help="Queries of the timing")
+    args = parser.parse_args()
+
+    car = Car()
+    kinematics = for_car(car)
+    print(f"{len(kinematics.speeds)} speeds, settled after at most {kinematics.frames} frames, "
+          f"tables {sum(table.nbytes for table in kinematics.offsets + kinematics.speed_after + kinematics.reach) / 1024:.0f} KiB")
+
+    distances = np.arange(1, args.max_distance + 1)
+    print(f"\n{'speed':>6s} {'max |error| frames':>18s} {'mean error':>10s} {'stop px':>8s} {'v^2/2d px':>9s} {'stop frames':>11s}")
+    for speed in kinematics.speeds.tolist():
+        exact = kinematics.frames_to_reach(speed, distances)
+        continuous = np.array([calculate_elapsed_time(d, speed, car.acceleration, car.max_speed) for d in distances.tolist()])
+        error = continuous - exact
+        print(f"{speed:6.1f} {np.abs(error).max():18.2f} {error.mean():10.2f} {kinematics.stopping_distance(speed):8d} "
+              f"{speed ** 2 / 2 / car.deceleration:9.1f} {kinematics.stopping_frames(speed):11d}")
+
+    rng = np.random.default_rng(0)
+    speeds = rng.choice(kinematics.speeds, args.queries)
+    targets = rng.uniform(0, 2 * args.max_distance, args.queries)
+    for name, function in [("frames_to_reach", lambda: kinematics.frames_to_reach(speeds, targets)),
+                           ("calculate_elapsed_time_array", lambda: calculate_elapsed_time_array(targets, speeds, car.acceleration, car.max_speed)),
+                           ("stopping_distance", lambda: kinematics.stopping_distance(speeds))]:
+        start = time.perf_counter()
+        function()
+        print(f"{name:30s} {(time.perf_counter() - start) / args.queries * 1e9:6.1f} ns/query")
+    start = time.perf_counter()
+    for speed, target in zip(speeds[:10000].tolist(), targets[:10000].tolist()):
+        kinematics.frames_to_reach(speed, target)
+    print(f"{'frames_to_reach (scalar)':30s} {(time.perf_counter() - start) / 10000 * 1e9:6.0f} ns/query")
@@ -1,13 +1,18 @@
+import collections
 import pygame
 import random
 import math
 import requests
+from trajectory_features import TrajectoryFeatures
 
 # Screen dimensions
 WIDTH, HEIGHT = 1400, 800
 CAR_WIDTH, CAR_HEIGHT = 200, 120
 PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT = 100, 140
 
+# distance (px) between car and pedestrian that counts as a collision
+COLLIDE_DISTANCE = 110
+
 # Server URL
 SERVER_URL = 'http://127.0.0.1:5000/predict_trajectory'
 
@@ -17,13 +22,32 @@ WHITE = (255, 255, 255)
 RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 
+# A route only depends on the case, the walking speed, the start point and the sprite
+# width, so it is computed once and shared by every pedestrian / round that walks it.
+# key: (case, speed, start, width), value: Route
+# path and centered_path are tuples, nobody may modify them
+# The least recently used routes are dropped past MAX_CACHED_ROUTES: in crowd mode
+# every pedestrian starts at a random offset, those routes are hardly ever walked again.
+Route = collections.namedtuple("Route", ["waypoints", "path", "centered_path"])
+MAX_CACHED_ROUTES = 256
+route_cache = collections.OrderedDict()
+
+
 class Car:
-    def __init__(self, car_image):
+    __slots__ = ("image", "rect", "width", "height", "max_speed", "speed", "acceleration", "deceleration",
+                 "decelerate_flag")
+
+    def __init__(self, car_image=None):
         # scale: (widt, height)
-        self.image = pygame.transform.scale(car_image, (CAR_WIDTH, CAR_HEIGHT))
-        self.width, self.height = self.image.get_size()
+        # car_image can be None in headless mode, then only the rect is kept
+        if car_image is not None:
+            self.image = pygame.transform.scale(car_image, (CAR_WIDTH, CAR_HEIGHT))
+            self.rect = self.image.get_rect()
+        else:
+            self.image = None
+            self.rect = pygame.Rect(0, 0, CAR_WIDTH, CAR_HEIGHT)
+        self.width, self.height = self.rect.size
 
-        self.rect = self.image.get_rect()
         self.rect.topleft = (0, (HEIGHT - self.height) // 2)
         
         self.max_speed = 15
@@ -49,20 +73,32 @@ class Car:
         self.rect.x += self.speed
 
     def draw(self, surface):
-        surface.blit(self.image, self.rect.topleft)
+        if self.image is not None:
+            surface.blit(self.image, self.rect.topleft)
 
     def start_new_round(self):
         self.rect.x = 0
 
 
 class Pedestrian:
-    def __init__(self, pedestrian_image, id=0):
+    __slots__ = ("pedestrian_id", "offset", "image", "rect", "width", "height", "start", "speed", "case",
+                 "collide", "entering", "waypoints", "current_waypoint_index", "path", "centered_path",
+                 "path_index", "trajectory", "features")
+
+    # offset: (dx, dy) the whole route is moved right by dx and the pedestrian starts
+    # dy px above the top of the screen (crowd mode), (0, 0) = the usual crossing
+    def __init__(self, pedestrian_image=None, id=0, offset=(0, 0)):
         self.pedestrian_id = id
-        self.image = pygame.transform.scale(pedestrian_image, (PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT))
-        self.width, self.height = self.image.get_size()
+        self.offset = offset
+        if pedestrian_image is not None:
+            self.image = pygame.transform.scale(pedestrian_image, (PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT))
+            self.rect = self.image.get_rect()
+        else:
+            self.image = None
+            self.rect = pygame.Rect(0, 0, PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT)
+        self.width, self.height = self.rect.size
         
-        self.rect = self.image.get_rect()
-        self.start = ((WIDTH - self.width) // 2, 0)
+        self.start = ((WIDTH - self.width) // 2 + offset[0], -offset[1])
         self.rect.topleft = self.start
 
         self.speed = 9
@@ -75,50 +111,74 @@ class Pedestrian:
         # Update this flag after he pass the middle of the screen
         self.entering = True
 
+        # store past trajectory
+        self.trajectory = []
+        # rolling heading angles of the trajectory, read by the predictors
+        self.features = TrajectoryFeatures()
+
         self.start_new_round()
         
 
     def start_new_round(self):
         self.entering = True
+        self.start = ((WIDTH - self.width) // 2 + self.offset[0], -self.offset[1])
 
-        # Generate intermediate waypoints
-        self.waypoints = self.generate_waypoints()
+        # waypoints and the path precomputed from them, shared with every other
+        # pedestrian on the same route (see route_cache)
+        route = self.get_route()
+        self.waypoints = route.waypoints
         self.current_waypoint_index = 0
-
-        # precompute the path based on waypoints
-        self.path = self.compute_path()
+        self.path = route.path
+        # the path shifted to the middle of the sprite, for drawing
+        self.centered_path = route.centered_path
         self.path_index = 0
 
-        # store past trajectory
-        self.trajectory = []
+        # reused, not reallocated every round
+        self.trajectory.clear()
+        self.features.reset()
+
+    def get_route(self):
+        key = (self.case, self.speed, self.start, self.width)
+        route = route_cache.get(key)
+        if route is None:
+            self.waypoints = self.generate_waypoints()
+            path = tuple(self.compute_path())
+            centered_path = tuple((x + self.width // 2, y) for x, y in path)
+            route = Route(tuple(self.waypoints), path, centered_path)
+            route_cache[key] = route
+            if len(route_cache) > MAX_CACHED_ROUTES:
+                route_cache.popitem(last=False)
+        else:
+            route_cache.move_to_end(key)
+        return route
         
     def generate_waypoints(self):
         waypoints = [self.start]
-        middle_x = (WIDTH - self.width) // 2
+        middle_x = (WIDTH - self.width) // 2 + self.offset[0]
         middle_y = HEIGHT // 2
         end_y = HEIGHT
 
         if self.case == 0: # straight line
-            self.end = (middle_x, end_y)
-            waypoints.append(self.end)
+            end = (middle_x, end_y)
+            waypoints.append(end)
 
         elif self.case == 1: # go right a little bit and go back to left
-            self.mid = (middle_x + 200, middle_y - 100)
-            self.end = (middle_x, end_y)
-            waypoints.append(self.mid)
-            waypoints.append(self.end)
+            mid = (middle_x + 200, middle_y - 100)
+            end = (middle_x, end_y)
+            waypoints.append(mid)
+            waypoints.append(end)
 
         elif self.case == 2: # bus stop case
-            self.mid = (middle_x, middle_y - 100)
-            self.end = (middle_x - 200, end_y)
-            waypoints.append(self.mid)
-            waypoints.append(self.end)
+            mid = (middle_x, middle_y - 100)
+            end = (middle_x - 200, end_y)
+            waypoints.append(mid)
+            waypoints.append(end)
 
         elif self.case == 3: # u turn
-            self.mid = (middle_x, middle_y - 100)
-            self.end = (middle_x, 0)
-            waypoints.append(self.mid)
-            waypoints.append(self.end)
+            mid = (middle_x, middle_y - 100)
+            end = (middle_x, 0)
+            waypoints.append(mid)
+            waypoints.append(end)
         
         return waypoints
     
@@ -142,17 +202,19 @@ class Pedestrian:
     def update(self):
         # update pedestrian movement
         if self.path_index < len(self.path):
-            self.rect.topleft = self.path[self.path_index]
+            point = self.path[self.path_index]
+            self.rect.topleft = point
             self.path_index += 1
-            self.trajectory.append((self.rect.x, self.rect.y))
+            self.trajectory.append(point)
+            self.features.append(point)
 
     def draw(self, screen):
         # draw the trajectory line
         if len(self.path) > 1:
-            centered_path = [(x + self.width // 2, y) for x, y in self.path]
-            pygame.draw.lines(screen, BLUE, False, centered_path, 2)
+            pygame.draw.lines(screen, BLUE, False, self.centered_path, 2)
 
-        screen.blit(self.image, self.rect.topleft)
+        if self.image is not None:
+            screen.blit(self.image, self.rect.topleft)
 
     def send_trajectory_to_car(self):
         # actively sends the trajectory to the car
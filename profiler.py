@@ -0,0 +1,256 @@
+import json
+import os
+import time
+
+# one frame at engine.FPS = 60
+FRAME_BUDGET = 1 / 60
+
+# histogram buckets (HDR histogram style): every doubling of the duration in ns
+# is split into SUB_BUCKETS equal buckets (<= 12.5 % wide), durations under
+# SUB_BUCKETS ns get one bucket per ns, up to 2^MAX_OCTAVE ns (~18 min)
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_OCTAVE = 40
+N_BUCKETS = (MAX_OCTAVE - SUB_BITS + 1) * SUB_BUCKETS
+
+# bucket bounds (s) of the Prometheus export
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, FRAME_BUDGET, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+PERCENTILES = (50, 95, 99)
+
+
+# bucket of a duration, only integer ops (the top SUB_BITS bits after the leading one)
+def bucket_index(ns):
+    if ns < SUB_BUCKETS:
+        return max(ns, 0)
+    shift = ns.bit_length() - 1 - SUB_BITS
+    return min((shift + 1) * SUB_BUCKETS + ((ns >> shift) & (SUB_BUCKETS - 1)), N_BUCKETS - 1)
+
+
+# first ns after a bucket (its lower bound is the upper bound of the bucket before)
+def bucket_upper(index):
+    if index < SUB_BUCKETS:
+        return index + 1
+    shift, sub = divmod(index, SUB_BUCKETS)
+    return (SUB_BUCKETS + sub + 1) << (shift - 1)
+
+
+# Timer + latency histogram of one stage. Reused for every measurement
+# (`with profiler.stage(name):`), nothing is allocated per call: __exit__ adds the
+# duration to a running count / sum / max and one log-linear bucket, so memory
+# stays constant however long the run is, and percentiles are read off the
+# buckets (within one bucket width).
+class Stage:
+    __slots__ = ("name", "count", "total", "max", "buckets", "started", "frame_total", "missed_total")
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * N_BUCKETS
+        self.started = 0
+        # ns spent in this stage during the current frame / during frames over budget
+        self.frame_total = 0
+        self.missed_total = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.add(time.perf_counter_ns() - self.started)
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        self.frame_total += ns
+        if ns > self.max:
+            self.max = ns
+        self.buckets[bucket_index(ns)] += 1
+
+    # duration (s) below which `percentile` % of the measurements are,
+    # interpolated linearly inside the bucket
+    def percentile(self, percentile):
+        if self.count == 0:
+            return 0.0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = bucket_upper(index - 1) if index else 0
+                fraction = (rank - seen) / count
+                return min(lower + (bucket_upper(index) - lower) * fraction, self.max) / 1e9
+            seen += count
+        return self.max / 1e9
+
+    # measurements <= bound (s), for the cumulative Prometheus buckets
+    def count_below(self, bound):
+        ns = bound * 1e9
+        return sum(count for index, count in enumerate(self.buckets) if bucket_upper(index) <= ns)
+
+    def snapshot(self):
+        stats = {"count": self.count, "mean": self.total / self.count / 1e9 if self.count else 0.0, "max": self.max / 1e9}
+        for percentile in PERCENTILES:
+            stats[f"p{percentile}"] = self.percentile(percentile)
+        return stats
+
+
+# No-op stand-in, so instrumented code does not need `if profiler is not None`
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class NullProfiler:
+    enabled = False
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def begin_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def skip_frame(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+# Per-stage timers and frame budget accounting.
+#   with profiler.stage("control"): ...     time a stage (stages can be nested,
+#                                           a nested stage is also part of its parent)
+#   profiler.begin_frame() / end_frame()    around one frame of work, frames that
+#                                           take longer than budget (s) are counted
+#                                           as misses, with the time every stage
+#                                           spent in the missed frames
+# jsonl_path: a snapshot line is appended every report_every frames and on close()
+class Profiler:
+    enabled = True
+
+    def __init__(self, budget=FRAME_BUDGET, jsonl_path=None, report_every=600):
+        self.budget = budget
+        self.budget_ns = int(budget * 1e9)
+        self.stages = {}
+        self.frame = Stage("frame")
+        self.frames = 0
+        self.budget_misses = 0
+        self.frame_started = None
+        self.started = time.time()
+        self.jsonl_path = jsonl_path
+        self.report_every = report_every
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name)
+        return stage
+
+    def begin_frame(self):
+        self.frame_started = time.perf_counter_ns()
+
+    # drop the current frame (e.g. the loop blocked on purpose), its stages still count
+    def skip_frame(self):
+        self.frame_started = None
+        for stage in self.stages.values():
+            stage.frame_total = 0
+
+    def end_frame(self):
+        if self.frame_started is None:
+            return
+        ns = time.perf_counter_ns() - self.frame_started
+        self.frame_started = None
+        self.frame.add(ns)
+        self.frames += 1
+        missed = ns > self.budget_ns
+        if missed:
+            self.budget_misses += 1
+        for stage in self.stages.values():
+            if missed:
+                stage.missed_total += stage.frame_total
+            stage.frame_total = 0
+        if self.jsonl_path is not None and self.frames % self.report_every == 0:
+            self.write_jsonl(self.jsonl_path)
+
+    def snapshot(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stats = stage.snapshot()
+            # mean time per missed frame, which stage ate the budget
+            stats["mean_in_missed_frames"] = stage.missed_total / self.budget_misses / 1e9 if self.budget_misses else 0.0
+            stages[name] = stats
+        return {
+            "time": time.time(),
+            "elapsed": time.time() - self.started,
+            "frames": self.frames,
+            "budget": self.budget,
+            "budget_misses": self.budget_misses,
+            "miss_rate": self.budget_misses / self.frames if self.frames else 0.0,
+            "frame": self.frame.snapshot(),
+            "stages": stages,
+        }
+
+    def write_jsonl(self, path):
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    # Prometheus text exposition format
+    def prometheus(self, prefix="simulation"):
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each stage of a frame.",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for stage in [self.frame] + list(self.stages.values()):
+            label = f'stage="{stage.name}"'
+            for bound in PROMETHEUS_BUCKETS:
+                lines.append(f'{prefix}_stage_seconds_bucket{{{label},le="{bound:g}"}} {stage.count_below(bound)}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{{label},le="+Inf"}} {stage.count}')
+            lines.append(f"{prefix}_stage_seconds_sum{{{label}}} {stage.total / 1e9:.9f}")
+            lines.append(f"{prefix}_stage_seconds_count{{{label}}} {stage.count}")
+        lines += [f"# HELP {prefix}_frames_total Frames measured.",
+                  f"# TYPE {prefix}_frames_total counter",
+                  f"{prefix}_frames_total {self.frames}",
+                  f"# HELP {prefix}_frame_budget_misses_total Frames that took longer than the frame budget.",
+                  f"# TYPE {prefix}_frame_budget_misses_total counter",
+                  f"{prefix}_frame_budget_misses_total {self.budget_misses}",
+                  f"# HELP {prefix}_frame_budget_seconds Frame budget.",
+                  f"# TYPE {prefix}_frame_budget_seconds gauge",
+                  f"{prefix}_frame_budget_seconds {self.budget:g}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(self.prometheus())
+        # os.replace so a scraper never reads a half written file
+        os.replace(temporary, path)
+
+    def summary(self):
+        lines = [f"{self.frames} frames, {self.budget_misses} over the {self.budget * 1e3:.1f} ms budget "
+                 f"({self.budget_misses / max(self.frames, 1):.1%})",
+                 f"{'stage':14s} {'count':>8s} {'mean ms':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'missed ms':>9s}"]
+        snapshot = self.snapshot()
+        rows = [("frame", snapshot["frame"])] + list(snapshot["stages"].items())
+        for name, stats in rows:
+            missed = stats.get("mean_in_missed_frames")
+            lines.append(f"{name:14s} {stats['count']:8d} {stats['mean'] * 1e3:8.3f} {stats['p50'] * 1e3:8.3f} "
+                         f"{stats['p95'] * 1e3:8.3f} {stats['p99'] * 1e3:8.3f} {stats['max'] * 1e3:8.3f} "
+                         + (f"{missed * 1e3:9.3f}" if missed is not None else f"{'':9s}"))
+        return "\n".join(lines)
+
+    def close(self):
+        if self.jsonl_path is not None:
+            self.write_jsonl(self.jsonl_path)
@@ -0,0 +1,135 @@
+import argparse
+import glob
+import os
+import re
+import numpy as np
+
+# one pedestrian position per record: where the pedestrian is after `frame`
+# of round `episode`, so every episode starts at the first point of its path
+# (simulation.py used to collect only the positions, in one list)
+RECORD_DTYPE = np.dtype([
+    ("episode", "<u4"),
+    ("pedestrian", "<u4"),
+    ("case", "u1"),
+    ("frame", "<u4"),
+    ("x", "<i4"),
+    ("y", "<i4"),
+])
+
+# records per shard (~1.4 MB)
+CHUNK_SIZE = 1 << 16
+
+SHARD_PATTERN = re.compile(r"shard_(\d{6})\.(npy|npz)$")
+
+
+def shard_paths(directory):
+    paths = [path for path in glob.glob(os.path.join(directory, "shard_*")) if SHARD_PATTERN.search(path)]
+    return sorted(paths, key=lambda path: int(SHARD_PATTERN.search(path).group(1)))
+
+
+def load_shard(path, mmap=True):
+    if path.endswith(".npz"):
+        with np.load(path) as shard:
+            return shard["records"]
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+# the shards of a directory one by one (memory-mapped .npy, so only the pages
+# that are read get loaded)
+def iter_shards(directory, mmap=True):
+    for path in shard_paths(directory):
+        yield load_shard(path, mmap)
+
+
+# all records of a directory as one array (copies, for datasets that fit in memory)
+def load_records(directory):
+    shards = list(iter_shards(directory))
+    return np.concatenate(shards) if shards else np.zeros(0, dtype=RECORD_DTYPE)
+
+
+# Streams records into append-only shards of a directory:
+#   shard_000000.npy, shard_000001.npy, ...   (or .npz with compress=True)
+# Records go into a preallocated chunk, a full chunk is written as one shard,
+# so memory stays at one chunk however long the run is. A shard is written to
+# a temporary file and renamed into place, after a crash every shard on disk
+# is complete and at most the last unflushed chunk is lost.
+# Recording into a directory that already has shards continues the numbering
+# of the shards and of the episodes.
+class TrajectoryRecorder:
+    def __init__(self, directory, chunk_size=CHUNK_SIZE, compress=False):
+        self.directory = directory
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+
+        existing = shard_paths(directory)
+        self.next_shard = int(SHARD_PATTERN.search(existing[-1]).group(1)) + 1 if existing else 0
+        # episode ids continue after the ones already on disk
+        self.first_episode = 0
+        if existing:
+            last = load_shard(existing[-1])
+            self.first_episode = int(last["episode"].max()) + 1 if len(last) else 0
+
+        self.chunk = np.empty(chunk_size, dtype=RECORD_DTYPE)
+        self.size = 0
+        self.records = 0
+
+    def record(self, episode, pedestrian_id, case, frame, x, y):
+        self.chunk[self.size] = (self.first_episode + episode, pedestrian_id, case, frame, x, y)
+        self.size += 1
+        self.records += 1
+        if self.size == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        if self.size == 0:
+            return
+        name = f"shard_{self.next_shard:06d}"
+        records = self.chunk[:self.size]
+        if self.compress:
+            temporary = os.path.join(self.directory, name + ".tmp.npz")
+            np.savez_compressed(temporary, records=records)
+            os.replace(temporary, os.path.join(self.directory, name + ".npz"))
+        else:
+            temporary = os.path.join(self.directory, name + ".tmp.npy")
+            np.save(temporary, records)
+            os.replace(temporary, os.path.join(self.directory, name + ".npy"))
+        self.next_shard += 1
+        self.size = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# the old dataset.npy layout: (N, 2) int32 positions of every record in order
+def export_positions(directory, path="dataset.npy"):
+    records = load_records(directory)
+    positions = np.stack([records["x"], records["y"]], axis=1).astype(np.int32)
+    np.save(path, positions)
+    return positions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect / export recorded trajectories")
+    parser.add_argument("directory", type=str, help="Recording directory")
+    parser.add_argument("--export", type=str, default=None, help="Write the positions in the old dataset.npy layout to this file")
+    args = parser.parse_args()
+
+    n_records = 0
+    episodes = set()
+    pedestrians = set()
+    for shard in iter_shards(args.directory):
+        n_records += len(shard)
+        episodes.update(np.unique(shard["episode"]).tolist())
+        pedestrians.update(np.unique(shard["pedestrian"]).tolist())
+    print(f"{len(shard_paths(args.directory))} shards, {n_records} records, "
+          f"{len(episodes)} episodes, {len(pedestrians)} pedestrians")
+
+    if args.export:
+        positions = export_positions(args.directory, args.export)
+        print(f"{len(positions)} positions saved to {args.export}")
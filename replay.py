@@ -0,0 +1,453 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pygame
+import control
+from control import car_control_logic_active, car_control_logic_passive, control_region, TTC_WINDOW
+from object import Car
+from spatial import SpatialGrid
+
+# One row per frame, taken after the controller decided and before anything moved,
+# i.e. exactly what the controller saw: the car, every pedestrian (rows
+# pedestrians .. pedestrians + n_pedestrians of pedestrians.bin) and the
+# detections (rows of detections.bin) of that frame, and the decision.
+# collisions: pedestrians that collided with the car in this frame's move
+FRAME_DTYPE = np.dtype([
+    ("episode", "<u4"),
+    ("frame", "<u4"),
+    ("car_x", "<i4"),
+    ("car_y", "<i4"),
+    ("car_speed", "<f8"),
+    ("decision", "u1"),
+    ("pedestrians", "<u8"),
+    ("n_pedestrians", "<u4"),
+    ("detections", "<u8"),
+    ("n_detections", "<u4"),
+    ("collisions", "<u2"),
+])
+
+# path: row of paths.bin of the path the car had received from this pedestrian
+# (active mode, -1 = none), start: the step of that path it was at
+PEDESTRIAN_DTYPE = np.dtype([
+    ("pedestrian", "<u4"),
+    ("case", "u1"),
+    ("x", "<i4"),
+    ("y", "<i4"),
+    ("path_index", "<u4"),
+    ("speed", "<f4"),
+    ("collide", "u1"),
+    ("path", "<i4"),
+    ("start", "<u4"),
+])
+
+DETECTION_DTYPE = np.dtype([
+    ("x1", "<f4"),
+    ("y1", "<f4"),
+    ("x2", "<f4"),
+    ("y2", "<f4"),
+    ("confidence", "<f4"),
+    ("class_id", "<u2"),
+])
+
+# every distinct received path once, its points are rows of points.bin
+PATH_DTYPE = np.dtype([
+    ("points", "<u8"),
+    ("length", "<u4"),
+])
+
+POINT_DTYPE = np.dtype([("x", "<i4"), ("y", "<i4")])
+
+TABLES = {"frames": FRAME_DTYPE, "pedestrians": PEDESTRIAN_DTYPE, "detections": DETECTION_DTYPE,
+          "paths": PATH_DTYPE, "points": POINT_DTYPE}
+
+# rows kept in memory before they are appended to the files
+CHUNK_SIZE = 1 << 14
+
+# a logged collision counts as warned when the controller braked within this
+# many frames before it
+WARNING_FRAMES = TTC_WINDOW
+
+VERSION = 1
+
+
+# Writes an episode log: one append-only binary file per table (*.bin, the dtypes
+# above) and meta.json with the configuration of the run, in a directory.
+# Rows are collected in memory and appended chunk by chunk, the frames last, so
+# after a crash every frame on disk has its pedestrian / detection rows.
+# Logging into a directory that already has a log continues its episode
+# numbering (the configuration has to be the same).
+#   engine = Engine(..., episode_log=EpisodeLogger("episodes"))
+class EpisodeLogger:
+    def __init__(self, directory, chunk_size=CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.rows = {name: [] for name in TABLES}
+        # rows of every table so far, on disk + in memory (= index of the next row)
+        self.counts = {name: table_rows(directory, name) for name in TABLES}
+        self.pending = 0
+
+        self.first_episode = 0
+        if self.counts["frames"]:
+            last = np.memmap(table_path(directory, "frames"), dtype=FRAME_DTYPE, mode="r", shape=(self.counts["frames"],))[-1]
+            self.first_episode = int(last["episode"]) + 1
+        # path object -> row of paths.bin (the object is kept so its id is not reused),
+        # and the points of every path logged so far -> row, for paths that arrive
+        # as a new object every frame (queue / udp transports)
+        self.path_ids = {}
+        self.path_rows = {}
+
+    # the configuration replay() runs the controller with
+    def begin(self, engine):
+        params = {key: value for key, value in engine.control_params.items() if key != "kinematics"}
+        meta = {"version": VERSION, "flag": engine.flag, "metric": engine.metric, "control_params": params,
+                "exact_kinematics": "kinematics" in engine.control_params, "tracker": engine.tracker is not None,
+                "broad_phase": engine.grid is not None,
+                "num_pedestrian": len(engine.pedestrians),
+                "car": {"max_speed": engine.car.max_speed, "acceleration": engine.car.acceleration,
+                        "deceleration": engine.car.deceleration},
+                "pedestrian": {"width": engine.pedestrians[0].width if engine.pedestrians else 0,
+                               "height": engine.pedestrians[0].height if engine.pedestrians else 0}}
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path) and self.counts["frames"]:
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"{self.directory} holds a log of a different configuration")
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+
+    def path_row(self, path):
+        cached = self.path_ids.get(id(path))
+        if cached is not None and cached[0] is path:
+            return cached[1]
+        points = tuple(tuple(point) for point in path)
+        row = self.path_rows.get(points)
+        if row is None:
+            row = self.path_rows[points] = self.counts["paths"]
+            self.rows["paths"].append((self.counts["points"], len(points)))
+            self.rows["points"].append(np.array(points, dtype=np.int32).reshape(-1, 2).view(POINT_DTYPE).reshape(-1))
+            self.counts["paths"] += 1
+            self.counts["points"] += len(points)
+        self.path_ids[id(path)] = (path, row)
+        return row
+
+    # the frame engine.step just decided on
+    # detections: (xyxys, confidences, class_ids) of the passive controller, None in active mode
+    def record(self, engine, detections=None):
+        # (the last frame stays in memory until the next one, collided() can still change it)
+        if self.pending >= self.chunk_size:
+            self.flush()
+        paths = control.precomputed_paths if engine.flag == "active" else {}
+        pedestrians = []
+        for pedestrian in engine.pedestrians:
+            entry = paths.get(pedestrian.pedestrian_id)
+            path, start = (self.path_row(entry["precomputed_path"]), entry.get("start", 0)) if entry is not None else (-1, 0)
+            pedestrians.append((pedestrian.pedestrian_id, pedestrian.case, pedestrian.rect.x, pedestrian.rect.y,
+                                pedestrian.path_index, pedestrian.speed, pedestrian.collide, path, start))
+        car = engine.car
+        first_pedestrian, first_detection = self.counts["pedestrians"], self.counts["detections"]
+        self.rows["pedestrians"] += pedestrians
+        self.counts["pedestrians"] += len(pedestrians)
+        n_detections = 0
+        if detections is not None:
+            xyxys, confidences, class_ids = detections
+            n_detections = len(xyxys)
+            self.rows["detections"] += [(*xyxy, confidence, class_id) for xyxy, confidence, class_id in zip(xyxys, confidences, class_ids)]
+            self.counts["detections"] += n_detections
+        self.rows["frames"].append((self.first_episode + engine.rounds, engine.round_frame, car.rect.x, car.rect.y, car.speed,
+                                    car.decelerate_flag, first_pedestrian, len(pedestrians), first_detection, n_detections, 0))
+        self.counts["frames"] += 1
+        self.pending += 1 + len(pedestrians) + n_detections
+
+    # the pedestrians that collided when the frame just recorded was stepped
+    def collided(self, count):
+        if count:
+            self.rows["frames"][-1] = self.rows["frames"][-1][:-1] + (count,)
+
+    def flush(self):
+        # frames last: a frame is only on disk once everything it points to is
+        for name in ("points", "paths", "pedestrians", "detections", "frames"):
+            rows = self.rows[name]
+            if not rows:
+                continue
+            # rows are tuples, the points come as one array per path
+            array = np.concatenate(rows) if name == "points" else np.array(rows, dtype=TABLES[name])
+            with open(table_path(self.directory, name), "ab") as f:
+                f.write(array.tobytes())
+            self.rows[name] = []
+        self.pending = 0
+        self.path_ids.clear()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def table_path(directory, name):
+    return os.path.join(directory, name + ".bin")
+
+
+# complete rows of a table file
+def table_rows(directory, name):
+    path = table_path(directory, name)
+    return os.path.getsize(path) // TABLES[name].itemsize if os.path.exists(path) else 0
+
+
+def memmap_table(directory, name, rows=None):
+    rows = table_rows(directory, name) if rows is None else rows
+    if rows == 0:
+        return np.zeros(0, dtype=TABLES[name])
+    return np.memmap(table_path(directory, name), dtype=TABLES[name], mode="r", shape=(rows,))
+
+
+# A log opened for reading, every table memory-mapped (nothing is loaded until
+# it is read). Frames whose rows did not all make it to disk are dropped, and so
+# is the last episode when it was cut off (complete=True).
+class EpisodeLog:
+    def __init__(self, directory, complete=True):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        tables = {name: memmap_table(directory, name) for name in TABLES if name != "frames"}
+        frames = memmap_table(directory, "frames")
+        if len(frames):
+            written = ((frames["pedestrians"] + frames["n_pedestrians"] <= len(tables["pedestrians"])) &
+                       (frames["detections"] + frames["n_detections"] <= len(tables["detections"])))
+            frames = frames[:int(np.argmin(written)) if not written.all() else len(frames)]
+        self.pedestrians, self.detections = tables["pedestrians"], tables["detections"]
+        self.paths, self.points = tables["paths"], tables["points"]
+
+        # first frame of every episode, and the end; the last episode of a run is
+        # cut off (engine.run stops in the first frame of the next round), in a log
+        # that several runs were appended to the ones before the last run stay in
+        starts = np.flatnonzero(np.diff(frames["episode"].astype(np.int64))) + 1
+        self.bounds = np.concatenate([[0], starts, [len(frames)]]).astype(np.int64) if len(frames) else np.zeros(1, dtype=np.int64)
+        if complete and len(self.bounds) > 1:
+            self.bounds = self.bounds[:-1]
+        self.frames = frames[:self.bounds[-1]]
+        self.path_cache = {}
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    # received path `row` as a tuple of points, the same object every time it is asked for
+    # (the controllers cache their PathIndex by path identity)
+    def path(self, row):
+        path = self.path_cache.get(row)
+        if path is None:
+            first, length = int(self.paths[row]["points"]), int(self.paths[row]["length"])
+            points = self.points[first:first + length]
+            path = self.path_cache[row] = tuple(zip(points["x"].tolist(), points["y"].tolist()))
+        return path
+
+    # (first frame, end) of episode i
+    def episode(self, i):
+        return int(self.bounds[i]), int(self.bounds[i + 1])
+
+    # frame indices with a collision, and the pedestrians that collided in each
+    def collisions(self):
+        frames = np.flatnonzero(self.frames["collisions"])
+        return frames, self.frames["collisions"][frames].astype(np.int64)
+
+
+# The attributes the controllers read from a Pedestrian, rebuilt from the log:
+# the trajectory (and its features) grow by the logged position whenever the
+# pedestrian's path_index went up, like Pedestrian.update appends them
+class ReplayPedestrian:
+    __slots__ = ("pedestrian_id", "rect", "width", "height", "speed", "case", "collide", "trajectory", "features", "path_index")
+
+    def __init__(self, pedestrian_id, width, height):
+        from trajectory_features import TrajectoryFeatures
+        self.pedestrian_id = pedestrian_id
+        self.rect = pygame.Rect(0, 0, width, height)
+        self.width, self.height = width, height
+        self.speed = 0
+        self.case = 0
+        self.collide = False
+        self.trajectory = []
+        self.features = TrajectoryFeatures()
+        self.path_index = 0
+
+    def set(self, case, x, y, path_index, speed, collide):
+        if path_index < self.path_index:
+            self.trajectory.clear()
+            self.features.reset()
+            self.path_index = 0
+        if path_index > self.path_index:
+            self.trajectory.append((x, y))
+            self.features.append((x, y))
+            self.path_index = path_index
+        self.rect.x, self.rect.y = x, y
+        self.case, self.speed, self.collide = case, speed, collide
+
+
+# Re-run a controller over a log, nothing is simulated or detected again.
+# The controller sees what the logged one saw (car, pedestrians, received paths,
+# detections) and its decisions are compared with the logged ones. This is
+# open loop: the world does not react to the new decisions, so once they differ
+# the frames after that show what would have happened under the logged
+# controller (the scores say which collisions it would have braked before).
+#   flag / metric / control_params / tracker: default to the ones of the log
+#   controller: replaces car_control_logic_active / car_control_logic_passive
+#       (same signature), e.g. a new controller to score
+#   exact_kinematics / event_driven / broad_phase: as in engine.Engine (broad
+#       phase: only the pedestrians near the car go to the controller)
+#   episodes: indices of the episodes to replay (default all). With a tracker
+#       only all of them in order give the tracks of the run
+# control.precomputed_paths is overwritten (active mode), like engine.Engine does.
+def replay(log, flag=None, metric=None, control_params=None, controller=None, tracker=None,
+           exact_kinematics=None, event_driven=False, broad_phase=None, episodes=None):
+    meta = log.meta
+    flag = meta["flag"] if flag is None else flag
+    metric = meta["metric"] if metric is None else metric
+    params = dict(meta["control_params"] if control_params is None else control_params)
+    car = Car()
+    car.max_speed, car.acceleration, car.deceleration = (meta["car"][key] for key in ("max_speed", "acceleration", "deceleration"))
+    if meta["exact_kinematics"] if exact_kinematics is None else exact_kinematics:
+        from kinematics import for_car
+        params["kinematics"] = for_car(car)
+    if tracker is None and meta["tracker"]:
+        from tracker import Tracker
+        tracker = Tracker()
+    broad_phase = meta["broad_phase"] if broad_phase is None else broad_phase
+    region_params = {key: params[key] for key in ("distance_threshold", "lookahead") if key in params}
+    if controller is None:
+        controller = car_control_logic_active if flag == "active" else car_control_logic_passive
+    scheduler = None
+    if event_driven and flag == "active" and metric == "ttc":
+        from events import TTCScheduler
+        scheduler = TTCScheduler(**{key: params[key] for key in ("ttc_window", "lookahead", "kinematics") if key in params})
+
+    width, height = meta["pedestrian"]["width"], meta["pedestrian"]["height"]
+    proxies = {}
+    # one list, filled every frame (TTCScheduler recognises the pedestrians by it)
+    pedestrians = []
+    paths = control.precomputed_paths
+    paths.clear()
+    decisions = np.zeros(len(log.frames), dtype=bool)
+    replayed = np.zeros(len(log.frames), dtype=bool)
+
+    start_time = time.perf_counter()
+    for episode in range(len(log)) if episodes is None else episodes:
+        first, end = log.episode(episode)
+        # one episode at a time as python lists, cheaper to walk than numpy rows
+        frames = log.frames[first:end]
+        pedestrian_rows = log.pedestrians[int(frames["pedestrians"][0]):int(frames["pedestrians"][-1] + frames["n_pedestrians"][-1])]
+        ped_first = int(frames["pedestrians"][0])
+        columns = [pedestrian_rows[name].tolist() for name in ("pedestrian", "case", "x", "y", "path_index", "speed", "collide", "path", "start")]
+        detection_rows = log.detections[int(frames["detections"][0]):int(frames["detections"][-1] + frames["n_detections"][-1])]
+        det_first = int(frames["detections"][0])
+        boxes = np.stack([detection_rows[name] for name in ("x1", "y1", "x2", "y2")], axis=1).tolist()
+        confidences, class_ids = detection_rows["confidence"].tolist(), detection_rows["class_id"].tolist()
+
+        for index, (car_x, car_y, car_speed, p, n_p, d, n_d) in enumerate(zip(
+                frames["car_x"].tolist(), frames["car_y"].tolist(), frames["car_speed"].tolist(),
+                frames["pedestrians"].tolist(), frames["n_pedestrians"].tolist(),
+                frames["detections"].tolist(), frames["n_detections"].tolist())):
+            car.rect.x, car.rect.y, car.speed = car_x, car_y, car_speed
+            pedestrians.clear()
+            for row in range(p - ped_first, p - ped_first + n_p):
+                pedestrian_id = columns[0][row]
+                proxy = proxies.get(pedestrian_id)
+                if proxy is None:
+                    proxy = proxies[pedestrian_id] = ReplayPedestrian(pedestrian_id, width, height)
+                proxy.set(columns[1][row], columns[2][row], columns[3][row], columns[4][row], columns[5][row], bool(columns[6][row]))
+                pedestrians.append(proxy)
+                if flag == "active":
+                    path = columns[7][row]
+                    if path < 0:
+                        paths.pop(pedestrian_id, None)
+                    else:
+                        paths[pedestrian_id] = {"precomputed_path": log.path(path), "start": columns[8][row]}
+
+            if flag == "active":
+                if scheduler is not None:
+                    scheduler.control(car, pedestrians, paths)
+                else:
+                    controller(car, nearby(car, pedestrians, pedestrians, flag, metric, region_params) if broad_phase else pedestrians,
+                               metric, **params)
+            else:
+                detections = (boxes[d - det_first:d - det_first + n_d], confidences[d - det_first:d - det_first + n_d],
+                              class_ids[d - det_first:d - det_first + n_d])
+                targets = tracker.update(detections) if tracker is not None else pedestrians
+                if broad_phase:
+                    targets = nearby(car, targets, pedestrians, flag, metric, region_params)
+                controller(car, targets, *detections, metric, **params)
+            decisions[first + index] = car.decelerate_flag
+        replayed[first:end] = True
+    elapsed = time.perf_counter() - start_time
+    return score(log, decisions, replayed, elapsed)
+
+
+# the objects the broad phase of engine.Engine hands the controller
+def nearby(car, objects, pedestrians, flag, metric, region_params):
+    region = control_region(car, flag, metric, max_speed=max((p.speed for p in pedestrians), default=0), **region_params)
+    positions = np.array([(obj.rect.x, obj.rect.y) for obj in objects], dtype=np.int64).reshape(-1, 2)
+    return [objects[i] for i in SpatialGrid().build(positions).query(*region).tolist()]
+
+
+# how the replayed decisions compare with the logged ones
+def score(log, decisions, replayed, elapsed=0.0):
+    logged = log.frames["decision"].astype(bool)
+    frames = int(replayed.sum())
+    changed = replayed & (decisions != logged)
+    frame_index, counts = log.collisions()
+    counts = counts[replayed[frame_index]]
+    frame_index = frame_index[replayed[frame_index]]
+    episode = log.frames["episode"]
+
+    # collisions of frames where the car had braked in one of the last
+    # WARNING_FRAMES frames (the decision of a frame comes before its move)
+    def warned(braked):
+        count = 0
+        for frame, collided in zip(frame_index.tolist(), counts.tolist()):
+            window = slice(max(frame - WARNING_FRAMES + 1, 0), frame + 1)
+            if (braked[window] & (episode[window] == episode[frame])).any():
+                count += collided
+        return count
+
+    return {
+        "episodes": int(len(np.unique(episode[replayed]))) if frames else 0,
+        "frames": frames,
+        "agreement": float(1 - changed.sum() / frames) if frames else 1.0,
+        "changed_frames": int(changed.sum()),
+        "brake_rate": float(decisions[replayed].mean()) if frames else 0.0,
+        "logged_brake_rate": float(logged[replayed].mean()) if frames else 0.0,
+        "collisions": int(counts.sum()),
+        "warned_collisions": warned(decisions),
+        "logged_warned_collisions": warned(logged),
+        "wall_time": elapsed,
+        "frames_per_second": frames / elapsed if elapsed > 0 else float("inf"),
+        "decisions": decisions,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the controller over recorded episodes")
+    parser.add_argument("directory", type=str, help="Episode log directory (engine.py / simulation.py --episode_log)")
+    parser.add_argument("--metric", type=str, default=None, choices=["distance", "ttc"], help="Collision avoidance metric (default: the logged one)")
+    parser.add_argument("--distance_threshold", type=float, default=None, help="Distance metric threshold (px)")
+    parser.add_argument("--ttc_window", type=float, default=None, help="ttc metric window (frames)")
+    parser.add_argument("--lookahead", type=float, default=None, help="ttc metric lookahead (px)")
+    parser.add_argument("--exact_kinematics", action="store_true", default=None, help="ttc: use the exact frames the car needs")
+    parser.add_argument("--event_driven", action="store_true", help="Active ttc: replay with the event-driven scheduler")
+    args = parser.parse_args()
+
+    log = EpisodeLog(args.directory)
+    params = dict(log.meta["control_params"])
+    for key in ("distance_threshold", "ttc_window", "lookahead"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    result = replay(log, metric=args.metric, control_params=params, exact_kinematics=args.exact_kinematics,
+                    event_driven=args.event_driven)
+    result.pop("decisions")
+    print(f"{log.meta['flag']} {args.metric or log.meta['metric']} {params}")
+    print(result)
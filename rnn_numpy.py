@@ -0,0 +1,122 @@
+import argparse
+import json
+import time
+import numpy as np
+
+# activations a Keras SimpleRNN / Dense layer can be saved with
+ACTIVATIONS = {
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "linear": lambda x: x,
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+}
+
+
+def read_layer_weights(h5_group):
+    # {"kernel": ..., "recurrent_kernel": ..., "bias": ...} of one layer, whatever the nesting
+    # (Keras 2 saves ".../simple_rnn_cell/kernel:0", Keras 3 ".../simple_rnn_cell/kernel")
+    weights = {}
+
+    def visit(name, obj):
+        if hasattr(obj, "shape"):
+            weights[name.split("/")[-1].split(":")[0]] = np.array(obj)
+
+    h5_group.visititems(visit)
+    return weights
+
+
+# pull the weights of the SimpleRNN + Dense model saved by RNN.py out of the
+# h5 file into a small npz, only h5py is needed (no TensorFlow)
+def export_weights(h5_path="trajectory_model.h5", npz_path="trajectory_model.npz"):
+    import h5py
+
+    with h5py.File(h5_path, "r") as f:
+        config = f.attrs["model_config"]
+        config = json.loads(config.decode() if isinstance(config, bytes) else config)
+        layers = [layer for layer in config["config"]["layers"] if layer["class_name"] != "InputLayer"]
+        classes = [layer["class_name"] for layer in layers]
+        if classes != ["SimpleRNN", "Dense"]:
+            raise ValueError(f"only SimpleRNN + Dense models can be exported, got {classes}")
+
+        rnn, dense = layers
+        rnn_weights = read_layer_weights(f["model_weights"][rnn["config"]["name"]])
+        dense_weights = read_layer_weights(f["model_weights"][dense["config"]["name"]])
+
+    np.savez(npz_path,
+             rnn_kernel=rnn_weights["kernel"],
+             rnn_recurrent_kernel=rnn_weights["recurrent_kernel"],
+             rnn_bias=rnn_weights["bias"],
+             rnn_activation=rnn["config"]["activation"],
+             dense_kernel=dense_weights["kernel"],
+             dense_bias=dense_weights["bias"],
+             dense_activation=dense["config"]["activation"])
+    return npz_path
+
+
+# SimpleRNN + Dense forward pass in NumPy, same math as Keras:
+#   h_t = activation(x_t @ kernel + h_{t-1} @ recurrent_kernel + bias)
+#   y   = activation(h_T @ dense_kernel + dense_bias)
+class NumpyRNN:
+    def __init__(self, rnn_kernel, rnn_recurrent_kernel, rnn_bias, dense_kernel, dense_bias,
+                 rnn_activation="relu", dense_activation="linear"):
+        self.rnn_kernel = rnn_kernel
+        self.rnn_recurrent_kernel = rnn_recurrent_kernel
+        self.rnn_bias = rnn_bias
+        self.dense_kernel = dense_kernel
+        self.dense_bias = dense_bias
+        self.rnn_activation = ACTIVATIONS[rnn_activation]
+        self.dense_activation = ACTIVATIONS[dense_activation]
+
+    @classmethod
+    def load(cls, npz_path="trajectory_model.npz"):
+        with np.load(npz_path) as weights:
+            return cls(weights["rnn_kernel"], weights["rnn_recurrent_kernel"], weights["rnn_bias"],
+                       weights["dense_kernel"], weights["dense_bias"],
+                       str(weights["rnn_activation"]), str(weights["dense_activation"]))
+
+    # input_sequences: (N, T, features), returns (N, units of the Dense layer)
+    def __call__(self, input_sequences):
+        input_sequences = np.asarray(input_sequences, dtype=self.rnn_kernel.dtype)
+        # input projection of all timesteps at once, only the recurrence is sequential
+        projected = input_sequences @ self.rnn_kernel + self.rnn_bias
+        hidden = np.zeros((input_sequences.shape[0], self.rnn_recurrent_kernel.shape[0]), dtype=projected.dtype)
+        for t in range(input_sequences.shape[1]):
+            hidden = self.rnn_activation(projected[:, t] + hidden @ self.rnn_recurrent_kernel)
+        return self.dense_activation(hidden @ self.dense_kernel + self.dense_bias)
+
+
+# compare against the Keras model on windows of dataset.npy (needs TensorFlow)
+def check(h5_path, npz_path, dataset_path="dataset.npy", length=10):
+    import tensorflow as tf
+
+    dataset = np.load(dataset_path).astype(np.float64)
+    steps = np.diff(dataset, axis=0)
+    angles = np.arctan2(steps[:, 1], steps[:, 0])
+    windows = np.lib.stride_tricks.sliding_window_view(angles, length)[..., None].astype(np.float32)
+
+    keras_model = tf.keras.models.load_model(h5_path)
+    numpy_model = NumpyRNN.load(npz_path)
+
+    start = time.perf_counter()
+    expected = keras_model(windows, training=False).numpy()
+    keras_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predicted = numpy_model(windows)
+    numpy_time = time.perf_counter() - start
+
+    print(f"{len(windows)} windows, max abs error {np.abs(expected - predicted).max():.2e}")
+    print(f"keras {keras_time * 1000:.2f} ms, numpy {numpy_time * 1000:.2f} ms")
+    return np.allclose(expected, predicted, atol=1e-4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the trajectory RNN to NumPy weights")
+    parser.add_argument("--model", type=str, default="trajectory_model.h5", help="Keras model saved by RNN.py")
+    parser.add_argument("--output", type=str, default="trajectory_model.npz", help="Exported weights")
+    parser.add_argument("--check", action="store_true", help="Compare the NumPy model against Keras (needs TensorFlow)")
+    args = parser.parse_args()
+
+    export_weights(args.model, args.output)
+    print(f"weights saved to {args.output}")
+    if args.check:
+        print("match" if check(args.model, args.output) else "MISMATCH")
@@ -1,20 +1,22 @@
 import pygame
 import argparse
-import cv2
 import sys
 import time
 import math
 import threading
 import random
-from flask import Flask, request, jsonify
 from object import Car, Pedestrian
 from object import CAR_WIDTH, CAR_HEIGHT
 from object import PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT
-from YOLO import model
-from trajectory_prediction import weighted_moving_average, RNN_prediction
-from ttc_func import calculate_ttc
+from control import precomputed_paths
+from engine import Engine
+from transport import HTTPTransport, make_transport
+from detection import AsyncDetector
+from capture import FrameCapture, ROAD_BAND
+from detectors import make_detector, DetectionNoise, DETECTORS
+from recorder import TrajectoryRecorder
+from profiler import Profiler, NULL_PROFILER
 import numpy as np
-import tensorflow as tf
 
 # Initialize Pygame
 pygame.init()
@@ -35,74 +37,66 @@ RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 GREEN = (0, 255, 0)  
 
-# the number of pedestrian's future steps that the car should predict
-PREDICT_STEPS = 100
-
-# the number of past trajectory coordinates that should be taken 
-# into consideration to compute weighted moving average
-ACCOUNTED_LENGTH = 10
+# Server URL the pedestrians send their paths to (active mode)
+SERVER_URL = 'http://127.0.0.1:5000/predict_trajectory'
 
 # Frame rate
 clock = pygame.time.Clock()
 FPS = 60
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Global dictionary to store precomputed_paths of each pedestrian
-# key: id, value: {}
-precomputed_paths = {}
-
-# actively receive path from pedestrian
-@app.route("/predict_trajectory", methods=["POST"])
+# actively receive path from pedestrian (endpoint of the http transport)
+# full update: {"pedestrian_id", "precomputed_path", "speed", optional "start" / "epoch" / "version" / "time"}
+# index update: {"pedestrian_id", "start", "version", optional "epoch" / "time"} moves along the last full path
 def receive_future_path():
+    from flask import request, jsonify
     global precomputed_paths
 
     data = request.json
-    if not data or "pedestrian_id" not in data or "precomputed_path" not in data or "speed" not in data:
+    if not data or "pedestrian_id" not in data:
         return jsonify({"status": "failure", "message": "Invalid or empty data"}), 400
-    
-    pedestrian_id = data["pedestrian_id"]
-    precomputed_path = data["precomputed_path"]
-    speed = data["speed"]
 
-    # store the information in the global dictionary
-    precomputed_paths[pedestrian_id] = {
-        "precomputed_path": precomputed_path,
-        "speed": speed
-    }
+    pedestrian_id = data["pedestrian_id"]
+    epoch = data.get("epoch", 0)
+    version = data.get("version", 0)
+    # send time (perf_counter of the sender), a client without one is ordered by arrival
+    sent_time = data.get("time", time.perf_counter())
+    entry = precomputed_paths.get(pedestrian_id)
+
+    if "precomputed_path" in data and "speed" in data:
+        # newer = later sender epoch, higher version, or the same version sent later (like
+        # v2x_server.PathStore): a late resend of the same path must not move the start back
+        if entry is not None and (entry.get("epoch", 0), entry.get("version", 0), entry.get("time", 0.0)) >= (epoch, version, sent_time):
+            return jsonify({"status": "stale"}), 200
+
+        # store the information in the global dictionary
+        precomputed_paths[pedestrian_id] = {
+            "precomputed_path": [tuple(point) for point in data["precomputed_path"]],
+            "start": data.get("start", 0),
+            "speed": data["speed"],
+            "epoch": epoch,
+            "version": version,
+            "time": sent_time
+        }
+
+    elif "start" in data:
+        if entry is None or entry.get("epoch", 0) != epoch or entry.get("version", 0) != version or entry.get("time", 0.0) >= sent_time:
+            return jsonify({"status": "stale"}), 200
+        entry["start"] = max(entry["start"], data["start"])
+        entry["time"] = sent_time
+
+    else:
+        return jsonify({"status": "failure", "message": "Invalid or empty data"}), 400
 
     return jsonify({"status": "success"}), 200
     
 
-def get_distance(pos1, pos2):
-    x1, y1 = pos1
-    x2, y2 = pos2
-    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-
-def predict(screenshot):
-    results = model(screenshot)
-    xyxys = []
-    confidences = []
-    class_ids = []
+# Flask app serving receive_future_path (flask is only needed for the http transport)
+def make_app():
+    from flask import Flask
+    app = Flask(__name__)
+    app.add_url_rule("/predict_trajectory", view_func=receive_future_path, methods=["POST"])
+    return app
 
-    for result in results: 
-        boxes = result.boxes.cpu().numpy()
-        for xyxy in boxes.xyxy: # iterate over each bounding box in the current frame
-            xyxys.append(xyxy)
-        for conf in boxes.conf:
-            confidences.append(conf)
-        for cls in boxes.cls:
-            class_ids.append(cls)
-
-    return xyxys, confidences, class_ids
-
-def is_entering(path):
-
-    cur_pos_y = path[0][1]
-    next_pos_y = path[1][1]
-
-    return ((HEIGHT / 2 - next_pos_y) * (next_pos_y - cur_pos_y) >= 0)
 
 def display_text_for_t_seconds(text, duration):
     # Define a font and size
@@ -139,132 +133,60 @@ def display_text_for_t_seconds(text, duration):
         else:
             break
 
-def collision_detection(car: Car, pedestrian: Pedestrian):
-    car_pos = (car.rect.x, car.rect.y)
-    pedestrian_pos = (pedestrian.rect.x, pedestrian.rect.y)
-    dist = get_distance(car_pos, pedestrian_pos) 
-    print("DIST: ", dist)
-    if dist <= 110: 
-        # Collide!
-        # print("COLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDECOLLIDE")
-        display_text_for_t_seconds("Collide!", 1)
-        return True
-    
-    return False
-
-# active prediction of pedestrian trajectory
-def car_control_logic_active(car: Car, pedestrians: list[Pedestrian], metric, distance_threshold=200):
-
-    # get the coordinate of car's head
-    car_head = car.rect.midright
-    car.decelerate_flag = False
-
-    for pedestrian in pedestrians:
-        if pedestrian.pedestrian_id not in precomputed_paths:
-            continue
-        
-        path = precomputed_paths[pedestrian.pedestrian_id]["precomputed_path"]
-        if len(path) >= 2:
-            precomputed_centered_path = [(x + pedestrian.width // 2, y) for x, y in precomputed_paths[pedestrian.pedestrian_id]["precomputed_path"]]
-            pygame.draw.lines(screen, RED, False, precomputed_centered_path, 3)
-
-        if metric == 'ttc':
-            car_ttc, pedestrian_ttc, pos = calculate_ttc(car, pedestrian, path)
-
-            # Deceleration logic
-            if car_ttc == -1:
-                continue
-            elif -30 < car_ttc - pedestrian_ttc and car_ttc - pedestrian_ttc < 30 and pos[0] - car.rect.x < 400:
-                car.decelerate_flag = True
-                # print("car ttc: " + str(car_ttc) + "pedestrian ttc: " + str(pedestrian_ttc))
-                break
-
-        elif metric == 'distance':
-            dist = get_distance(car_head, (pedestrian.rect.x, pedestrian.rect.y))
-            if dist <= distance_threshold and pedestrian.rect.x > car_head[0]:
-                car.decelerate_flag = True
-                break
-
-# passive prediction of pedestrian trajectory
-def car_control_logic_passive(car: Car, pedestrians: list[Pedestrian], xyxys, confidences, class_ids, metric, distance_threshold=200):
-    if len(xyxys) == 0:
-        car.decelerate_flag = False
-        return
-    
-    # get the coordinate of car's head
-    car_head = car.rect.midright
-    car.decelerate_flag = False
-
-    prediction_strategy = 1
-
-    for pedestrian in pedestrians:
-        if len(pedestrian.trajectory) <= 20: break
-
-        past_trajectory = pedestrian.trajectory[:] # copy
-        future_trajectory = []
-
-        if prediction_strategy == 0: # WMA
-            for _ in range(PREDICT_STEPS):
-                predicted_direction = weighted_moving_average(past_trajectory)
-                predicted_step_x = past_trajectory[-1][0] + predicted_direction[0] * pedestrian.speed
-                predicted_step_y = past_trajectory[-1][1] + predicted_direction[1] * pedestrian.speed
-                
-                past_trajectory.append((predicted_step_x, predicted_step_y))
-                future_trajectory.append((predicted_step_x, predicted_step_y))
-
-        elif prediction_strategy == 1: # RNN
-            predicted_direction = RNN_prediction(pedestrian.trajectory)
-            for i in range(PREDICT_STEPS):
-                predicted_step_x = past_trajectory[-1][0] + predicted_direction[0] * pedestrian.speed
-                predicted_step_y = past_trajectory[-1][1] + predicted_direction[1] * pedestrian.speed
-
-                past_trajectory.append((predicted_step_x, predicted_step_y))
-                future_trajectory.append((predicted_step_x, predicted_step_y))
-                # past_trajectory.append((pred_x + i * pedestrian.speed, pred_y + i * pedestrian.speed))
-                # future_trajectory.append((pred_x + i * pedestrian.speed, pred_y + i * pedestrian.speed))
-
-        # centered trajectory
-        future_centered_trajectory = [(x + pedestrian.width // 2, y) for x, y in future_trajectory]
-        pygame.draw.lines(screen, RED, False, future_centered_trajectory, 2)
-
-        if metric == 'ttc':
-            # print(future_centered_trajectory)
-            car_ttc, pedestrian_ttc, pos = calculate_ttc(car, pedestrian, future_centered_trajectory)
-
-            # Deceleration logic
-            if car_ttc == -1:
-                continue
-            elif -30 < car_ttc - pedestrian_ttc and car_ttc - pedestrian_ttc < 30 and pos[0] - car.rect.x < 350:
-                car.decelerate_flag = True
-                # print("car ttc: " + str(car_ttc) + "pedestrian ttc: " + str(pedestrian_ttc))
-                break
-        else:
-            distance = get_distance(car_head, (pedestrian.rect.x, pedestrian.rect.y))
-            # print(f"Distance: {distance}, Threshold: {distance_threshold}") 
-            if distance <= distance_threshold and pedestrian.rect.x > car_head[0]:
-                car.decelerate_flag = True
-                break
-
-
-dataset = []
-
-def main(flag: bool, granularity_size: int, n_rounds: int, metric: bool):
+def main(flag: bool, granularity_size: int, n_rounds: int, metric: bool, detect_every: int = 1, sync_detection: bool = False,
+         capture_scale: int = 1, road_roi: bool = False, detector_name: str = "yolo", noise: DetectionNoise = None,
+         num_pedestrian: int = 1, crowd: bool = False, recorder: TrajectoryRecorder = None, profiler: Profiler = None,
+         episode_log=None, transport_name: str = "udp"):
+    # per-stage timers, the engine adds its own stages (control, rnn, pedestrians, transport)
+    profiler = profiler if profiler is not None else NULL_PROFILER
+    stage = profiler.stage
     running = True # game loop
-    car = Car(CAR_IMAGE)
-    num_pedestrian = 1
-    pedestrians = [Pedestrian(PEDESTRIAN_IMAGE, id=i) for i in range(num_pedestrian)]
-    
-    if flag == "active":
+    # active mode: the channel the pedestrians send their paths through, the
+    # receiving end is polled by the engine on this thread (except http, where
+    # the Flask thread writes precomputed_paths)
+    transport = None
+    if flag == "active" and transport_name == "http":
         # start Flask server in a separate thread
-        threading.Thread(target=app.run, kwargs={"debug": False, "host": "0.0.0.0", "port": 5000}).start()
+        threading.Thread(target=make_app().run, kwargs={"debug": False, "host": "0.0.0.0", "port": 5000}, daemon=True).start()
+        transport = HTTPTransport(SERVER_URL)
+    elif flag == "active" and transport_name != "direct":
+        transport = make_transport(transport_name, precomputed_paths)
+    # the engine owns the car / pedestrians and the physics step,
+    # this loop only adds the window, the detector and the frame pacing
+    engine = Engine(flag, metric, num_pedestrian=num_pedestrian,
+                    car_image=CAR_IMAGE, pedestrian_image=PEDESTRIAN_IMAGE,
+                    surface=screen, transport=transport, recorder=recorder,
+                    max_round_frames=None, crowd=crowd, profiler=profiler, episode_log=episode_log)
+
+    backend = make_detector(detector_name, engine.car, engine.pedestrians, noise)
+    if backend.source == "image":
+        # screenshots are copied once from the screen into reused buffers,
+        # optionally only the road band and / or downscaled
+        frame_capture = FrameCapture(screen, ROAD_BAND if road_roi else None, capture_scale)
+        grab_frame = frame_capture.capture
+
+        def detect(screenshot):
+            xyxys, confidences, class_ids = backend(screenshot)
+            return frame_capture.to_screen(xyxys), confidences, class_ids
+    else:
+        # the cheap backends read the screen / the objects directly
+        grab_frame = (lambda: screen) if backend.source == "surface" else (lambda: None)
+        detect = backend
+
+    # YOLO runs on a background thread on the latest captured frame,
+    # the loop uses whatever boxes are newest instead of waiting for them
+    # (the other backends are cheap enough to run inline)
+    detector = AsyncDetector(detect, every=detect_every, threaded=backend.source == "image" and not sync_detection,
+                             release=frame_capture.release if backend.source == "image" else None)
 
-    rounds = 0
     paused = 0 # even = false, odd = true
 
     while running:
-        if rounds >= n_rounds:
+        if engine.rounds >= n_rounds:
             running = False
 
+        # one frame of work, the clock.tick wait at the end is not part of it
+        profiler.begin_frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -272,66 +194,63 @@ def main(flag: bool, granularity_size: int, n_rounds: int, metric: bool):
                 if event.key == pygame.K_SPACE:
                     paused = (paused + 1) % 2
 
-        # Capture pygame screen
-        screenshot = pygame.surfarray.array3d(screen)
-        screenshot = cv2.transpose(screenshot)
-        screenshot = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
-
-        # feed image into YOLO model
-        xyxys, confidences, class_ids = predict(screenshot)
- 
-        # Check if the car reaches the end of the frame
-        # if yes, start a new round
-        if car.rect.x + car.width >= WIDTH:
-            rounds += 1
-            car.start_new_round()
-            for pedestrian in pedestrians:
-                pedestrian.case = random.randrange(4)
-                pedestrian.collide = False
-                pedestrian.start_new_round()
+        # Capture pygame screen and hand it to the detector (only every detect_every frames)
+        if detector.wants(engine.frame):
+            with stage("capture"):
+                screenshot = grab_frame()
+            # inline detection runs here, threaded detection only hands the frame over
+            with stage("detect"):
+                detector.submit(screenshot, engine.frame)
+
+        # newest boxes the detector has finished, possibly a few frames old
+        with stage("detect"):
+            detections = detector.latest(engine.frame)
+        xyxys, confidences, class_ids = detections.boxes
 
         if paused % 2 == 0:
             # clear screen first
-            screen.fill(WHITE)
-
-            if flag == "active":
-                car_control_logic_active(car, pedestrians, metric)
-            elif flag == "passive":
-                car_control_logic_passive(car, pedestrians, xyxys, confidences, class_ids, metric)    
-            
-            # move the car
-            car.update()
-            # print(car.decelerate_flag)
-            
-            # Move pedestrian
-            for pedestrian in pedestrians:
-                dataset.append((pedestrian.rect.x, pedestrian.rect.y))
-                pedestrian.update()
-                if pedestrian.collide is False:
-                    pedestrian.collide = collision_detection(car, pedestrian)
-
-                if flag == "active":
-                    pedestrian.send_trajectory_to_car()
-
-                # Check if the pedestrian is leaving the intersection
-                if pedestrian.rect.y >= HEIGHT // 2:
-                    pedestrian.entering = False
+            with stage("draw"):
+                screen.fill(WHITE)
+
+            # control logic, move the car and the pedestrians
+            with stage("step"):
+                collided = engine.step(detections.boxes)
+            # the 1 s "Collide!" screen would count as one enormous frame
+            if collided:
+                profiler.skip_frame()
+            for pedestrian in collided:
+                # Collide!
+                display_text_for_t_seconds("Collide!", 1)
   
-            # draw bounding box
-            if xyxys:
-                for index, xyxy in enumerate(xyxys):
-                    # dont need to draw boundary for car
-                    if class_ids[index] == 2: # id = 2: car
-                        continue
-                    x1, y1, x2, y2 = xyxy[0], xyxy[1], xyxy[2], xyxy[3]
-                    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                    pygame.draw.rect(screen, GREEN, pygame.Rect((x1-28, y1-10), (100+7, 140+25)), width=2)
-
-            car.draw(screen) # draw car
-            for pedestrian in pedestrians:
-                pedestrian.draw(screen) # draw pedestrian
-            pygame.display.flip()
+            with stage("draw"):
+                # draw bounding box
+                if len(xyxys):
+                    for index, xyxy in enumerate(xyxys):
+                        # dont need to draw boundary for car
+                        if class_ids[index] == 2: # id = 2: car
+                            continue
+                        x1, y1, x2, y2 = xyxy[0], xyxy[1], xyxy[2], xyxy[3]
+                        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+                        pygame.draw.rect(screen, GREEN, pygame.Rect((x1-28, y1-10), (100+7, 140+25)), width=2)
+
+                engine.draw(screen) # draw car and pedestrians
+            with stage("display"):
+                pygame.display.flip()
+            profiler.end_frame()
             clock.tick(FPS)
+        else:
+            # paused, nothing to measure
+            profiler.skip_frame()
+
+    detector.close()
+    print(detector.stats.summary())
+    if transport is not None:
+        print(transport.stats.summary())
+        if transport_name == "v2x":
+            print(transport.server.store.stats.summary())
+        transport.close()
+    if profiler.enabled:
+        print(profiler.summary())
 
 
 if __name__ == "__main__":
@@ -341,13 +260,48 @@ if __name__ == "__main__":
     parser.add_argument("--granularity_size", type=int, default=10, help="Granularity size for collision detection")
     parser.add_argument("--n_rounds", type=int, default=5, help="Number of rounds to run")
     parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric (distance or ttc)")
+    parser.add_argument("--detect_every", type=int, default=1, help="Run the detector on every N-th frame")
+    parser.add_argument("--sync_detection", action="store_true", help="Run the detector inline every frame (blocking)")
+    parser.add_argument("--capture_scale", type=int, default=1, help="Downscale the screenshot for the detector by this factor")
+    parser.add_argument("--road_roi", action="store_true", help="Only send the band around the road to the detector")
+    parser.add_argument("--detector", type=str, default="yolo", choices=DETECTORS, help="Detector backend for the passive mode")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Detector noise: box coordinate std (px)")
+    parser.add_argument("--miss_rate", type=float, default=0.0, help="Detector noise: probability of missing a box")
+    parser.add_argument("--false_positive_rate", type=float, default=0.0, help="Detector noise: probability of a false person box per frame")
+    parser.add_argument("--transport", type=str, default="udp", choices=["direct", "queue", "udp", "v2x", "http"], help="Channel for the active mode paths (http: the old Flask endpoint)")
+    parser.add_argument("--record", type=str, default=None, help="Record the pedestrian trajectories into this directory")
+    parser.add_argument("--episode_log", type=str, default=None, help="Log what the controller saw and decided every frame into this directory (replay.py)")
+    parser.add_argument("--num_pedestrian", type=int, default=1, help="Number of pedestrians")
+    parser.add_argument("--crowd", action="store_true", help="Spread the pedestrians out and only check the ones near the car")
+    parser.add_argument("--profile", action="store_true", help="Time every stage of the frame loop and print a summary at the end")
+    parser.add_argument("--profile_jsonl", type=str, default=None, help="Append profiler snapshots (every 10 s of frames) to this JSONL file (implies --profile)")
+    parser.add_argument("--profile_prometheus", type=str, default=None, help="Write the profiler histograms to this file in Prometheus text format at the end (implies --profile)")
     args = parser.parse_args()
 
     flag = args.flag
     granularity_size = args.granularity_size
     n_rounds = args.n_rounds
     metric = args.metric
-    main(flag, granularity_size, n_rounds, metric)
-
-    dataset = np.array(dataset)
-    # np.save("dataset.npy", dataset)
\ No newline at end of file
+    # shards are written as the run goes, close() only writes the last partial one
+    recorder = TrajectoryRecorder(args.record) if args.record else None
+    episode_log = None
+    if args.episode_log:
+        from replay import EpisodeLogger
+        episode_log = EpisodeLogger(args.episode_log)
+    profiler = None
+    if args.profile or args.profile_jsonl or args.profile_prometheus:
+        profiler = Profiler(jsonl_path=args.profile_jsonl, report_every=10 * FPS)
+    try:
+        main(flag, granularity_size, n_rounds, metric, args.detect_every, args.sync_detection,
+             args.capture_scale, args.road_roi, args.detector,
+             DetectionNoise(args.jitter, args.miss_rate, args.false_positive_rate),
+             args.num_pedestrian, args.crowd, recorder, profiler, episode_log, args.transport)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if episode_log is not None:
+            episode_log.close()
+        if profiler is not None:
+            profiler.close()
+            if args.profile_prometheus:
+                profiler.write_prometheus(args.profile_prometheus)
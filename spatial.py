@@ -0,0 +1,86 @@
+import argparse
+import time
+import numpy as np
+
+# side of a grid cell (px), about the size of a pedestrian sprite
+CELL_SIZE = 100
+
+# cell coordinates are shifted by this before they are packed into one key,
+# so points above / left of the screen (crowd pedestrians waiting to walk in) work too
+CELL_BIAS = 1 << 15
+KEY_STRIDE = 1 << 16
+
+
+# Uniform grid over points for the broad phase: which points can be inside a
+# rectangle. build() sorts the points by (cell column, cell row), so the cells
+# of one column that a rectangle covers are one contiguous range of the sorted
+# keys, and query() needs two binary searches per column instead of a test
+# per point. Both are vectorized, query() is O(columns * log n + hits).
+class SpatialGrid:
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.points = np.zeros((0, 2))
+        self.order = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.points)
+
+    def key(self, column, row):
+        return (column + CELL_BIAS) * KEY_STRIDE + (row + CELL_BIAS)
+
+    # points: (N, 2) x, y
+    def build(self, points):
+        self.points = np.asarray(points).reshape(-1, 2)
+        cells = np.floor_divide(self.points, self.cell_size).astype(np.int64)
+        keys = self.key(cells[:, 0], cells[:, 1])
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        if len(self.points):
+            self.low = self.points.min(axis=0)
+            self.high = self.points.max(axis=0)
+        return self
+
+    # indices (ascending) of the points with x1 <= x <= x2 and y1 <= y <= y2
+    def query(self, x1, y1, x2, y2):
+        if len(self.points) == 0:
+            return self.order[:0]
+        # clamp to the extent of the points, so unbounded rectangles (+-inf) work
+        low = np.maximum((x1, y1), self.low)
+        high = np.minimum((x2, y2), self.high)
+        if low[0] > high[0] or low[1] > high[1]:
+            return self.order[:0]
+        column1, row1 = np.floor_divide(low, self.cell_size)
+        column2, row2 = np.floor_divide(high, self.cell_size)
+
+        columns = np.arange(int(column1), int(column2) + 1)
+        starts = np.searchsorted(self.keys, self.key(columns, int(row1)), side="left")
+        ends = np.searchsorted(self.keys, self.key(columns, int(row2)), side="right")
+        candidates = np.concatenate([self.order[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+
+        # narrow phase for the cells on the border of the rectangle
+        x, y = self.points[candidates, 0], self.points[candidates, 1]
+        inside = (x1 <= x) & (x <= x2) & (y1 <= y) & (y <= y2)
+        return np.sort(candidates[inside])
+
+
+if __name__ == "__main__":
+    # per-frame cost of the crowd: the same scenario with and without the broad phase
+    from engine import Engine, summarize
+
+    parser = argparse.ArgumentParser(description="Crowd simulation with and without the spatial grid")
+    parser.add_argument("--flag", type=str, default="active", choices=["active", "passive"], help="active or passive pedestrian detection")
+    parser.add_argument("--metric", type=str, default="distance", choices=["distance", "ttc"], help="Collision avoidance metric")
+    parser.add_argument("--num_pedestrian", type=int, nargs="+", default=[10, 100, 500], help="Crowd sizes")
+    parser.add_argument("--n_rounds", type=int, default=5, help="Number of rounds per run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    for n in args.num_pedestrian:
+        for broad_phase in (False, True):
+            engine = Engine(args.flag, args.metric, num_pedestrian=n, seed=args.seed, crowd=True, broad_phase=broad_phase)
+            start = time.perf_counter()
+            summary = summarize(engine.run(args.n_rounds))
+            elapsed = time.perf_counter() - start
+            print(f"{n:4d} pedestrians, broad phase {'on ' if broad_phase else 'off'}: {elapsed / engine.frame * 1e3:7.3f} ms/frame  "
+                  f"collisions {summary['collisions']}  frames {summary['frames']}  timeouts {summary['timeouts']}")
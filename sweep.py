@@ -0,0 +1,154 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# parameters of the controllers in control.py that can be swept
+PARAM_NAMES = ["distance_threshold", "ttc_window", "lookahead"]
+
+# columns of the results table
+COLUMNS = ["flag", "metric", "backend"] + PARAM_NAMES + ["case", "seed", "rounds", "collisions",
+           "collision_rate", "timeouts", "mean_round_time", "mean_min_distance", "wall_time"]
+
+
+def grid_search(param_values: dict):
+    # every combination of the given values
+    names = list(param_values)
+    for values in itertools.product(*(param_values[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(param_values: dict, n_samples, seed=0):
+    # uniform samples inside [min, max] of the given values (ints stay ints)
+    rng = random.Random(seed)
+    for _ in range(n_samples):
+        params = {}
+        for name, values in param_values.items():
+            low, high = min(values), max(values)
+            if all(isinstance(v, int) for v in values):
+                params[name] = rng.randint(low, high)
+            else:
+                params[name] = rng.uniform(low, high)
+        yield params
+
+
+def make_tasks(flag, metric, backend, params_list, cases, seeds, n_rounds, n_scenarios):
+    tasks = []
+    for params in params_list:
+        for case in cases:
+            for seed in seeds:
+                tasks.append({
+                    "flag": flag, "metric": metric, "backend": backend, "params": params,
+                    "case": case, "seed": seed, "n_rounds": n_rounds, "n_scenarios": n_scenarios,
+                })
+    return tasks
+
+
+# runs in a worker process, the simulators are imported there so the parent
+# does not need them (and the batch backend never loads the predictors)
+def run_task(task):
+    start = time.perf_counter()
+    if task["backend"] == "batch":
+        from batch_sim import BatchSimulator
+        sim = BatchSimulator(task["n_scenarios"], task["flag"], task["metric"], seed=task["seed"],
+                             cases=[task["case"]], **task["params"])
+        summary = sim.run(task["n_rounds"])
+    else:
+        from engine import Engine, summarize
+        engine = Engine(task["flag"], task["metric"], seed=task["seed"], cases=[task["case"]],
+                        control_params=task["params"])
+        summary = summarize(engine.run(task["n_rounds"]))
+
+    row = {"flag": task["flag"], "metric": task["metric"], "backend": task["backend"],
+           "case": task["case"], "seed": task["seed"]}
+    row.update(task["params"])
+    for column in ["rounds", "collisions", "collision_rate", "timeouts", "mean_round_time", "mean_min_distance"]:
+        row[column] = summary[column]
+    row["wall_time"] = time.perf_counter() - start
+    return row
+
+
+def run_sweep(tasks, workers=None):
+    # one task per process at a time, results come back in task order
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return [run_task(task) for task in tasks]
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_task, tasks, chunksize=chunksize))
+
+
+def aggregate(rows):
+    # collapse the case / seed rows of every parameter set into one row
+    groups = {}
+    for row in rows:
+        key = tuple(row.get(name) for name in PARAM_NAMES)
+        groups.setdefault(key, []).append(row)
+
+    table = []
+    for key, group in groups.items():
+        rounds = sum(row["rounds"] for row in group)
+        entry = dict(zip(PARAM_NAMES, key))
+        entry["rounds"] = rounds
+        entry["collisions"] = sum(row["collisions"] for row in group)
+        entry["timeouts"] = sum(row["timeouts"] for row in group)
+        for column in ["collision_rate", "mean_round_time", "mean_min_distance"]:
+            entry[column] = sum(row[column] * row["rounds"] for row in group) / rounds
+        table.append(entry)
+
+    # safest first, then fastest
+    table.sort(key=lambda entry: (entry["collision_rate"], entry["mean_round_time"]))
+    return table
+
+
+def write_csv(rows, path, columns):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweep of the car controllers")
+    parser.add_argument("--flag", type=str, default="active", choices=["active", "passive"], help="active or passive pedestrian detection")
+    parser.add_argument("--metric", type=str, default="ttc", choices=["distance", "ttc"], help="Collision avoidance metric (distance or ttc)")
+    parser.add_argument("--backend", type=str, default="batch", choices=["batch", "engine"], help="batch_sim.BatchSimulator or engine.Engine")
+    parser.add_argument("--distance_threshold", type=int, nargs="+", default=[150, 200, 250], help="Values of distance_threshold")
+    parser.add_argument("--ttc_window", type=int, nargs="+", default=[20, 30, 40], help="Values of the ttc window")
+    parser.add_argument("--lookahead", type=int, nargs="+", default=[300, 400, 500], help="Values of the ttc look-ahead")
+    parser.add_argument("--random", type=int, default=0, help="Random search with this many samples instead of a grid")
+    parser.add_argument("--cases", type=int, nargs="+", default=[0, 1, 2, 3], help="Pedestrian cases")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="Random seeds")
+    parser.add_argument("--n_rounds", type=int, default=20, help="Number of rounds per task")
+    parser.add_argument("--n_scenarios", type=int, default=100, help="Scenarios per task (batch backend)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores)")
+    parser.add_argument("--output", type=str, default="sweep_results.csv", help="CSV with one row per task")
+    args = parser.parse_args()
+
+    # only sweep what the chosen metric actually uses
+    if args.metric == "distance":
+        param_values = {"distance_threshold": args.distance_threshold}
+    else:
+        param_values = {"ttc_window": args.ttc_window, "lookahead": args.lookahead}
+
+    if args.random > 0:
+        params_list = list(random_search(param_values, args.random, seed=args.seeds[0]))
+    else:
+        params_list = list(grid_search(param_values))
+
+    tasks = make_tasks(args.flag, args.metric, args.backend, params_list, args.cases, args.seeds,
+                       args.n_rounds, args.n_scenarios)
+    start = time.perf_counter()
+    rows = run_sweep(tasks, args.workers)
+    elapsed = time.perf_counter() - start
+
+    write_csv(rows, args.output, COLUMNS)
+    table = aggregate(rows)
+    print(f"{len(tasks)} tasks in {elapsed:.2f}s, results in {args.output}")
+    header = [name for name in PARAM_NAMES if name in param_values] + ["rounds", "collision_rate", "mean_round_time", "mean_min_distance"]
+    print("\t".join(header))
+    for entry in table:
+        print("\t".join(f"{entry[name]:.3f}" if isinstance(entry[name], float) else str(entry[name]) for name in header))
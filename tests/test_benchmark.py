@@ -0,0 +1,30 @@
+from benchmark import compare
+
+
+def report(min_us, calibration_us, outcome=None):
+    result = {"min_us": min_us, "median_us": min_us, "calibration_us": calibration_us}
+    if outcome is not None:
+        result["outcome"] = outcome
+    return {"results": {"episode/passive/ttc": result}}
+
+
+# faster in raw time, but the calibration happened to be faster still: by
+# default that is not a regression
+def test_raw_times_are_compared_by_default():
+    baseline, current = report(350.5, 20.0), report(343.7, 12.0)
+    [(_, _, _, ratio, status)] = compare(baseline, current)
+    assert ratio < 1
+    assert status == "ok"
+
+
+def test_normalize_divides_by_the_calibration():
+    baseline, current = report(100.0, 10.0), report(200.0, 20.0)
+    assert compare(baseline, current)[0][4] == "regression"
+    [(_, _, _, ratio, status)] = compare(baseline, current, normalize=True)
+    assert ratio == 1.0
+    assert status == "ok"
+
+
+def test_changed_outcome_is_reported():
+    baseline, current = report(100.0, 10.0, {"collisions": 3}), report(100.0, 10.0, {"collisions": 4})
+    assert compare(baseline, current)[0][4] == "changed"
@@ -0,0 +1,62 @@
+import time
+import numpy as np
+import pygame
+from capture import FrameCapture
+from detection import AsyncDetector
+
+
+def shade(i):
+    return (i % 251, (i * 7) % 251, (i * 13) % 251)
+
+
+def test_capture_matches_surface():
+    surface = pygame.Surface((64, 48), depth=32)
+    surface.fill((10, 20, 30))
+    surface.fill((200, 100, 50), pygame.Rect(8, 4, 16, 12))
+    frame_capture = FrameCapture(surface, roi=(4, 2, 60, 40), scale=2)
+    frame = frame_capture.capture()
+    expected = pygame.surfarray.array3d(surface).transpose(1, 0, 2)[2:40:2, 4:60:2, ::-1]
+    assert np.array_equal(frame, expected)
+
+
+def test_released_buffers_are_reused():
+    frame_capture = FrameCapture(pygame.Surface((32, 32), depth=32), buffers=2)
+    first = frame_capture.capture()
+    frame_capture.release(first)
+    assert frame_capture.capture() is first
+    frame_capture.capture()
+    # both buffers are out: a new array, not one of them
+    extra = frame_capture.capture()
+    assert all(extra is not buffer for buffer in frame_capture.buffers)
+    assert frame_capture.copies == 1
+    frame_capture.release(extra)
+    assert len(frame_capture.free) == 0
+
+
+# a detector far slower than the loop: the frame it works on must not be
+# written by the captures that happen meanwhile
+def test_slow_detector_sees_unchanged_frames():
+    surface = pygame.Surface((64, 48), depth=32)
+    frame_capture = FrameCapture(surface)
+    torn = []
+    seen = []
+
+    def detect(image):
+        before = image.copy()
+        time.sleep(0.02)
+        seen.append(int(before[0, 0, 2]))
+        if not np.array_equal(image, before) or not (before == before[0, 0]).all():
+            torn.append(int(before[0, 0, 2]))
+        return [], [], []
+
+    detector = AsyncDetector(detect, release=frame_capture.release)
+    for i in range(60):
+        surface.fill(shade(i))
+        detector.submit(frame_capture.capture(), i)
+        time.sleep(0.002)
+    detector.close()
+
+    assert len(seen) >= 3
+    assert torn == []
+    # every buffer came back (nothing leaked to the dropped / pending frames)
+    assert len(frame_capture.free) == len(frame_capture.buffers)
@@ -0,0 +1,33 @@
+import os
+from data_pipeline import WindowDataset
+from recorder import TrajectoryRecorder
+
+
+def record(directory, episodes):
+    with TrajectoryRecorder(directory, chunk_size=256) as recorder:
+        for episode in range(episodes):
+            for frame in range(40):
+                recorder.record(episode, 0, 0, frame, 3 * frame + episode, 5 * frame)
+
+
+def test_unchanged_source_reuses_the_cache(tmp_path):
+    source = str(tmp_path / "recordings")
+    record(source, 3)
+    first = WindowDataset.from_source(source)
+    meta_path = os.path.join(source, "windows", "meta.json")
+    built = os.stat(meta_path).st_mtime_ns
+    second = WindowDataset.from_source(source)
+    assert os.stat(meta_path).st_mtime_ns == built
+    assert len(second) == len(first) > 0
+
+
+# recordings appended after the cache was built: the cache has to be rebuilt,
+# not silently reused with the old windows
+def test_appended_recordings_rebuild_the_cache(tmp_path):
+    source = str(tmp_path / "recordings")
+    record(source, 3)
+    before = len(WindowDataset.from_source(source))
+    record(source, 10)
+    after = len(WindowDataset.from_source(source))
+    assert after > before
+    assert after == len(WindowDataset.from_source(source, rebuild=True))
@@ -0,0 +1,37 @@
+import time
+from detection import AsyncDetector
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < end:
+        time.sleep(0.001)
+    return condition()
+
+
+# a detect() that raises loses that frame, not the worker
+def test_worker_survives_a_failing_detect():
+    calls = []
+    released = []
+
+    def detect(image):
+        calls.append(image)
+        if len(calls) == 1:
+            raise RuntimeError("bad frame")
+        return [[image, 0, image + 1, 1]], [0.9], [0]
+
+    detector = AsyncDetector(detect, release=released.append)
+    detector.submit(0, 0)
+    assert wait_for(lambda: detector.stats.errors == 1)
+    for frame in range(1, 6):
+        detector.submit(frame, frame)
+        assert wait_for(lambda: detector.stats.processed + detector.stats.dropped >= frame)
+    assert wait_for(lambda: detector.latest().frame == 5)
+    assert detector.worker.is_alive()
+    detector.close()
+
+    assert detector.stats.errors == 1
+    assert isinstance(detector.error, RuntimeError)
+    assert detector.stats.processed == 5 - detector.stats.dropped
+    # the failed frame was released as well
+    assert sorted(released) == list(range(6))
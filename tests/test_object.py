@@ -0,0 +1,40 @@
+import random
+from object import MAX_CACHED_ROUTES, Pedestrian, route_cache
+from engine import CROWD_DEPTH, CROWD_SPREAD
+
+
+def test_route_is_shared_between_pedestrians_and_rounds():
+    first, second = Pedestrian(id=0), Pedestrian(id=1)
+    path = first.path
+    first.start_new_round()
+    assert first.path is path
+    assert second.path is path
+
+
+# crowd mode: (almost) every round starts at another offset, the cache must not
+# keep all of those routes
+def test_route_cache_is_bounded_in_crowd_mode():
+    rng = random.Random(0)
+    pedestrians = [Pedestrian(id=i) for i in range(200)]
+    for _ in range(10):
+        for pedestrian in pedestrians:
+            pedestrian.case = rng.randrange(4)
+            pedestrian.offset = (rng.randint(*CROWD_SPREAD), rng.randint(0, CROWD_DEPTH))
+            pedestrian.start_new_round()
+    assert len(route_cache) <= MAX_CACHED_ROUTES
+
+    # the routes still in use are intact, evicted or not
+    for pedestrian in pedestrians:
+        assert pedestrian.path[0] == pedestrian.start
+        assert pedestrian.path == tuple(pedestrian.compute_path())
+
+
+def test_evicted_route_is_rebuilt_the_same():
+    pedestrian = Pedestrian()
+    pedestrian.offset = (37, 123)
+    pedestrian.start_new_round()
+    path = pedestrian.path
+    route_cache.clear()
+    pedestrian.start_new_round()
+    assert pedestrian.path is not path
+    assert pedestrian.path == path
@@ -0,0 +1,45 @@
+from transport import FULL, INDEX, QueueTransport, decode, encode
+
+PATH = [(650, 9 * i) for i in range(10)]
+
+
+def test_late_resend_of_the_same_version_is_stale():
+    transport = QueueTransport()
+    transport.apply((FULL, 0, 1, 0, 1.0, 9.0, 0, PATH))
+    transport.apply((INDEX, 0, 1, 0, 2.0, 4))
+    transport.apply((FULL, 0, 1, 0, 3.0, 9.0, 5, PATH))
+    # the FULL sent at 1.5 arrives last: it must not move the start back
+    transport.apply((FULL, 0, 1, 0, 1.5, 9.0, 1, PATH))
+    transport.apply((INDEX, 0, 1, 0, 2.5, 3))
+    assert transport.paths[0]["start"] == 5
+    assert transport.stats.dropped == 2
+
+
+def test_newer_version_replaces_the_path():
+    transport = QueueTransport()
+    transport.apply((FULL, 0, 1, 0, 1.0, 9.0, 7, PATH))
+    transport.apply((FULL, 0, 1, 1, 2.0, 9.0, 0, PATH[:3]))
+    assert transport.paths[0]["start"] == 0
+    assert transport.paths[0]["precomputed_path"] == PATH[:3]
+    # an index of the old version is stale
+    transport.apply((INDEX, 0, 1, 0, 3.0, 8))
+    assert transport.paths[0]["start"] == 0
+
+
+def test_restarted_sender_is_newer():
+    transport = QueueTransport()
+    old, new = QueueTransport(), QueueTransport()
+    assert new.epoch > old.epoch
+    for sender in (old, new):
+        sender.send(0, PATH, 3 if sender is old else 0, 9.0)
+    # old: version 0 at start 3, new: version 0 again at start 0, any order
+    messages = [old.queue.get(), new.queue.get()]
+    for message in reversed(messages):
+        transport.apply(message)
+    assert transport.paths[0]["epoch"] == new.epoch
+    assert transport.paths[0]["start"] == 0
+
+
+def test_binary_round_trip():
+    for message in [(FULL, 7, 123456789012, 3, 1.5, 9.0, 2, PATH), (INDEX, 7, 123456789012, 3, 1.5, 4)]:
+        assert decode(encode(message)) == message
@@ -0,0 +1,91 @@
+import asyncio
+import struct
+import numpy as np
+from transport import FULL, INDEX, encode
+from v2x_server import PathStore, V2XServer, encode_batch
+
+PATH = np.stack([np.full(5, 650), np.arange(5) * 9], axis=1)
+
+
+def full(pedestrian_id=0, version=0, sent_time=1.0, epoch=1, start=0):
+    return encode((FULL, pedestrian_id, epoch, version, sent_time, 9.0, start, PATH))
+
+
+def index(start, pedestrian_id=0, version=0, sent_time=2.0, epoch=1):
+    return encode((INDEX, pedestrian_id, epoch, version, sent_time, start))
+
+
+def test_valid_batch_is_applied():
+    store = PathStore()
+    assert store.apply_batch(encode_batch([full(), index(3)])[4:]) == 2
+    assert np.array_equal(store.paths[0]["precomputed_path"], PATH)
+    assert store.paths[0]["start"] == 3
+    assert store.malformed == 0
+
+
+# a restarted sender counts from version 0 again, on a new send time clock
+def test_restarted_sender_replaces_the_old_one():
+    store = PathStore()
+    assert store.apply(full(version=5, sent_time=100.0, start=4))
+    assert store.apply(index(6, version=5, sent_time=101.0))
+    assert store.apply(full(version=0, sent_time=0.5, epoch=2))
+    assert store.paths[0]["start"] == 0
+    assert store.apply(index(1, version=0, sent_time=0.6, epoch=2))
+    assert store.apply(full(version=1, sent_time=0.7, epoch=2))
+    # late messages of the old sender are stale now
+    assert not store.apply(index(7, version=5, sent_time=102.0))
+    assert not store.apply(full(version=6, sent_time=103.0))
+    assert (store.paths[0]["epoch"], store.paths[0]["version"]) == (2, 1)
+
+
+def test_malformed_messages_are_dropped():
+    store = PathStore()
+    message = full()
+    for bad in [message[:10],                       # cut in the header
+                message[:-8],                       # one point missing
+                message + b"\0" * 8,                # one point too many
+                b"\x07" + message[1:],              # unknown kind
+                index(3)[:-1]]:
+        assert store.apply(bad) is False
+    assert store.malformed == 5
+    assert store.stats.dropped == 5
+    assert store.paths == {}
+
+
+def test_malformed_batches_are_dropped():
+    store = PathStore()
+    payload = encode_batch([full(), index(3)])[4:]
+    for bad in [b"",
+                b"\x03\x00" + payload[2:],          # more messages than there are
+                b"\x01\x00" + payload[2:],          # fewer messages than there are
+                payload[:-1]]:                      # last message cut off
+        assert store.apply_batch(bad) == 0
+    assert store.malformed == 4
+    assert store.paths == {}
+    # the store still takes a good batch afterwards
+    assert store.apply_batch(payload) == 2
+
+
+# a malformed batch on a connection must not end the connection: the good
+# batch after it still arrives
+def test_server_survives_malformed_batches():
+    async def run():
+        store = PathStore()
+        server = await V2XServer(store, port=0).start()
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        bad = b"\x05\x00" + struct.pack("<H", 3) + b"abc"
+        writer.write(struct.pack("<I", len(bad)) + bad)
+        writer.write(encode_batch([full(), index(2)]))
+        await writer.drain()
+        for _ in range(500):
+            if server.batches == 2:
+                break
+            await asyncio.sleep(0.005)
+        writer.close()
+        server.server.close()
+        return store, server
+
+    store, server = asyncio.run(run())
+    assert server.batches == 2
+    assert store.malformed == 1
+    assert store.paths[0]["start"] == 2
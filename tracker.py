@@ -0,0 +1,183 @@
+import argparse
+import collections
+import math
+import time
+import numpy as np
+import pygame
+from trajectory_features import TrajectoryFeatures
+from engine import PERSON_CLASS_ID
+
+# points kept per track, the passive controller needs more than 20
+TRAJECTORY_LENGTH = 32
+# frames the speed estimate averages over
+SPEED_WINDOW = 10
+
+
+def iou_matrix(a, b):
+    # a: (T, 4), b: (D, 4) xyxy boxes -> (T, D) intersection over union
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def centroid_distance_matrix(a, b):
+    ca = (a[:, :2] + a[:, 2:]) / 2
+    cb = (b[:, :2] + b[:, 2:]) / 2
+    return np.hypot(ca[:, None, 0] - cb[None, :, 0], ca[:, None, 1] - cb[None, :, 1])
+
+
+# cheapest pairs first, every row / column used at most once
+# only pairs with cost < max_cost are considered
+def greedy_assignment(cost, max_cost):
+    rows, cols = np.nonzero(cost < max_cost)
+    order = np.argsort(cost[rows, cols], kind="stable")
+    used_rows, used_cols = set(), set()
+    matches = []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((row, col))
+    return matches
+
+
+# optimal assignment (needs scipy), pairs with cost >= max_cost are dropped afterwards
+def hungarian_assignment(cost, max_cost):
+    from scipy.optimize import linear_sum_assignment
+    rows, cols = linear_sum_assignment(np.minimum(cost, max_cost))
+    return [(row, col) for row, col in zip(rows.tolist(), cols.tolist()) if cost[row, col] < max_cost]
+
+
+ASSIGNMENTS = {"greedy": greedy_assignment, "hungarian": hungarian_assignment}
+
+# highest cost of a match: no overlap at all (1) and centroids max_distance apart (1)
+MAX_COST = 2.0 + 1e-9
+
+
+# One tracked object, with the attributes car_control_logic_passive reads from
+# a Pedestrian: trajectory (top left corners), features, speed, width and rect
+class Track:
+    # box: (x1, y1, x2, y2) floats, pixels: the same rounded to ints
+    def __init__(self, track_id, box, pixels, class_id):
+        self.track_id = track_id
+        self.pedestrian_id = track_id
+        self.class_id = class_id
+        self.trajectory = collections.deque(maxlen=TRAJECTORY_LENGTH)
+        self.features = TrajectoryFeatures()
+        self.steps = collections.deque(maxlen=SPEED_WINDOW)  # recent step lengths
+        self.steps_sum = 0.0
+        self.speed = 0.0
+        self.hits = 0
+        self.time_since_update = 0
+        self.update(box, pixels)
+
+    def update(self, box, pixels):
+        self.box = box
+        x1, y1, x2, y2 = pixels
+        self.rect = pygame.Rect(x1, y1, x2 - x1, y2 - y1)
+        self.width, self.height = self.rect.size
+        self.hits += 1
+        self.time_since_update = 0
+
+        point = (x1, y1)
+        # a box that did not move has no heading, only moving steps go into the trajectory
+        if self.trajectory and self.trajectory[-1] == point:
+            return
+        if self.trajectory:
+            if len(self.steps) == SPEED_WINDOW:
+                self.steps_sum -= self.steps[0]
+            step = math.dist(self.trajectory[-1], point)
+            self.steps.append(step)
+            self.steps_sum += step
+            self.speed = self.steps_sum / len(self.steps)
+        self.trajectory.append(point)
+        self.features.append(point)
+
+
+# Associates the boxes of every frame with tracks.
+# cost of a track / box pair = (1 - IoU) + centroid distance / max_distance,
+# pairs whose centroids are further apart than max_distance are never matched.
+# Boxes nobody matched start new tracks, tracks without a box for more than
+# max_age frames are dropped.
+class Tracker:
+    def __init__(self, max_distance=60, max_age=5, method="greedy", classes=(PERSON_CLASS_ID,)):
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.assign = ASSIGNMENTS[method]
+        self.classes = classes
+        self.tracks = []
+        self.next_id = 0
+
+    # detections: (xyxys, confidences, class_ids)
+    # returns the tracks that got a box this frame, oldest first
+    def update(self, detections):
+        xyxys, confidences, class_ids = detections
+        boxes = np.asarray(xyxys, dtype=np.float64).reshape(-1, 4)
+        class_ids = np.asarray(class_ids).reshape(-1)
+        if self.classes is not None and len(boxes):
+            keep = np.isin(class_ids, self.classes)
+            boxes, class_ids = boxes[keep], class_ids[keep]
+
+        for track in self.tracks:
+            track.time_since_update += 1
+
+        # python lists once for the per-track updates
+        box_list = boxes.tolist()
+        pixel_list = np.rint(boxes).astype(int).tolist()
+        matched_boxes = set()
+        if self.tracks and len(boxes):
+            track_boxes = np.array([track.box for track in self.tracks], dtype=np.float64)
+            distance = centroid_distance_matrix(track_boxes, boxes)
+            cost = (1 - iou_matrix(track_boxes, boxes)) + distance / self.max_distance
+            cost[distance > self.max_distance] = np.inf
+            for row, col in self.assign(cost, MAX_COST):
+                self.tracks[row].update(box_list[col], pixel_list[col])
+                matched_boxes.add(col)
+
+        self.tracks = [track for track in self.tracks if track.time_since_update <= self.max_age]
+        for col in range(len(boxes)):
+            if col not in matched_boxes:
+                self.tracks.append(Track(self.next_id, box_list[col], pixel_list[col], int(class_ids[col])))
+                self.next_id += 1
+
+        return [track for track in self.tracks if track.time_since_update == 0]
+
+
+if __name__ == "__main__":
+    from engine import Engine, summarize
+
+    parser = argparse.ArgumentParser(description="Benchmark the detection tracker")
+    parser.add_argument("--objects", type=int, nargs="+", default=[1, 10, 50, 100], help="Objects per frame")
+    parser.add_argument("--frames", type=int, default=500, help="Frames per benchmark")
+    parser.add_argument("--method", type=str, default="greedy", choices=list(ASSIGNMENTS), help="Assignment method")
+    parser.add_argument("--n_rounds", type=int, default=50, help="Rounds of the passive controller comparison")
+    args = parser.parse_args()
+
+    # per-frame cost: n boxes moving 9 px per frame in random directions, spread over the screen
+    rng = np.random.default_rng(0)
+    for n in args.objects:
+        corners = rng.uniform((0, 0), (1300, 660), (n, 2))
+        angles = rng.uniform(-np.pi, np.pi, n)
+        velocity = 9 * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        tracker = Tracker(method=args.method)
+        elapsed = 0.0
+        for frame in range(args.frames):
+            corners += velocity
+            xyxys = np.concatenate([corners, corners + (100, 140)], axis=1)
+            detections = (xyxys, np.ones(n), np.zeros(n))
+            start = time.perf_counter()
+            tracker.update(detections)
+            elapsed += time.perf_counter() - start
+        print(f"{n:4d} objects: {elapsed / args.frames * 1e3:.3f} ms/frame, {len(tracker.tracks)} tracks, {tracker.next_id} ids")
+
+    # passive controller fed from the tracker vs straight from the Pedestrian objects
+    for label, tracker in [("pedestrians", None), ("tracker", Tracker(method=args.method))]:
+        engine = Engine("passive", "ttc", num_pedestrian=3, seed=0, tracker=tracker)
+        summary = summarize(engine.run(args.n_rounds))
+        print(f"{label:12s} collisions {summary['collisions']}  frames {summary['frames']}  mean min distance {summary['mean_min_distance']:.1f}")
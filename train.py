@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+from data_pipeline import WindowDataset, ACCOUNTED_LENGTH
+
+# one frame of the simulation (engine.FPS = 60), car_control_logic_passive
+# runs one forward pass for all tracked pedestrians per frame
+FRAME_BUDGET_MS = 1000 / 60
+
+# datasets up to this many windows are trained from in-memory tensors
+# (tf.data over a python generator costs more than the tiny models themselves)
+IN_MEMORY_WINDOWS = 1 << 20
+
+CHECKPOINT_DIR = "checkpoints"
+MODEL_DIR = "models"
+
+
+# the model zoo, every model maps (N, ACCOUNTED_LENGTH, 1) angles to (N, 1) next angle
+def simple_rnn(keras, length):
+    return keras.Sequential([keras.Input((length, 1)), keras.layers.SimpleRNN(50, activation="relu"), keras.layers.Dense(1)])
+
+
+def gru(keras, length):
+    return keras.Sequential([keras.Input((length, 1)), keras.layers.GRU(32), keras.layers.Dense(1)])
+
+
+def conv1d(keras, length):
+    return keras.Sequential([keras.Input((length, 1)),
+                             keras.layers.Conv1D(16, 3, activation="relu"),
+                             keras.layers.Conv1D(16, 3, activation="relu"),
+                             keras.layers.Flatten(),
+                             keras.layers.Dense(1)])
+
+
+# next angle = weighted sum of the window, the learned version of the WMA strategy
+def linear(keras, length):
+    return keras.Sequential([keras.Input((length, 1)), keras.layers.Flatten(), keras.layers.Dense(1)])
+
+
+MODELS = {"simple_rnn": simple_rnn, "gru": gru, "conv1d": conv1d, "linear": linear}
+
+
+def make_dataset(windows, batch_size, shuffle=False, seed=None):
+    import tensorflow as tf
+    if len(windows) > IN_MEMORY_WINDOWS:
+        return windows.tf_dataset(batch_size, shuffle, seed)
+    X, y = windows.arrays()
+    dataset = tf.data.Dataset.from_tensor_slices((X, y)).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(windows), seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+# validation loss of the WMA strategy (no training), the baseline every model has to beat
+def wma_loss(windows):
+    X, y = windows.arrays()
+    weights = np.arange(1, X.shape[1] + 1)
+    predicted = X[:, :, 0] @ weights / weights.sum()
+    return float(np.mean((predicted - y) ** 2)) if len(y) else float("nan")
+
+
+def write_json(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary, path)
+
+
+def make_checkpointer(keras, directory, patience, every, state, min_delta=1e-5):
+    # Early stopping on val_loss that also checkpoints:
+    #   best.keras  the model of the best epoch so far
+    #   last.keras  model + optimizer every `every` epochs (and when training ends)
+    #   state.json  epoch, best loss, epochs without improvement, history
+    # all of it is restored by --resume, so a resumed run stops at the same epoch
+    # an uninterrupted one would have.
+    class Checkpointer(keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            logs = logs or {}
+            loss = float(logs.get("val_loss", logs.get("loss")))
+            state["history"].append({"epoch": epoch + 1, "loss": float(logs.get("loss", np.nan)), "val_loss": loss})
+            state["epoch"] = epoch + 1
+            if loss < state["best"] - min_delta:
+                state["best"] = loss
+                state["best_epoch"] = epoch + 1
+                state["wait"] = 0
+                self.model.save(os.path.join(directory, "best.keras"))
+            else:
+                state["wait"] += 1
+                if state["wait"] >= patience:
+                    state["stopped"] = True
+                    self.model.stop_training = True
+            if state["epoch"] % every == 0 or state["stopped"]:
+                self.save()
+
+        def on_train_end(self, logs=None):
+            self.save()
+
+        def save(self):
+            self.model.save(os.path.join(directory, "last.keras"))
+            write_json(os.path.join(directory, "state.json"), state)
+
+    return Checkpointer()
+
+
+def train_model(name, train, val, epochs, batch_size, patience, checkpoint_every, resume, seed, verbose):
+    import keras
+
+    directory = os.path.join(CHECKPOINT_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    state_path = os.path.join(directory, "state.json")
+
+    if resume and os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        model = keras.models.load_model(os.path.join(directory, "last.keras"))
+        print(f"{name}: resuming after epoch {state['epoch']} (best {state['best']:.5f} at epoch {state['best_epoch']})")
+    else:
+        keras.utils.set_random_seed(seed)
+        model = MODELS[name](keras, train.length)
+        model.compile(optimizer="adam", loss="mean_squared_error")
+        state = {"model": name, "epoch": 0, "best": float("inf"), "best_epoch": 0, "wait": 0, "stopped": False, "history": []}
+
+    start = time.perf_counter()
+    if not state["stopped"] and state["epoch"] < epochs:
+        # the dataset shuffles itself
+        model.fit(make_dataset(train, batch_size, shuffle=True, seed=seed), epochs=epochs, initial_epoch=state["epoch"],
+                  validation_data=make_dataset(val, batch_size) if len(val) else None,
+                  callbacks=[make_checkpointer(keras, directory, patience, checkpoint_every, state)], shuffle=False, verbose=verbose)
+    train_time = time.perf_counter() - start
+
+    # the weights of the best epoch, not the last one
+    best_path = os.path.join(directory, "best.keras")
+    if os.path.exists(best_path):
+        model = keras.models.load_model(best_path)
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    model.save(os.path.join(MODEL_DIR, name + ".h5"))
+    return model, state, train_time
+
+
+# per-call latency (ms) of the compiled forward pass trajectory_prediction.py
+# uses (and of the NumPy backend for the SimpleRNN), at each batch size
+def measure_latency(name, model, length, batch_sizes, repeat):
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec([None, length, 1], tf.float32)])
+    def forward(input_sequences):
+        return model(input_sequences, training=False)
+
+    backends = {"tensorflow": lambda x: forward(x).numpy()}
+    if name == "simple_rnn":
+        from rnn_numpy import NumpyRNN, export_weights
+        export_weights(os.path.join(MODEL_DIR, name + ".h5"), os.path.join(MODEL_DIR, name + ".npz"))
+        backends["numpy"] = NumpyRNN.load(os.path.join(MODEL_DIR, name + ".npz"))
+
+    rng = np.random.default_rng(0)
+    latency = {}
+    for backend, function in backends.items():
+        for batch_size in batch_sizes:
+            x = rng.uniform(-np.pi, np.pi, (batch_size, length, 1)).astype(np.float32)
+            function(x)  # trace / warm up
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function(x)
+                times.append(time.perf_counter() - start)
+            latency[f"{backend}_{batch_size}"] = float(np.median(times) * 1e3)
+    return latency
+
+
+# make a trained model the one the simulation loads (trajectory_model.h5 / .npz)
+def install(name):
+    shutil.copyfile(os.path.join(MODEL_DIR, name + ".h5"), "trajectory_model.h5")
+    if name == "simple_rnn":
+        from rnn_numpy import export_weights
+        export_weights("trajectory_model.h5", "trajectory_model.npz")
+    elif os.path.exists("trajectory_model.npz"):
+        # the NumPy backend only runs the SimpleRNN, without the stale npz
+        # RNN_BACKEND=auto falls back to TensorFlow and loads the new h5
+        os.remove("trajectory_model.npz")
+    print(f"installed {name} as trajectory_model.h5")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and compare trajectory prediction models")
+    parser.add_argument("--data", type=str, default="dataset.npy", help="Recording directory (recorder.py) or (N, 2) positions .npy")
+    parser.add_argument("--models", type=str, nargs="+", default=list(MODELS), choices=list(MODELS), help="Models to train")
+    parser.add_argument("--epochs", type=int, default=200, help="Maximum number of epochs")
+    parser.add_argument("--batch_size", type=int, default=32, help="Batch size")
+    parser.add_argument("--patience", type=int, default=20, help="Epochs without validation improvement before stopping")
+    parser.add_argument("--checkpoint_every", type=int, default=10, help="Save a resumable checkpoint every N epochs")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoints in checkpoints/<model>")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--latency_batch", type=int, nargs="+", default=[1, 8], help="Batch sizes of the latency measurement")
+    parser.add_argument("--latency_repeat", type=int, default=200, help="Forward passes per latency measurement")
+    parser.add_argument("--install", type=str, default=None, choices=list(MODELS), help="Install this model as trajectory_model.h5 afterwards")
+    parser.add_argument("--verbose", type=int, default=0, help="Keras fit verbosity")
+    args = parser.parse_args()
+
+    dataset = WindowDataset.from_source(args.data, ACCOUNTED_LENGTH)
+    train, val = dataset.split(0.8)
+    print(f"{len(train)} training / {len(val)} validation windows, WMA validation loss {wma_loss(val):.5f}")
+
+    results = []
+    for name in args.models:
+        model, state, train_time = train_model(name, train, val, args.epochs, args.batch_size, args.patience,
+                                               args.checkpoint_every, args.resume, args.seed, args.verbose)
+        latency = measure_latency(name, model, ACCOUNTED_LENGTH, args.latency_batch, args.latency_repeat)
+        results.append({"model": name, "params": model.count_params(), "val_loss": state["best"],
+                        "best_epoch": state["best_epoch"], "epochs": state["epoch"], "train_time": train_time, "latency_ms": latency})
+
+    print(f"\n{'model':12s} {'params':>7s} {'val loss':>9s} {'epochs':>9s} {'train s':>8s}  latency ms (budget {FRAME_BUDGET_MS:.1f} ms/frame)")
+    for result in results:
+        latency = "  ".join(f"{key} {value:.3f}" for key, value in result["latency_ms"].items())
+        print(f"{result['model']:12s} {result['params']:7d} {result['val_loss']:9.5f} {result['best_epoch']:4d}/{result['epochs']:<4d} "
+              f"{result['train_time']:8.1f}  {latency}")
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    write_json(os.path.join(MODEL_DIR, "results.json"), results)
+
+    if args.install:
+        install(args.install)
@@ -0,0 +1,79 @@
+import math
+import numpy as np
+
+# the number of past heading angles the predictors look at
+# (same as ACCOUNTED_LENGTH in trajectory_prediction.py)
+ACCOUNTED_LENGTH = 10
+
+
+# Rolling window of the last `length` heading angles of a trajectory.
+# append() is O(1): it computes one atan2 and updates the sums that the
+# weighted moving average needs, instead of recomputing the whole window.
+#   plain_sum    = a_1 + ... + a_n
+#   weighted_sum = 1 * a_1 + ... + n * a_n   (a_n = newest angle)
+class TrajectoryFeatures:
+    def __init__(self, length=ACCOUNTED_LENGTH):
+        self.length = length
+        self.angles = np.zeros(length)  # ring buffer, head = next slot to write
+        self.reset()
+
+    # empty window, keeps the buffer
+    def reset(self):
+        self.head = 0
+        self.count = 0  # number of angles in the window (<= length)
+        self.n_points = 0
+        self.last_point = None
+        self.plain_sum = 0.0
+        self.weighted_sum = 0.0
+
+    def __len__(self):
+        return self.n_points
+
+    def copy(self):
+        features = TrajectoryFeatures.__new__(TrajectoryFeatures)
+        features.__dict__.update(self.__dict__)
+        features.angles = self.angles.copy()
+        return features
+
+    def append(self, point):
+        if self.last_point is not None:
+            dx = point[0] - self.last_point[0]
+            dy = point[1] - self.last_point[1]
+            self.push_angle(math.atan2(dy, dx))
+        self.last_point = point
+        self.n_points += 1
+
+    def push_angle(self, angle):
+        if self.count == self.length:
+            # every weight drops by one, the oldest angle (weight 1) leaves the window
+            # and the new one comes in with the largest weight
+            oldest = self.angles[self.head]
+            self.weighted_sum += self.length * angle - self.plain_sum
+            self.plain_sum += angle - oldest
+        else:
+            self.count += 1
+            self.weighted_sum += self.count * angle
+            self.plain_sum += angle
+
+        self.angles[self.head] = angle
+        self.head = (self.head + 1) % self.length
+
+        # recompute the sums exactly once per lap of the ring buffer so the
+        # floating point error of the updates cannot build up (amortized O(1))
+        if self.head == 0 and self.count == self.length:
+            self.plain_sum = float(self.angles.sum())
+            self.weighted_sum = float(np.arange(1, self.length + 1) @ self.angles)
+
+    def window(self):
+        # the angles in the window, oldest first
+        if self.count < self.length:
+            return self.angles[:self.count].copy()
+        return np.roll(self.angles, -self.head)
+
+    def wma_angle(self):
+        sum_of_weights = self.count * (self.count + 1) / 2
+        return self.weighted_sum / sum_of_weights
+
+    def wma_direction(self):
+        theta_WMA = self.wma_angle()
+        return (math.cos(theta_WMA), math.sin(theta_WMA))
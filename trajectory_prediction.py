@@ -1,16 +1,27 @@
+import functools
 import math
+import os
+import time
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import SimpleRNN, Dense
+from trajectory_features import TrajectoryFeatures
 
 WIDTH, HEIGHT = 1400, 800
 
+# RNN inference backend: "numpy" (rnn_numpy.py, no TensorFlow import), "tensorflow",
+# or "auto" = numpy when the exported weights exist, tensorflow otherwise
+RNN_BACKEND = os.environ.get("RNN_BACKEND", "auto")
+RNN_MODEL_PATH = "trajectory_model.h5"
+RNN_WEIGHTS_PATH = "trajectory_model.npz"
+
 # the number of past trajectory coordinates that should be taken 
 # into consideration to compute weighted moving average
 ACCOUNTED_LENGTH = 10
 
 def weighted_moving_average(trajectory: list):
+    # incrementally maintained window (see trajectory_features.py)
+    if isinstance(trajectory, TrajectoryFeatures):
+        return trajectory.wma_direction()
+
     # calculate corresponding angles
     angles = []
 
@@ -38,19 +49,153 @@ def weighted_moving_average(trajectory: list):
     predicted_direction = (math.cos(theta_WMA), math.sin(theta_WMA))
     return predicted_direction
 
-RNN_model = tf.keras.models.load_model("trajectory_model.h5")
+# Feeding the WMA its own predictions is a linear recurrence on the angles:
+#   a_new = (1 * a_1 + ... + k * a_k) / (1 + ... + k)   over the last k angles
+# so every future angle is a fixed linear combination of the n angles we start with.
+# Row j of this (steps, n) matrix holds the weights of the j-th future angle, it is
+# built once by running the recurrence on the unit vectors.
+@functools.lru_cache(maxsize=None)
+def wma_rollout_matrix(n, steps, length=ACCOUNTED_LENGTH):
+    window = list(np.eye(n))
+    rows = []
+    for _ in range(steps):
+        k = min(len(window), length)
+        weights = np.arange(1, k + 1)
+        new = weights @ np.array(window[-k:]) / weights.sum()
+        rows.append(new)
+        window.append(new)
+    matrix = np.array(rows)
+    matrix.setflags(write=False)
+    return matrix
+
+def wma_rollout_angles(windows, steps):
+    # windows: (N, n) past angles, oldest first -> (N, steps) predicted angles
+    windows = np.atleast_2d(windows)
+    return windows @ wma_rollout_matrix(windows.shape[1], steps).T
+
+def angle_rollout(last_points, angles, speed):
+    # walk `speed` px per step along the given angles, starting after last_points
+    # last_points: (N, 2), angles: (N, steps) -> (N, steps, 2)
+    steps = np.stack([np.cos(angles), np.sin(angles)], axis=-1) * np.reshape(speed, (-1, 1, 1))
+    # cumsum from the last point adds the steps in the same order as a python loop would
+    points = np.concatenate([np.asarray(last_points, dtype=np.float64)[:, None, :], steps], axis=1)
+    return np.cumsum(points, axis=1)[:, 1:]
+
+# the whole future trajectory of the WMA strategy in one vectorized pass
+# trajectory: list of points or TrajectoryFeatures, returns a (steps, 2) array
+def wma_rollout(trajectory, speed, steps):
+    if isinstance(trajectory, TrajectoryFeatures):
+        window, last_point = trajectory.window(), trajectory.last_point
+    else:
+        window, last_point = trajectory_angles(trajectory), trajectory[-1]
+    angles = wma_rollout_angles(window, steps)
+    return angle_rollout([last_point], angles, speed)[0]
+
+# keep walking in a constant direction (used with the RNN prediction)
+def direction_rollout(last_point, direction, speed, steps):
+    angle = math.atan2(direction[1], direction[0])
+    return angle_rollout([last_point], np.full((1, steps), angle), speed)[0]
+
+# callable (N, ACCOUNTED_LENGTH, 1) float32 -> (N, 1) numpy array, loaded on first use
+RNN_forward = None
+
+def load_rnn_backend(backend=RNN_BACKEND):
+    global RNN_forward
+
+    if backend == "auto":
+        backend = "numpy" if os.path.exists(RNN_WEIGHTS_PATH) else "tensorflow"
+
+    if backend == "numpy":
+        from rnn_numpy import NumpyRNN
+        RNN_forward = NumpyRNN.load(RNN_WEIGHTS_PATH)
+
+    elif backend == "tensorflow":
+        import tensorflow as tf
+        RNN_model = tf.keras.models.load_model(RNN_MODEL_PATH)
+
+        # one compiled forward pass for any batch size, much cheaper than RNN_model.predict
+        # (predict builds a dataset / callbacks on every call)
+        @tf.function(input_signature=[tf.TensorSpec([None, ACCOUNTED_LENGTH, 1], tf.float32)])
+        def forward(input_sequences):
+            return RNN_model(input_sequences, training=False)
+
+        RNN_forward = lambda input_sequences: forward(input_sequences).numpy()
+
+    else:
+        raise ValueError(f"unknown RNN backend: {backend}")
+
+    return backend
+
+def trajectory_angles(trajectory, length=ACCOUNTED_LENGTH):
+    # heading angles of the last `length` steps of the trajectory
+    points = np.asarray(trajectory[-(length + 1):], dtype=np.float64)
+    steps = np.diff(points, axis=0)
+    return np.arctan2(steps[:, 1], steps[:, 0])
+
+# predict the direction of every trajectory in a single forward pass
+# trajectories: list of trajectories (lists of points or TrajectoryFeatures)
+# with more than ACCOUNTED_LENGTH points each
+# returns an (N, 2) array of unit direction vectors
+def RNN_prediction_batch(trajectories):
+    if len(trajectories) == 0:
+        return np.empty((0, 2))
+
+    input_sequences = np.stack([trajectory.window() if isinstance(trajectory, TrajectoryFeatures) else trajectory_angles(trajectory)
+                                for trajectory in trajectories])
+    input_sequences = input_sequences.reshape((len(trajectories), ACCOUNTED_LENGTH, 1)).astype(np.float32)
+    if RNN_forward is None:
+        load_rnn_backend()
+    predicted_angles = RNN_forward(input_sequences)[:, 0]
+
+    return np.stack([np.cos(predicted_angles), np.sin(predicted_angles)], axis=1)
+
 def RNN_prediction(trajectory):
-    angles = []
+    predicted_direction = RNN_prediction_batch([trajectory])[0]
+    return (float(predicted_direction[0]), float(predicted_direction[1]))
 
-    for i in range(len(trajectory) - 1):
-        dx = trajectory[i+1][0] - trajectory[i][0]
-        dy = trajectory[i+1][1] - trajectory[i][1]
 
-        angle = math.atan2(dy, dx)
-        angles.append(angle)
+if __name__ == "__main__":
+    # benchmark: vectorized rollouts vs the step-by-step loops of car_control_logic_passive
+    PREDICT_STEPS = 100
+    SPEED = 9
+    REPEAT = 200
+    rng = np.random.default_rng(0)
+    trajectory = [tuple(point) for point in np.cumsum(rng.uniform(-9, 9, size=(40, 2)), axis=0)]
+
+    def wma_loop(trajectory):
+        past_trajectory = trajectory[:]
+        future_trajectory = []
+        for _ in range(PREDICT_STEPS):
+            predicted_direction = weighted_moving_average(past_trajectory)
+            predicted_step_x = past_trajectory[-1][0] + predicted_direction[0] * SPEED
+            predicted_step_y = past_trajectory[-1][1] + predicted_direction[1] * SPEED
+            past_trajectory.append((predicted_step_x, predicted_step_y))
+            future_trajectory.append((predicted_step_x, predicted_step_y))
+        return np.array(future_trajectory)
+
+    def direction_loop(trajectory, direction):
+        past_trajectory = trajectory[:]
+        future_trajectory = []
+        for _ in range(PREDICT_STEPS):
+            predicted_step_x = past_trajectory[-1][0] + direction[0] * SPEED
+            predicted_step_y = past_trajectory[-1][1] + direction[1] * SPEED
+            past_trajectory.append((predicted_step_x, predicted_step_y))
+            future_trajectory.append((predicted_step_x, predicted_step_y))
+        return np.array(future_trajectory)
 
-    input_sequence = np.array(angles[-ACCOUNTED_LENGTH:]).reshape((1, ACCOUNTED_LENGTH, 1))
-    predicted_angle = RNN_model.predict(input_sequence)[0][0]
+    def timeit(function):
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            result = function()
+        return (time.perf_counter() - start) / REPEAT * 1e6, result
 
-    predicted_direction = (math.cos(predicted_angle), math.sin(predicted_angle))
-    return predicted_direction
\ No newline at end of file
+    direction = weighted_moving_average(trajectory)
+    for name, loop, vectorized in [
+        ("wma", lambda: wma_loop(trajectory), lambda: wma_rollout(trajectory, SPEED, PREDICT_STEPS)),
+        ("direction", lambda: direction_loop(trajectory, direction), lambda: direction_rollout(trajectory[-1], direction, SPEED, PREDICT_STEPS)),
+    ]:
+        loop_time, expected = timeit(loop)
+        vectorized_time, predicted = timeit(vectorized)
+        error = np.abs(expected - predicted).max()
+        print(f"{name:10s} loop {loop_time:8.1f} us  vectorized {vectorized_time:6.1f} us  "
+              f"speedup {loop_time / vectorized_time:5.1f}x  max error {error:.1e}")
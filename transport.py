@@ -0,0 +1,290 @@
+import argparse
+import collections
+import queue
+import socket
+import struct
+import time
+import numpy as np
+
+# Pedestrian -> car channel for the active mode.
+# Instead of posting the whole remaining path every frame, a pedestrian sends
+#   FULL  (pedestrian id, epoch, path version, speed, start, path)   when its path changes
+#   INDEX (pedestrian id, epoch, path version, start)                 every other frame
+# and the receiver rebuilds the same entries as control.precomputed_paths:
+#   {"precomputed_path": path, "start": start, "speed": speed, "epoch": epoch, "version": version}
+# epoch: when the sender started (wall clock, us). A restarted sender counts its
+# versions from 0 again on a new send time clock, its later epoch makes its
+# messages newer than anything of the old sender.
+FULL = 1
+INDEX = 2
+
+# resend the full path every this many frames, so a lost FULL message (UDP)
+# only costs a few frames
+FULL_EVERY = 60
+
+# binary layout (little endian)
+HEADER = struct.Struct("<BIQId")  # kind, pedestrian id, sender epoch, path version, send time
+FULL_BODY = struct.Struct("<fII")  # speed, start, number of points (then int32 x, y pairs)
+INDEX_BODY = struct.Struct("<I")   # start
+
+
+def encode(message):
+    header = HEADER.pack(*message[:5])
+    if message[0] == FULL:
+        speed, start, path = message[5:]
+        points = np.asarray(path, dtype=np.int32).reshape(-1, 2)
+        return header + FULL_BODY.pack(speed, start, len(points)) + points.tobytes()
+    return header + INDEX_BODY.pack(message[5])
+
+
+def decode(data):
+    header = HEADER.unpack_from(data)
+    if header[0] == FULL:
+        speed, start, n = FULL_BODY.unpack_from(data, HEADER.size)
+        points = np.frombuffer(data, dtype=np.int32, count=2 * n, offset=HEADER.size + FULL_BODY.size)
+        path = [tuple(point) for point in points.reshape(-1, 2).tolist()]
+        return (*header, speed, start, path)
+    (start,) = INDEX_BODY.unpack_from(data, HEADER.size)
+    return (*header, start)
+
+
+# sender epoch: wall clock us, later for a sender started later (also for two
+# senders started within the same us of one process)
+last_epoch = 0
+
+
+def new_epoch():
+    global last_epoch
+    last_epoch = max(time.time_ns() // 1000, last_epoch + 1)
+    return last_epoch
+
+
+# message counts, bytes and send -> apply latency of a transport
+class TransportStats:
+    def __init__(self, keep=10000):
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0  # stale / out of order (and, on a PathStore, malformed) messages
+        self.bytes = 0
+        self.latencies = collections.deque(maxlen=keep)
+
+    def summary(self):
+        latencies = np.array(self.latencies) * 1e6
+        summary = {"sent": self.sent, "received": self.received, "dropped": self.dropped, "bytes": self.bytes}
+        if len(latencies):
+            summary["latency_mean_us"] = float(latencies.mean())
+            summary["latency_p50_us"] = float(np.percentile(latencies, 50))
+            summary["latency_p99_us"] = float(np.percentile(latencies, 99))
+        return summary
+
+
+# sender and receiver side of a channel, subclasses only move messages:
+#   write(message)  sender side, hand one message to the channel
+#   flush()         sender side, end of frame (for transports that batch)
+#   poll()          receiver side, apply everything that arrived
+class Transport:
+    def __init__(self, paths=None, full_every=FULL_EVERY):
+        # receiver side, same layout as control.precomputed_paths
+        self.paths = {} if paths is None else paths
+        self.full_every = full_every
+        # sender side, pedestrian id -> [path object, version, frames since the last FULL, last start]
+        self.sent = {}
+        self.epoch = new_epoch()
+        self.stats = TransportStats()
+
+    def send(self, pedestrian_id, path, start, speed):
+        state = self.sent.get(pedestrian_id)
+        # a new path, or the same (shared, see object.route_cache) path walked again from the start
+        if state is None or state[0] is not path or start < state[3]:
+            version = 0 if state is None else state[1] + 1
+            state = [path, version, 0, start]
+            self.sent[pedestrian_id] = state
+        state[3] = start
+
+        if state[2] % self.full_every == 0:
+            self.write((FULL, pedestrian_id, self.epoch, state[1], time.perf_counter(), speed, start, path))
+        else:
+            self.write((INDEX, pedestrian_id, self.epoch, state[1], time.perf_counter(), start))
+        state[2] += 1
+        self.stats.sent += 1
+
+    def apply(self, message):
+        kind, pedestrian_id, epoch, version, sent_time = message[:5]
+        entry = self.paths.get(pedestrian_id)
+        if kind == FULL:
+            speed, start, path = message[5:]
+            # same order as v2x_server.PathStore: a later sender epoch, a higher version,
+            # or the same one sent later (a reordered resend must not move the start back)
+            if entry is not None and (entry.get("epoch", -1), entry.get("version", -1), entry.get("time", float("-inf"))) \
+                    >= (epoch, version, sent_time):
+                self.stats.dropped += 1
+                return
+            self.paths[pedestrian_id] = {"precomputed_path": path, "start": start, "speed": speed, "epoch": epoch,
+                                         "version": version, "time": sent_time}
+        else:
+            start = message[5]
+            # an index is only meaningful for the path version it was sent for
+            if entry is None or entry.get("epoch") != epoch or entry.get("version") != version or start < entry["start"] or \
+                    entry.get("time", float("-inf")) >= sent_time:
+                self.stats.dropped += 1
+                return
+            entry["start"] = start
+            entry["time"] = sent_time
+        self.stats.received += 1
+        self.stats.latencies.append(time.perf_counter() - sent_time)
+
+    def write(self, message):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def poll(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# both ends in the same process (e.g. headless runs), messages are passed as tuples
+class QueueTransport(Transport):
+    def __init__(self, paths=None, full_every=FULL_EVERY):
+        super().__init__(paths, full_every)
+        self.queue = queue.SimpleQueue()
+
+    def write(self, message):
+        self.queue.put(message)
+
+    def poll(self):
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.apply(message)
+
+
+# binary datagrams over UDP, one socket per side
+# bind: address the receiver listens on (None = send only)
+# target: address the sender sends to (None = receive only)
+class UDPTransport(Transport):
+    def __init__(self, paths=None, bind=("127.0.0.1", 5005), target=("127.0.0.1", 5005), full_every=FULL_EVERY):
+        super().__init__(paths, full_every)
+        self.target = target
+        self.receiver = None
+        if bind is not None:
+            self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            self.receiver.bind(bind)
+            self.receiver.setblocking(False)
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if target is not None else None
+
+    def write(self, message):
+        data = encode(message)
+        self.sender.sendto(data, self.target)
+        self.stats.bytes += len(data)
+
+    def poll(self):
+        while True:
+            try:
+                data = self.receiver.recv(65536)
+            except BlockingIOError:
+                return
+            self.apply(decode(data))
+
+    def close(self):
+        for sock in (self.receiver, self.sender):
+            if sock is not None:
+                sock.close()
+
+
+# JSON to the Flask endpoint of simulation.py over one keep-alive connection,
+# the server applies the messages (see receive_future_path), so poll() has nothing to do.
+# One blocking POST per message: only for trying the endpoint, the control loop
+# waits for every pedestrian's round trip.
+class HTTPTransport(Transport):
+    def __init__(self, url, full_every=FULL_EVERY):
+        super().__init__(None, full_every)
+        import requests
+        self.url = url
+        self.session = requests.Session()
+
+    def write(self, message):
+        kind, pedestrian_id, epoch, version, sent_time = message[:5]
+        data = {"pedestrian_id": pedestrian_id, "epoch": epoch, "version": version, "time": sent_time}
+        if kind == FULL:
+            speed, start, path = message[5:]
+            data.update({"precomputed_path": path, "start": start, "speed": speed})
+        else:
+            data["start"] = message[5]
+        response = self.session.post(self.url, json=data)
+        self.stats.bytes += len(response.request.body or b"")
+        # the server answers after applying it, so the latency is send -> applied and acknowledged
+        status = response.json().get("status") if response.ok else None
+        if status == "success":
+            self.stats.received += 1
+            self.stats.latencies.append(time.perf_counter() - sent_time)
+        elif status == "stale":
+            self.stats.dropped += 1
+
+    def close(self):
+        self.session.close()
+
+
+# paths: the receiver side dict (control.precomputed_paths for the controller)
+# v2x: a V2XServer is started in a background thread for the transport
+# (transport.server, stopped by close())
+def make_transport(name, paths=None):
+    if name == "queue":
+        return QueueTransport(paths)
+    if name == "udp":
+        return UDPTransport(paths)
+    if name == "v2x":
+        from v2x_server import V2XServer, PathStore, V2XTransport
+        server = V2XServer(PathStore(paths), port=0).start_in_thread()
+        transport = V2XTransport(server.host, server.port)
+        transport.server = server
+        return transport
+    raise ValueError(f"unknown transport: {name}")
+
+
+if __name__ == "__main__":
+    # throughput / latency of the transports: every pedestrian sends once per
+    # frame, the receiver polls once per frame (like the control loop does)
+    from object import Pedestrian
+
+    parser = argparse.ArgumentParser(description="Benchmark the pedestrian path transports")
+    parser.add_argument("--transports", type=str, nargs="+", default=["queue", "udp"], help="Transports to measure")
+    parser.add_argument("--num_pedestrian", type=int, default=50, help="Number of pedestrians")
+    parser.add_argument("--frames", type=int, default=600, help="Number of frames")
+    args = parser.parse_args()
+
+    pedestrians = [Pedestrian(None, id=i) for i in range(args.num_pedestrian)]
+    for pedestrian in pedestrians:
+        pedestrian.case = pedestrian.pedestrian_id % 4
+        pedestrian.start_new_round()
+
+    # size of what the old per-frame POST sent (the whole remaining path as JSON)
+    import json
+    legacy_bytes = np.mean([len(json.dumps({"pedestrian_id": 0, "precomputed_path": pedestrian.path[index:], "speed": pedestrian.speed}))
+                            for pedestrian in pedestrians for index in range(len(pedestrian.path))])
+    print(f"legacy json post: {legacy_bytes:.1f} B/msg")
+
+    for name in args.transports:
+        transport = make_transport(name)
+        start_time = time.perf_counter()
+        for frame in range(args.frames):
+            for pedestrian in pedestrians:
+                if pedestrian.path_index >= len(pedestrian.path):
+                    pedestrian.start_new_round()
+                pedestrian.update()
+                transport.send(pedestrian.pedestrian_id, pedestrian.path, pedestrian.path_index, pedestrian.speed)
+            transport.poll()
+        elapsed = time.perf_counter() - start_time
+        transport.close()
+
+        summary = transport.stats.summary()
+        print(f"{name:6s} {summary['sent'] / elapsed:10.0f} msg/s  {args.frames / elapsed:8.1f} frames/s  "
+              f"{summary['bytes'] / max(summary['sent'], 1):6.1f} B/msg  "
+              f"latency p50 {summary.get('latency_p50_us', float('nan')):7.1f} us  "
+              f"p99 {summary.get('latency_p99_us', float('nan')):7.1f} us  dropped {summary['dropped']}")
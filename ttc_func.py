@@ -1,28 +1,98 @@
 # ttc_func.py
+import bisect
 import math
+import numpy as np
 from object import Car, Pedestrian
 
+# a path point is at the car's height when its y is within this many px of car.rect.y
+INTERSECTION_BAND = 9
+
 def get_distance(pos1, pos2):
     x1, y1 = pos1
     x2, y2 = pos2
     return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
 
-def find_intersection_point(car: Car, path):
-    for coord in path:
-        # print("hello, coord: " + str(coord[1] // 1) + "rect.y: " + str(car.rect.y))
+# Path stored as a NumPy array and split into runs where y only goes one way
+# (pedestrian paths are straight segments between waypoints, so there are only
+# a few). Inside a run the points within the car's band are one contiguous
+# slice, found with two binary searches, so the first intersection at or
+# after any step is O(runs * log n) instead of a scan over the path.
+class PathIndex:
+    def __init__(self, path, band=INTERSECTION_BAND):
+        self.points = np.asarray(path)
+        self.band = band
+        # (first step, last step, direction, y * direction of the run as a list,
+        # bisect on a list is much cheaper than numpy calls on arrays this small)
+        self.runs = []
+        if len(self.points) == 0:
+            return
+
+        y = self.points[:, 1]
+        direction = np.sign(np.diff(y))
+        moving = np.flatnonzero(direction)
+        # a new run starts at the point where y turns around (flat steps join the current run)
+        turns = moving[1:][direction[moving[1:]] != direction[moving[:-1]]]
+        starts = np.concatenate([[0], turns])
+        ends = np.concatenate([turns, [len(y) - 1]])
+        for start, end in zip(starts, ends):
+            run_direction = direction[start:end][direction[start:end] != 0]
+            run_direction = run_direction[0] if len(run_direction) else 1
+            self.runs.append((int(start), int(end), int(run_direction), (y[start:end + 1] * run_direction).tolist()))
+
+    def __len__(self):
+        return len(self.points)
+
+    # first step j >= start with -band < y_j - car_y < band, -1 if there is none
+    def first_hit(self, car_y, start=0):
+        for run_start, run_end, direction, keys in self.runs:
+            if run_end < start:
+                continue
+            low, high = sorted(((car_y - self.band) * direction, (car_y + self.band) * direction))
+            first = run_start + bisect.bisect_right(keys, low)
+            last = run_start + bisect.bisect_left(keys, high)  # exclusive
+            first = max(first, start)
+            if first < last:
+                return first
+        return -1
+
+    def point(self, step):
+        return tuple(self.points[step].tolist())
 
-        if -9 < coord[1] - car.rect.y and coord[1] - car.rect.y < 9:
-            return coord
+# first step j >= start of a path that is only searched once
+# (building a PathIndex only pays off when the same path is queried again)
+def first_hit(path, car_y, start=0, band=INTERSECTION_BAND):
+    if isinstance(path, PathIndex):
+        return path.first_hit(car_y, start)
 
-    return None
+    if isinstance(path, np.ndarray):
+        dy = path[start:, 1] - car_y
+        hits = np.flatnonzero((-band < dy) & (dy < band))
+        return start + int(hits[0]) if len(hits) else -1
+
+    for step in range(start, len(path)):
+        if -band < path[step][1] - car_y and path[step][1] - car_y < band:
+            return step
+    return -1
+
+def path_point(path, step):
+    if isinstance(path, PathIndex):
+        return path.point(step)
+    return tuple(path[step].tolist()) if isinstance(path, np.ndarray) else path[step]
+
+# path: list of points, (n, 2) array or PathIndex
+def find_intersection_point(car: Car, path, start=0):
+    step = first_hit(path, car.rect.y, start)
+    if step < 0:
+        return None
+    return path_point(path, step)
 
 def calculate_elapsed_time(d, v0, a, v_max):
     # Time to reach maximum speed
     t_acc = (v_max - v0) / a
-    
+
     # Distance covered to reach maximum speed
     d_acc = v0 * t_acc + 0.5 * a * t_acc**2
-    
+
     if d_acc >= d:
         # The car reaches the finish line while still accelerating
         discriminant = v0**2 + 2 * a * d
@@ -37,24 +107,58 @@ def calculate_elapsed_time(d, v0, a, v_max):
         t_total = t_acc + t_const
         return t_total
 
-def calculate_ttc(car: Car, pedestrian: Pedestrian, path):
-    pos = find_intersection_point(car, path)
+def calculate_elapsed_time_array(d, v0, a, v_max):
+    # calculate_elapsed_time for arrays of distances / speeds
+    t_acc = (v_max - v0) / a
+    d_acc = v0 * t_acc + 0.5 * a * t_acc**2
+    discriminant = np.maximum(v0**2 + 2 * a * d, 0)
+    t_still_accelerating = (-v0 + np.sqrt(discriminant)) / a
+    t_total = t_acc + (d - d_acc) / v_max
+    return np.where(d_acc >= d, t_still_accelerating, t_total)
+
+# path: list of points, (n, 2) array or PathIndex
+# start: step of the path the pedestrian is at
+# kinematics: kinematics.Kinematics, car_ttc is then the frames Car.update really
+# needs (instead of the continuous estimate of calculate_elapsed_time)
+def calculate_ttc(car: Car, pedestrian: Pedestrian, path, start=0, kinematics=None):
+    step = first_hit(path, car.rect.y, start)
 
     # ignore the pedestrians who would not collide w/ the car or is behide the car
-    if pos is None or pos[0] <= car.rect.x:
+    if step < 0:
+        return -1, -1, (-1, -1)
+    pos = path_point(path, step)
+    if pos[0] <= car.rect.x:
         return -1, -1, (-1, -1)
-    
-    # take acceleration & max speed into account
-    car_ttc = calculate_elapsed_time((pos[0] - car.rect.x), car.speed, car.acceleration, car.max_speed) 
 
-    
+    # take acceleration & max speed into account
+    if kinematics is not None:
+        car_ttc = kinematics.frames_to_reach(car.speed, pos[0] - car.rect.x)
+    else:
+        car_ttc = calculate_elapsed_time((pos[0] - car.rect.x), car.speed, car.acceleration, car.max_speed)
 
-    pedestrian_ttc = 0
-    for coord in path:
-        pedestrian_ttc += 1
-        if coord == pos:
-            break
+    # number of steps until the pedestrian stands on the intersection point
+    pedestrian_ttc = step - start + 1
 
     # print("CARTTC: ", car_ttc, "PEDESTRIAN_TTC: ", pedestrian_ttc)
     return car_ttc, pedestrian_ttc, pos
 
+# calculate_ttc for many pedestrians against the car in one call
+# indices: list of PathIndex, starts: step each pedestrian is at
+# returns arrays car_ttc, pedestrian_ttc (-1 where there is no conflict) and positions (N, 2)
+def calculate_ttc_many(car: Car, indices, starts=None, kinematics=None):
+    n = len(indices)
+    starts = np.zeros(n, dtype=int) if starts is None else np.asarray(starts)
+    steps = np.array([index.first_hit(car.rect.y, start) for index, start in zip(indices, starts)], dtype=int)
+    positions = np.full((n, 2), -1.0)
+    for i in np.flatnonzero(steps >= 0):
+        positions[i] = indices[i].points[steps[i]]
+
+    valid = (steps >= 0) & (positions[:, 0] > car.rect.x)
+    d = np.where(valid, positions[:, 0] - car.rect.x, 1.0)
+    if kinematics is not None:
+        car_ttc = np.where(valid, kinematics.frames_to_reach(car.speed, d), -1)
+    else:
+        car_ttc = np.where(valid, calculate_elapsed_time_array(d, car.speed, car.acceleration, car.max_speed), -1)
+    pedestrian_ttc = np.where(valid, steps - starts + 1, -1)
+    positions[~valid] = -1
+    return car_ttc, pedestrian_ttc, positions
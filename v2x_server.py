@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import socket
+import struct
+import threading
+import time
+import numpy as np
+from transport import Transport, TransportStats, FULL, INDEX, FULL_EVERY, HEADER, FULL_BODY, INDEX_BODY, encode, new_epoch
+
+# A batch carries the updates of many pedestrians (usually one batch per frame):
+#   u32 payload length | u16 count | count x (u16 message length | message)
+# where every message is a transport.encode() FULL / INDEX message.
+BATCH_HEADER = struct.Struct("<IH")
+MESSAGE_LENGTH = struct.Struct("<H")
+
+# a larger declared batch length is not a batch, the connection is closed
+MAX_BATCH_BYTES = 1 << 24
+
+V2X_HOST, V2X_PORT = "127.0.0.1", 5006
+
+
+def encode_batch(messages):
+    parts = [MESSAGE_LENGTH.pack(len(message)) + message for message in messages]
+    payload = b"".join(parts)
+    return BATCH_HEADER.pack(len(payload) + 2, len(parts)) + payload
+
+
+# payload without the u32 length: u16 count followed by the messages
+# (struct.error / ValueError if the messages do not fill exactly the payload)
+def split_batch(payload):
+    (count,) = MESSAGE_LENGTH.unpack_from(payload)
+    offset = MESSAGE_LENGTH.size
+    messages = []
+    for _ in range(count):
+        (length,) = MESSAGE_LENGTH.unpack_from(payload, offset)
+        offset += MESSAGE_LENGTH.size
+        if offset + length > len(payload):
+            raise ValueError(f"message of {length} bytes past the end of a {len(payload)} byte batch")
+        messages.append(payload[offset:offset + length])
+        offset += length
+    if offset != len(payload):
+        raise ValueError(f"{len(payload) - offset} bytes after the {count} messages of a batch")
+    return messages
+
+
+# header and body of a FULL / INDEX message, checked against its size
+# (struct.error / ValueError for anything else)
+def unpack_message(data):
+    kind, pedestrian_id, epoch, version, sent_time = HEADER.unpack_from(data)
+    if kind == FULL:
+        body = FULL_BODY.unpack_from(data, HEADER.size)
+        size = HEADER.size + FULL_BODY.size + 8 * body[2]
+    elif kind == INDEX:
+        body = INDEX_BODY.unpack_from(data, HEADER.size)
+        size = HEADER.size + INDEX_BODY.size
+    else:
+        raise ValueError(f"unknown message kind {kind}")
+    if len(data) != size:
+        raise ValueError(f"message of {len(data)} bytes, its header says {size}")
+    return kind, pedestrian_id, epoch, version, sent_time, body
+
+
+# Latest path of every pedestrian, entries have the control.precomputed_paths layout
+# with the path kept as an (n, 2) int32 array:
+#   {"precomputed_path": array, "start", "speed", "epoch", "version", "time", "received"}
+# An update is applied only if it is newer than what is stored: a later sender
+# epoch (a restarted sender, see transport.py), a higher path version, or the
+# same version with a later send time. Anything else is stale (reordered,
+# duplicated, or from a sender that has been restarted since) and dropped. So is a malformed message or batch
+# (counted in malformed as well), it never takes the connection down.
+class PathStore:
+    def __init__(self, paths=None):
+        self.paths = {} if paths is None else paths
+        self.stats = TransportStats()
+        self.malformed = 0
+
+    def drop_malformed(self):
+        self.malformed += 1
+        self.stats.dropped += 1
+
+    def apply(self, data):
+        try:
+            kind, pedestrian_id, epoch, version, sent_time, body = unpack_message(data)
+        except (struct.error, ValueError):
+            self.drop_malformed()
+            return False
+        entry = self.paths.get(pedestrian_id)
+        received = time.perf_counter()
+
+        if kind == FULL:
+            if entry is not None and (entry["epoch"], entry["version"], entry["time"]) >= (epoch, version, sent_time):
+                self.stats.dropped += 1
+                return False
+            speed, start, n = body
+            path = np.frombuffer(data, dtype=np.int32, count=2 * n, offset=HEADER.size + FULL_BODY.size).reshape(-1, 2).copy()
+            self.paths[pedestrian_id] = {"precomputed_path": path, "start": start, "speed": speed,
+                                         "epoch": epoch, "version": version, "time": sent_time, "received": received}
+        else:
+            if entry is None or entry["epoch"] != epoch or entry["version"] != version or entry["time"] >= sent_time:
+                self.stats.dropped += 1
+                return False
+            (start,) = body
+            entry["start"] = start
+            entry["time"] = sent_time
+            entry["received"] = received
+
+        self.stats.received += 1
+        self.stats.latencies.append(received - sent_time)
+        return True
+
+    def apply_batch(self, payload):
+        self.stats.bytes += len(payload) + 4
+        try:
+            messages = split_batch(payload)
+        except (struct.error, ValueError):
+            # the message boundaries are lost, none of it is applied
+            self.drop_malformed()
+            return 0
+        applied = 0
+        for message in messages:
+            applied += self.apply(message)
+        return applied
+
+
+# asyncio TCP server, every connection streams batches into the same PathStore
+class V2XServer:
+    def __init__(self, store: PathStore, host=V2X_HOST, port=V2X_PORT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.batches = 0
+        self.server = None
+        self.loop = None
+        self.handlers = set()  # (task, writer) of the open connections
+
+    async def handle(self, reader, writer):
+        handler = (asyncio.current_task(), writer)
+        self.handlers.add(handler)
+        try:
+            while True:
+                (length,) = struct.unpack("<I", await reader.readexactly(4))
+                if length > MAX_BATCH_BYTES:
+                    # not a batch, the stream cannot be resynchronized
+                    self.store.drop_malformed()
+                    break
+                payload = await reader.readexactly(length)
+                self.store.apply_batch(payload)
+                self.batches += 1
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.discard(handler)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    # run the event loop in a daemon thread (next to the pygame / headless loop)
+    def start_in_thread(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    # stop listening and end the open connections (on the server's loop): closing
+    # a connection ends its handler at the next read like a client hanging up
+    async def shutdown(self):
+        self.server.close()
+        handlers = list(self.handlers)
+        for _, writer in handlers:
+            writer.close()
+        if handlers:
+            await asyncio.wait([task for task, _ in handlers])
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# sender side: collects the messages of one frame and ships them as one batch
+# over a persistent TCP connection when flush() is called
+class V2XTransport(Transport):
+    def __init__(self, host=V2X_HOST, port=V2X_PORT, full_every=FULL_EVERY):
+        super().__init__(None, full_every)
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending = []
+        # V2XServer started for this transport (make_transport), stopped on close
+        self.server = None
+
+    def write(self, message):
+        self.pending.append(encode(message))
+
+    def flush(self):
+        if self.pending:
+            data = encode_batch(self.pending)
+            self.socket.sendall(data)
+            self.stats.bytes += len(data)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.socket.close()
+        if self.server is not None:
+            self.server.stop()
+
+
+# local load generator: `clients` connections, each streaming `batches` batches
+# of updates for its own `pedestrians` pedestrians as fast as it can
+async def generate_load(host, port, clients, pedestrians, batches, path_length=100):
+    path = np.stack([np.full(path_length, 650), np.arange(path_length) * 9], axis=1)
+
+    async def client(client_id):
+        reader, writer = await asyncio.open_connection(host, port)
+        epoch = new_epoch()
+        ids = range(client_id * pedestrians, (client_id + 1) * pedestrians)
+        for batch in range(batches):
+            messages = []
+            for pedestrian_id in ids:
+                version = batch // path_length
+                start = batch % path_length
+                if start == 0:
+                    messages.append(encode((FULL, pedestrian_id, epoch, version, time.perf_counter(), 9.0, start, path)))
+                else:
+                    messages.append(encode((INDEX, pedestrian_id, epoch, version, time.perf_counter(), start)))
+            writer.write(encode_batch(messages))
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+
+
+async def load_test(clients, pedestrians, batches):
+    store = PathStore()
+    server = await V2XServer(store, port=0).start()
+    expected = clients * pedestrians * batches
+
+    start = time.perf_counter()
+    await generate_load(server.host, server.port, clients, pedestrians, batches)
+    while store.stats.received + store.stats.dropped < expected:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    server.server.close()
+
+    summary = store.stats.summary()
+    print(f"{clients} clients x {pedestrians} pedestrians x {batches} batches")
+    print(f"{expected / elapsed:.0f} updates/s, {server.batches / elapsed:.0f} batches/s, "
+          f"applied {summary['received']}, dropped {summary['dropped']}, "
+          f"latency p50 {summary['latency_p50_us']:.0f} us p99 {summary['latency_p99_us']:.0f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched V2X ingestion server for pedestrian paths")
+    parser.add_argument("--serve", action="store_true", help="Run the server until interrupted")
+    parser.add_argument("--port", type=int, default=V2X_PORT, help="Port to listen on")
+    parser.add_argument("--clients", type=int, default=4, help="Load test: number of connections")
+    parser.add_argument("--pedestrians", type=int, default=50, help="Load test: pedestrians per connection")
+    parser.add_argument("--batches", type=int, default=600, help="Load test: batches per connection")
+    args = parser.parse_args()
+
+    if args.serve:
+        server = V2XServer(PathStore(), port=args.port).start_in_thread()
+        print(f"listening on {server.host}:{server.port}")
+        try:
+            while True:
+                time.sleep(5)
+                print(server.store.stats.summary())
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        asyncio.run(load_test(args.clients, args.pedestrians, args.batches))